@@ -0,0 +1,177 @@
+import logging
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pydantic
+
+from stopcovid.dialog.command_stream.broadcast import (
+    BroadcastAdHocMessage,
+    BroadcastError,
+    BroadcastFanOut,
+    BroadcastProgress,
+    BroadcastProgressRepository,
+)
+
+
+@patch("stopcovid.dialog.command_stream.broadcast.increment")
+class TestBroadcastFanOut(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.publisher = MagicMock()
+        self.publisher.publish_ad_hoc_message_commands.return_value = []
+        self.progress_repo = MagicMock()
+        self.saved = []
+        self.progress_repo.save_progress.side_effect = lambda progress: self.saved.append(
+            progress.copy()
+        )
+        self.progress_repo.fetch_progress.side_effect = lambda broadcast_id: BroadcastProgress(
+            broadcast_id=broadcast_id
+        )
+        self.dialog_repo = MagicMock()
+        self.fan_out = BroadcastFanOut(self.publisher, self.progress_repo, self.dialog_repo)
+        self.fan_out.max_records_per_second = 1e9
+
+    def _published(self):
+        return [
+            phone_number
+            for call in self.publisher.publish_ad_hoc_message_commands.call_args_list
+            for phone_number in call[0][0]
+        ]
+
+    def test_requires_exactly_one_recipient_source(self, increment_mock):
+        with self.assertRaises(pydantic.ValidationError):
+            BroadcastAdHocMessage(broadcast_id="b", message="hi")
+        with self.assertRaises(pydantic.ValidationError):
+            BroadcastAdHocMessage(broadcast_id="b", message="hi", phone_numbers=[], employer_id=1)
+
+    def test_phone_numbers_published_in_chunks(self, increment_mock):
+        phone_numbers = [f"+1555{i:07d}" for i in range(1200)]
+        broadcast = BroadcastAdHocMessage(
+            broadcast_id="b", message="hi", media_url="https://x", phone_numbers=phone_numbers
+        )
+        progress = self.fan_out.fan_out(broadcast)
+        self.assertTrue(progress.complete)
+        self.assertEqual(1200, progress.published)
+        self.assertEqual(phone_numbers, self._published())
+        self.assertEqual(3, self.publisher.publish_ad_hoc_message_commands.call_count)
+        self.publisher.publish_ad_hoc_message_commands.assert_called_with(
+            phone_numbers[1000:], "hi", "https://x"
+        )
+        self.assertEqual([500, 1000, 1200, 1200], [p.published for p in self.saved])
+        self.publisher.publish_broadcast_command.assert_not_called()
+
+    def test_account_broadcast_scans_pages(self, increment_mock):
+        self.dialog_repo.scan_phone_numbers_for_account.side_effect = [
+            (["1", "2"], {"phone_number": {"S": "2"}}),
+            (["3"], None),
+        ]
+        broadcast = BroadcastAdHocMessage(broadcast_id="b", message="hi", employer_id=1, unit_id=2)
+        progress = self.fan_out.fan_out(broadcast)
+        self.assertTrue(progress.complete)
+        self.assertEqual(["1", "2", "3"], self._published())
+        self.dialog_repo.scan_phone_numbers_for_account.assert_called_with(
+            1, 2, {"phone_number": {"S": "2"}}
+        )
+
+    def test_resumes_from_progress(self, increment_mock):
+        self.progress_repo.fetch_progress.side_effect = None
+        self.progress_repo.fetch_progress.return_value = BroadcastProgress(
+            broadcast_id="b", published=3, page_key={"phone_number": {"S": "2"}}, offset=1
+        )
+        self.dialog_repo.scan_phone_numbers_for_account.return_value = (["3", "4"], None)
+        broadcast = BroadcastAdHocMessage(broadcast_id="b", message="hi", employer_id=1)
+        progress = self.fan_out.fan_out(broadcast)
+        self.assertEqual(["4"], self._published())
+        self.assertEqual(4, progress.published)
+        self.dialog_repo.scan_phone_numbers_for_account.assert_called_once_with(
+            1, None, {"phone_number": {"S": "2"}}
+        )
+
+    def test_complete_broadcast_is_skipped(self, increment_mock):
+        self.progress_repo.fetch_progress.side_effect = None
+        self.progress_repo.fetch_progress.return_value = BroadcastProgress(
+            broadcast_id="b", complete=True
+        )
+        self.fan_out.fan_out(BroadcastAdHocMessage(broadcast_id="b", message="hi", employer_id=1))
+        self.publisher.publish_ad_hoc_message_commands.assert_not_called()
+        self.progress_repo.save_progress.assert_not_called()
+
+    def test_continues_when_out_of_time(self, increment_mock):
+        self.fan_out.time_budget_seconds = 0
+        broadcast = BroadcastAdHocMessage(broadcast_id="b", message="hi", phone_numbers=["1"])
+        progress = self.fan_out.fan_out(broadcast)
+        self.assertFalse(progress.complete)
+        self.publisher.publish_ad_hoc_message_commands.assert_not_called()
+        self.publisher.publish_broadcast_command.assert_called_once()
+        broadcast_id, payload = self.publisher.publish_broadcast_command.call_args[0]
+        self.assertEqual("b", broadcast_id)
+        self.assertEqual(
+            broadcast.copy(update={"continuation": 1}), BroadcastAdHocMessage(**payload)
+        )
+        self.assertEqual(1, progress.continuation)
+        self.assertEqual(1, self.saved[-1].continuation)
+
+    def test_time_budget_from_remaining_time(self, increment_mock):
+        broadcast = BroadcastAdHocMessage(broadcast_id="b", message="hi", phone_numbers=["1"])
+        # nothing left after the reserve
+        progress = self.fan_out.fan_out(broadcast, lambda: 1000)
+        self.assertFalse(progress.complete)
+        self.publisher.publish_ad_hoc_message_commands.assert_not_called()
+        self.progress_repo.fetch_progress.side_effect = None
+        self.progress_repo.fetch_progress.return_value = BroadcastProgress(broadcast_id="b")
+        self.fan_out.time_budget_seconds = 0
+        progress = self.fan_out.fan_out(broadcast, lambda: 10000)
+        self.assertTrue(progress.complete)
+
+    def test_stale_continuation_is_skipped(self, increment_mock):
+        # e.g. the first command of a broadcast, redelivered because its batch was retried
+        # after the fan-out had published a continuation
+        self.progress_repo.fetch_progress.side_effect = None
+        self.progress_repo.fetch_progress.return_value = BroadcastProgress(
+            broadcast_id="b", published=500, offset=500, continuation=1
+        )
+        broadcast = BroadcastAdHocMessage(broadcast_id="b", message="hi", phone_numbers=["1"])
+        progress = self.fan_out.fan_out(broadcast)
+        self.assertFalse(progress.complete)
+        self.publisher.publish_ad_hoc_message_commands.assert_not_called()
+        self.publisher.publish_broadcast_command.assert_not_called()
+        self.progress_repo.save_progress.assert_not_called()
+        self.fan_out.fan_out(broadcast.copy(update={"continuation": 1}))
+        self.publisher.publish_ad_hoc_message_commands.assert_not_called()
+        self.assertTrue(self.saved[-1].complete)
+
+    def test_publish_failure_does_not_record_progress(self, increment_mock):
+        self.publisher.publish_ad_hoc_message_commands.return_value = [("1", {})]
+        broadcast = BroadcastAdHocMessage(broadcast_id="b", message="hi", phone_numbers=["1"])
+        with self.assertRaises(BroadcastError):
+            self.fan_out.fan_out(broadcast)
+        self.progress_repo.save_progress.assert_not_called()
+
+
+class TestBroadcastProgressRepository(unittest.TestCase):
+    """
+    requires local dynamoDB to be running: docker-compose up in the dynamodb_local directory
+    """
+
+    def setUp(self) -> None:
+        os.environ["STAGE"] = "test"
+        self.repo = BroadcastProgressRepository(
+            region_name="us-west-2",
+            endpoint_url="http://localhost:9000",
+            aws_access_key_id="fake-key",
+            aws_secret_access_key="fake-secret",
+        )
+        self.repo.drop_and_recreate_table()
+
+    def test_save_and_fetch(self):
+        self.assertEqual(BroadcastProgress(broadcast_id="b"), self.repo.fetch_progress("b"))
+        progress = BroadcastProgress(
+            broadcast_id="b",
+            published=700,
+            page_key={"phone_number": {"S": "+15551234567"}},
+            offset=200,
+            continuation=2,
+        )
+        self.repo.save_progress(progress)
+        self.assertEqual(progress, self.repo.fetch_progress("b"))
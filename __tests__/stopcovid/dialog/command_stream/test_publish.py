@@ -1,8 +1,12 @@
+import json
 import logging
 import unittest
+import uuid
 from unittest.mock import patch, MagicMock
 
 from stopcovid.dialog.command_stream.publish import CommandPublisher
+from stopcovid.drills.bundle import get_drill_loader
+from stopcovid.drills.drills import Drill
 
 
 class TestCommandPublisher(unittest.TestCase):
@@ -36,3 +40,73 @@ class TestCommandPublisher(unittest.TestCase):
         self.command_publisher.publish_process_sms_command("123456789", "lol", {"foo": "bar"})
         put_records_mock.assert_called_once()
         rollbar_mock.report_exc_info.assert_called_once_with(extra_data=kinesis_response)
+
+    def test_publish_commands_chunks_to_put_records_limit(self):
+        self.put_records_mock.return_value = {"FailedRecordCount": 0}
+        phone_numbers = [f"+1555{i:07d}" for i in range(1201)]
+        failed = self.command_publisher.publish_ad_hoc_message_commands(phone_numbers, "hi")
+        self.assertEqual([], failed)
+        self.assertEqual(
+            [500, 500, 201],
+            [len(call[1]["Records"]) for call in self.put_records_mock.call_args_list],
+        )
+
+    def test_publish_commands_chunks_to_put_records_byte_limit(self):
+        self.put_records_mock.return_value = {"FailedRecordCount": 0}
+        # just under 1 MB each, so at most 5 fit in 5 MB
+        failed = self.command_publisher.publish_ad_hoc_message_commands(
+            [str(i) for i in range(12)], "a" * 1_000_000
+        )
+        self.assertEqual([], failed)
+        self.assertEqual(
+            [5, 5, 2], [len(call[1]["Records"]) for call in self.put_records_mock.call_args_list]
+        )
+
+    @patch("stopcovid.dialog.command_stream.publish.time.sleep")
+    def test_publish_commands_retries_only_failed_records(self, sleep_mock):
+        self.put_records_mock.side_effect = [
+            {
+                "FailedRecordCount": 1,
+                "Records": [{"SequenceNumber": "1"}, {"ErrorCode": "Throttled"}, {}],
+            },
+            {"FailedRecordCount": 0},
+        ]
+        failed = self.command_publisher.publish_ad_hoc_message_commands(["1", "2", "3"], "hi")
+        self.assertEqual([], failed)
+        retried = self.put_records_mock.call_args_list[1][1]["Records"]
+        self.assertEqual(["2"], [record["PartitionKey"] for record in retried])
+
+    @patch("stopcovid.dialog.command_stream.publish.rollbar")
+    @patch("stopcovid.dialog.command_stream.publish.time.sleep")
+    def test_publish_commands_returns_records_that_keep_failing(self, sleep_mock, rollbar_mock):
+        self.put_records_mock.side_effect = lambda StreamName, Records: {
+            "FailedRecordCount": 1,
+            "Records": [
+                {"ErrorCode": "Throttled"} if record["PartitionKey"] == "2" else {}
+                for record in Records
+            ],
+        }
+        failed = self.command_publisher.publish_ad_hoc_message_commands(["1", "2"], "hi")
+        self.assertEqual(["2"], [phone_number for phone_number, _ in failed])
+        self.assertEqual(3, self.put_records_mock.call_count)
+        rollbar_mock.report_exc_info.assert_called_once()
+
+    def test_publish_start_drill_commands(self):
+        self.put_records_mock.return_value = {"FailedRecordCount": 0}
+        drill_instance_id = uuid.uuid4()
+        self.command_publisher.publish_start_drill_commands(
+            [
+                ("1", "01-sample-drill-en", drill_instance_id),
+                ("2", "01-sample-drill-en", uuid.uuid4()),
+            ]
+        )
+        records = self.put_records_mock.call_args[1]["Records"]
+        self.assertEqual(["1", "2"], [record["PartitionKey"] for record in records])
+        command = json.loads(records[0]["Data"])
+        self.assertEqual("START_DRILL", command["type"])
+        self.assertEqual(str(drill_instance_id), command["payload"]["drill_instance_id"])
+        self.assertEqual("01-sample-drill-en", command["payload"]["drill_slug"])
+        self.assertEqual(
+            get_drill_loader().get_drill("01-sample-drill-en"),
+            Drill(**command["payload"]["drill_body"]),
+        )
@@ -0,0 +1,225 @@
+import datetime
+import json
+import logging
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from stopcovid.dialog.command_stream.scheduled_commands import (
+    DRAIN_LOOKBACK_SLOTS,
+    MAX_DRAIN_SLOTS,
+    SHARDS,
+    SLOT_SECONDS,
+    ScheduledCommand,
+    ScheduledCommandRepository,
+    cancel_command,
+    drain_due_commands,
+    schedule_command,
+    shard_for,
+    slot_key,
+)
+
+
+class TestScheduleCommand(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dynamodb = MagicMock()
+        get_client_patch = patch(
+            "stopcovid.dialog.command_stream.scheduled_commands.get_boto3_client",
+            return_value=self.dynamodb,
+        )
+        get_client_patch.start()
+        self.addCleanup(get_client_patch.stop)
+        self.repo = ScheduledCommandRepository()
+        self.command = {"type": "SEND_AD_HOC_MESSAGE", "payload": {"phone_number": "123"}}
+
+    def test_schedule_is_one_write_to_the_slot_and_shard(self):
+        fire_at = datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(hours=1)
+        scheduled = schedule_command("123", self.command, fire_at, "timer-1", self.repo)
+        self.dynamodb.put_item.assert_called_once()
+        item = self.dynamodb.put_item.call_args[1]["Item"]
+        slot = int(fire_at.timestamp()) // SLOT_SECONDS * SLOT_SECONDS
+        self.assertEqual(slot_key(slot, shard_for("timer-1")), item["slot_key"]["S"])
+        self.assertEqual("timer-1", item["timer_id"]["S"])
+        self.assertEqual(self.command, json.loads(item["command"]["S"]))
+        self.assertEqual(int(fire_at.timestamp()), scheduled.fire_ts)
+
+    def test_past_timers_fire_on_next_tick(self):
+        fire_at = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        scheduled = schedule_command("123", self.command, fire_at, repo=self.repo)
+        self.assertGreater(scheduled.fire_ts, fire_at.timestamp())
+
+    def test_shards_are_stable_and_spread(self):
+        self.assertEqual(shard_for("timer-1"), shard_for("timer-1"))
+        self.assertEqual(SHARDS, len({shard_for(f"timer-{i}") for i in range(100)}))
+
+    def test_fetch_slot_round_trips(self):
+        scheduled = ScheduledCommand(
+            timer_id="timer-1", fire_ts=1588341630, partition_key="123", command=self.command
+        )
+        self.repo.save(scheduled)
+        item = self.dynamodb.put_item.call_args[1]["Item"]
+        self.dynamodb.query.return_value = {"Items": [item]}
+        self.assertEqual([scheduled], self.repo.fetch_slot(1588341600, 0, 1588341640))
+        kwargs = self.dynamodb.query.call_args[1]
+        self.assertEqual("by_slot", kwargs["IndexName"])
+        self.assertEqual(
+            "slot_key = :slot_key AND fire_ts <= :fire_before", kwargs["KeyConditionExpression"]
+        )
+
+    def test_rescheduling_replaces_the_timer(self):
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        schedule_command("123", self.command, now + datetime.timedelta(hours=1), "t", self.repo)
+        schedule_command("123", self.command, now + datetime.timedelta(hours=2), "t", self.repo)
+        keys = [
+            {"timer_id": call[1]["Item"]["timer_id"]}
+            for call in self.dynamodb.put_item.call_args_list
+        ]
+        self.assertEqual([{"timer_id": {"S": "t"}}] * 2, keys)
+
+    def test_cancel_deletes_by_timer(self):
+        cancel_command("timer-1", self.repo)
+        self.assertEqual(
+            {"timer_id": {"S": "timer-1"}}, self.dynamodb.delete_item.call_args[1]["Key"]
+        )
+
+    def test_fired_timer_rescheduled_since_it_was_read_is_kept(self):
+        scheduled = ScheduledCommand(
+            timer_id="timer-1", fire_ts=1588341630, partition_key="123", command=self.command
+        )
+        self.dynamodb.delete_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "DeleteItem"
+        )
+        self.repo.delete_all([scheduled])
+        kwargs = self.dynamodb.delete_item.call_args[1]
+        self.assertEqual({"timer_id": {"S": "timer-1"}}, kwargs["Key"])
+        self.assertEqual({"N": "1588341630"}, kwargs["ExpressionAttributeValues"][":fire_ts"])
+
+
+@patch("stopcovid.dialog.command_stream.scheduled_commands.increment")
+class TestDrainDueCommands(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.now = 1588341600 + 30
+        self.current_slot = 1588341600
+        self.slots = {}
+        self.repo = MagicMock()
+        self.repo.fetch_slot.side_effect = lambda slot, shard, fire_before: [
+            command
+            for command in self.slots.get((slot, shard), [])
+            if command.fire_ts <= fire_before
+        ]
+        self.publisher = MagicMock()
+        self.publisher.publish_commands.return_value = []
+        self.watermark_repo = MagicMock()
+        self.watermark_repo.fetch_watermark.return_value = None
+
+    def _drain(self):
+        return drain_due_commands(self.now, self.repo, self.publisher, self.watermark_repo)
+
+    def _slots_read(self):
+        return sorted({call[0][0] for call in self.repo.fetch_slot.call_args_list})
+
+    def _scheduled(self, timer_id, fire_ts):
+        return ScheduledCommand(
+            timer_id=timer_id,
+            fire_ts=fire_ts,
+            partition_key=timer_id,
+            command={"type": "SEND_AD_HOC_MESSAGE", "payload": {"timer": timer_id}},
+        )
+
+    def test_publishes_due_commands_in_fire_order(self, increment_mock):
+        late = self._scheduled("late", self.current_slot - 3 * SLOT_SECONDS)
+        due = self._scheduled("due", self.current_slot + 10)
+        not_yet = self._scheduled("not-yet", self.current_slot + 45)
+        self.slots = {
+            (self.current_slot, 1): [due, not_yet],
+            (self.current_slot - 3 * SLOT_SECONDS, 5): [late],
+        }
+        self.assertEqual(2, self._drain())
+        self.publisher.publish_commands.assert_called_once_with(
+            [("late", late.command), ("due", due.command)]
+        )
+        self.repo.delete_all.assert_called_once_with([late, due])
+        self.assertEqual((DRAIN_LOOKBACK_SLOTS + 1) * SHARDS, self.repo.fetch_slot.call_count)
+        self.watermark_repo.save_watermark.assert_called_once_with(
+            "scheduled-commands", self.current_slot
+        )
+
+    def test_drains_from_watermark(self, increment_mock):
+        # the last tick was two hours ago, longer than the first tick looks back
+        watermark = self.current_slot - 120 * SLOT_SECONDS
+        self.watermark_repo.fetch_watermark.return_value = watermark
+        overdue = self._scheduled("overdue", watermark + 5)
+        self.slots = {(watermark, 3): [overdue]}
+        self.assertEqual(1, self._drain())
+        self.assertEqual(
+            list(range(watermark, self.current_slot + 1, SLOT_SECONDS)), self._slots_read()
+        )
+
+    def test_drain_after_long_outage_is_bounded(self, increment_mock):
+        self.watermark_repo.fetch_watermark.return_value = self.current_slot - 86400 * 7
+        self._drain()
+        self.assertEqual(MAX_DRAIN_SLOTS + 1, len(self._slots_read()))
+
+    def test_failed_commands_stay_scheduled(self, increment_mock):
+        first = self._scheduled("first", self.current_slot)
+        second = self._scheduled("second", self.current_slot + 1)
+        self.slots = {(self.current_slot, 0): [first, second]}
+        self.publisher.publish_commands.side_effect = lambda commands: commands[1:]
+        self.assertEqual(1, self._drain())
+        self.repo.delete_all.assert_called_once_with([first])
+        # the next tick tries it again
+        self.watermark_repo.save_watermark.assert_not_called()
+
+    def test_nothing_due(self, increment_mock):
+        self.assertEqual(0, self._drain())
+        self.publisher.publish_commands.assert_not_called()
+        self.watermark_repo.save_watermark.assert_called_once_with(
+            "scheduled-commands", self.current_slot
+        )
+
+
+class TestScheduledCommandPersistence(unittest.TestCase):
+    """
+    requires local dynamoDB to be running: docker-compose up in the dynamodb_local directory
+    """
+
+    def setUp(self) -> None:
+        os.environ["STAGE"] = "test"
+        self.repo = ScheduledCommandRepository(
+            region_name="us-west-2",
+            endpoint_url="http://localhost:9000",
+            aws_access_key_id="fake-key",
+            aws_secret_access_key="fake-secret",
+        )
+        self.repo.drop_and_recreate_table()
+        self.command = {"type": "SEND_AD_HOC_MESSAGE", "payload": {"phone_number": "123"}}
+
+    def _fetch_all(self, fire_ts):
+        slot = fire_ts // SLOT_SECONDS * SLOT_SECONDS
+        return [
+            scheduled
+            for shard in range(SHARDS)
+            for scheduled in self.repo.fetch_slot(slot, shard, fire_ts)
+        ]
+
+    def test_reschedule_and_cancel(self):
+        first = ScheduledCommand(
+            timer_id="timer-1", fire_ts=1588341630, partition_key="123", command=self.command
+        )
+        self.repo.save(first)
+        self.assertEqual([first], self._fetch_all(1588341630))
+
+        rescheduled = first.copy(update={"fire_ts": 1588345230})
+        self.repo.save(rescheduled)
+        self.assertEqual([], self._fetch_all(1588341630))
+        self.assertEqual([rescheduled], self._fetch_all(1588345230))
+
+        # the earlier version fired, but the timer has moved on since
+        self.repo.delete_all([first])
+        self.assertEqual([rescheduled], self._fetch_all(1588345230))
+
+        self.repo.delete("timer-1")
+        self.assertEqual([], self._fetch_all(1588345230))
@@ -23,6 +23,7 @@ from stopcovid.dialog.models.events import (
     SupportRequested,
     ThankYouReceived,
     UserUpdated,
+    ReminderTriggered,
 )
 from stopcovid.dialog.models.state import UserProfile, DialogState, PromptState
 from stopcovid.dialog.registration import CodeValidationPayload
@@ -274,6 +275,30 @@ class TestAdvancedToNextPrompt(unittest.TestCase):
         )
 
 
+class TestReminderTriggered(unittest.TestCase):
+    def test_reminder_triggered(self):
+        profile = UserProfile(validated=True)
+        event = ReminderTriggered(
+            phone_number="123456789",
+            user_profile=profile,
+            prompt=DRILL.prompts[1],
+            drill_instance_id=uuid.uuid4(),
+        )
+        dialog_state = DialogState(
+            phone_number="123456789",
+            seq="0",
+            user_profile=profile,
+            current_drill=DRILL,
+            drill_instance_id=event.drill_instance_id,
+            current_prompt_state=PromptState(slug=DRILL.prompts[1].slug, start_time=NOW),
+        )
+        event.apply_to(dialog_state)
+        self.assertEqual(
+            PromptState(slug=DRILL.prompts[1].slug, start_time=NOW, reminder_triggered=True),
+            dialog_state.current_prompt_state,
+        )
+
+
 class TestDrillCompleted(unittest.TestCase):
     def test_drill_completed(self):
         profile = UserProfile(validated=False)
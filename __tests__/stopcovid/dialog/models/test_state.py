@@ -1,7 +1,13 @@
+import datetime
 import json
 import unittest
 
-from stopcovid.dialog.models.state import UserProfile
+from stopcovid.dialog.models.state import (
+    REMINDER_DELAY,
+    DialogState,
+    PromptState,
+    UserProfile,
+)
 
 
 class TestUserProfileSerialization(unittest.TestCase):
@@ -18,3 +24,30 @@ class TestUserProfileSerialization(unittest.TestCase):
         serialized = profile.json()
         deserialized = UserProfile(**json.loads(serialized))
         self.assertIsNone(deserialized.language)
+
+
+class TestReminderDueTime(unittest.TestCase):
+    def setUp(self) -> None:
+        self.start = datetime.datetime(2020, 5, 1, 14, tzinfo=datetime.timezone.utc)
+        self.dialog_state = DialogState(
+            phone_number="123456789",
+            seq="0",
+            user_profile=UserProfile(validated=True),
+            current_prompt_state=PromptState(slug="prompt", start_time=self.start),
+        )
+
+    def test_due_after_prompt_start(self):
+        self.assertEqual(self.start + REMINDER_DELAY, self.dialog_state.reminder_due_time())
+
+    def test_due_after_last_response(self):
+        assert self.dialog_state.current_prompt_state
+        last_response = self.start + datetime.timedelta(minutes=5)
+        self.dialog_state.current_prompt_state.last_response_time = last_response
+        self.assertEqual(last_response + REMINDER_DELAY, self.dialog_state.reminder_due_time())
+
+    def test_not_due(self):
+        assert self.dialog_state.current_prompt_state
+        self.dialog_state.current_prompt_state.reminder_triggered = True
+        self.assertIsNone(self.dialog_state.reminder_due_time())
+        self.dialog_state.current_prompt_state = None
+        self.assertIsNone(self.dialog_state.reminder_due_time())
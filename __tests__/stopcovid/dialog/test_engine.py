@@ -12,6 +12,8 @@ from stopcovid.dialog.engine import (
     StartDrill,
     SendAdHocMessage,
     UpdateUser,
+    TriggerReminder,
+    prefetch_registration_codes,
 )
 from stopcovid.dialog.models.events import (
     DialogEventBatch,
@@ -22,7 +24,7 @@ from stopcovid.dialog.models.events import (
     FailedPrompt,
     DrillCompleted,
 )
-from stopcovid.dialog.models.state import DialogState, PromptState, AccountInfo
+from stopcovid.dialog.models.state import DialogState, PromptState, AccountInfo, UserProfile
 
 from stopcovid.dialog.registration import CodeValidationPayload
 from stopcovid.drills.drills import Drill, Prompt, PromptMessage
@@ -649,3 +651,74 @@ class TestProcessCommand(unittest.TestCase):
         self.assertEqual(self.dialog_state.user_profile.name, name)
         self.assertEqual(self.dialog_state.user_profile.account_info.unit_id, unit_id)
         self.assertEqual(self.dialog_state.user_profile.account_info.employer_id, employer_id)
+
+    def test_trigger_reminder(self):
+        self._set_current_prompt(2)
+        command = TriggerReminder(self.phone_number, self.drill_instance_id, "graded-response-1")
+        batch = self._process_command(command)
+        self._assert_event_types(batch, DialogEventType.REMINDER_TRIGGERED)
+        self.assertEqual("graded-response-1", batch.events[0].prompt.slug)  # type: ignore
+        self.assertTrue(self.dialog_state.current_prompt_state.reminder_triggered)
+
+        # a second reminder for the same prompt is a no-op
+        batch = self._process_command(command)
+        self._assert_event_types(batch)
+
+    def test_trigger_reminder_after_user_moved_on(self):
+        self._set_current_prompt(3)
+        command = TriggerReminder(self.phone_number, self.drill_instance_id, "graded-response-1")
+        self._assert_event_types(self._process_command(command))
+
+        command = TriggerReminder(self.phone_number, uuid.uuid4(), "graded-response-2")
+        self._assert_event_types(self._process_command(command))
+
+    def test_trigger_reminder_opted_out(self):
+        self._set_current_prompt(2)
+        self.dialog_state.user_profile.opted_out = True
+        command = TriggerReminder(self.phone_number, self.drill_instance_id, "graded-response-1")
+        self._assert_event_types(self._process_command(command))
+
+
+class TestPrefetchRegistrationCodes(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.repo = MagicMock()
+        self.validator = MagicMock()
+
+    def test_prefetches_messages_that_might_be_codes(self):
+        self.repo.fetch_user_profiles.return_value = {
+            "validated": UserProfile(validated=True, account_info=AccountInfo(employer_id=1)),
+            "unvalidated": UserProfile(validated=False),
+            "demo": UserProfile(validated=True, is_demo=True),
+            "no-employer": UserProfile(validated=True, account_info=AccountInfo()),
+            "opted-out": UserProfile(validated=False, opted_out=True),
+        }
+        prefetch_registration_codes(
+            [
+                ("validated", "A"),
+                ("unvalidated", " Code1 "),
+                ("demo", "code2"),
+                ("no-employer", "code3"),
+                ("opted-out", "code4"),
+                ("new-user", "code5"),
+            ],
+            repo=self.repo,
+            registration_validator=self.validator,
+        )
+        self.validator.validate_codes.assert_called_once_with(["code1", "code2", "code3", "code5"])
+
+    def test_no_candidates(self):
+        self.repo.fetch_user_profiles.return_value = {
+            "validated": UserProfile(validated=True, account_info=AccountInfo(employer_id=1))
+        }
+        prefetch_registration_codes(
+            [("validated", "A")], repo=self.repo, registration_validator=self.validator
+        )
+        self.validator.validate_codes.assert_not_called()
+
+    def test_failures_are_ignored(self):
+        self.repo.fetch_user_profiles.side_effect = RuntimeError("boom")
+        prefetch_registration_codes(
+            [("new-user", "code")], repo=self.repo, registration_validator=self.validator
+        )
+        self.validator.validate_codes.assert_not_called()
@@ -1,13 +1,31 @@
+import datetime
+import json
 import unittest
 import uuid
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
 
 from stopcovid.dialog.models.events import (
     CompletedPrompt,
     AdvancedToNextPrompt,
     DialogEventBatch,
 )
-from stopcovid.dialog.persistence import DynamoDBDialogRepository
-from stopcovid.dialog.models.state import DialogState, UserProfile
+from stopcovid.dialog.persistence import (
+    DueReminder,
+    DynamoDBDialogRepository,
+    InMemoryDialogRepository,
+    SQLiteDialogRepository,
+    reminder_index_attributes,
+)
+from stopcovid.dialog.models.state import (
+    DialogState,
+    DialogStateSnapshot,
+    PromptState,
+    UserProfile,
+    REMINDER_DELAY,
+)
+from stopcovid.utils import dynamodb as dynamodb_utils
 from stopcovid.drills.drills import Prompt, PromptMessage
 
 
@@ -70,3 +88,320 @@ class TestPersistence(unittest.TestCase):
 
         event2_retrieved = batch_retrieved.events[1]
         self.assertEqual(event2.prompt.slug, event2_retrieved.prompt.slug)  # type: ignore
+
+
+class TestDynamoDBDialogRepositoryRequests(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = MagicMock()
+        get_client_patch = patch(
+            "stopcovid.dialog.persistence.get_boto3_client", return_value=self.dynamodb
+        )
+        get_client_patch.start()
+        self.addCleanup(get_client_patch.stop)
+        self.repo = DynamoDBDialogRepository(table_name_suffix="test")
+        self.start = datetime.datetime(2020, 5, 1, 14, 0, 30, tzinfo=datetime.timezone.utc)
+        self.dialog_state = DialogState(
+            phone_number="123456789",
+            seq="1",
+            drill_instance_id=uuid.uuid4(),
+            current_prompt_state=PromptState(slug="prompt", start_time=self.start),
+        )
+
+    def _persisted_state_item(self):
+        batch = DialogEventBatch(
+            phone_number="123456789",
+            seq="1",
+            events=[
+                AdvancedToNextPrompt(
+                    phone_number="123456789",
+                    user_profile=UserProfile(validated=True),
+                    prompt=Prompt(slug="prompt", messages=[PromptMessage(text="hi")]),
+                    drill_instance_id=self.dialog_state.drill_instance_id,
+                )
+            ],
+        )
+        self.repo.persist_dialog_state(batch, self.dialog_state)
+        write_items = self.dynamodb.transact_write_items.call_args[1]["TransactItems"]
+        return write_items[1]["Put"]["Item"]
+
+    def test_due_reminder_indexed(self):
+        due_ts = int((self.start + REMINDER_DELAY).timestamp())
+        self.assertEqual(
+            {"reminder_due_bucket": due_ts - 30, "reminder_due_ts": due_ts},
+            reminder_index_attributes(self.dialog_state),
+        )
+        item = dynamodb_utils.deserialize(self._persisted_state_item())
+        self.assertEqual(due_ts, item["reminder_due_ts"])
+        self.assertEqual(due_ts - 30, item["reminder_due_bucket"])
+
+    def test_no_reminder_not_indexed(self):
+        self.dialog_state.current_prompt_state = None
+        self.assertEqual({}, reminder_index_attributes(self.dialog_state))
+        item = self._persisted_state_item()
+        self.assertNotIn("reminder_due_bucket", item)
+        self.assertNotIn("reminder_due_ts", item)
+
+    def test_fetch_due_reminders(self):
+        drill_instance_id = uuid.uuid4()
+        item = {
+            "phone_number": {"S": "123456789"},
+            "drill_instance_id": {"S": str(drill_instance_id)},
+            "current_prompt_state": {"M": {"slug": {"S": "prompt"}}},
+        }
+        self.dynamodb.query.side_effect = [
+            {"Items": [item], "LastEvaluatedKey": {"phone_number": {"S": "123456789"}}},
+            {"Items": []},
+        ]
+        self.assertEqual(
+            [DueReminder("123456789", drill_instance_id, "prompt")],
+            self.repo.fetch_due_reminders(1588341600, 1588341630),
+        )
+        self.assertEqual(2, self.dynamodb.query.call_count)
+
+    def test_fetch_user_profiles(self):
+        self.dynamodb.batch_get_item.side_effect = [
+            {
+                "Responses": {
+                    "dialog-state-test": [
+                        {
+                            "phone_number": {"S": "1"},
+                            "user_profile": {
+                                "M": dynamodb_utils.serialize(
+                                    UserProfile(validated=True, language="es").dict()
+                                )
+                            },
+                        }
+                    ]
+                },
+                "UnprocessedKeys": {"dialog-state-test": {"Keys": [{"phone_number": {"S": "2"}}]}},
+            },
+            {"Responses": {"dialog-state-test": []}},
+        ]
+        profiles = self.repo.fetch_user_profiles(["1", "2", "1"])
+        self.assertEqual({"1": UserProfile(validated=True, language="es")}, profiles)
+        first_request = self.dynamodb.batch_get_item.call_args_list[0][1]["RequestItems"]
+        self.assertEqual(2, len(first_request["dialog-state-test"]["Keys"]))
+        self.assertEqual(
+            {"dialog-state-test": {"Keys": [{"phone_number": {"S": "2"}}]}},
+            self.dynamodb.batch_get_item.call_args_list[1][1]["RequestItems"],
+        )
+
+
+class LocalRepositoryTests:
+    def make_repo(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.repo = self.make_repo()
+        self.phone_number = "123456789"
+        self.now = datetime.datetime(2020, 5, 1, tzinfo=datetime.timezone.utc)
+
+    def _batch(self, minutes, seq):
+        return DialogEventBatch(
+            phone_number=self.phone_number,
+            seq=seq,
+            created_time=self.now + datetime.timedelta(minutes=minutes),
+            events=[
+                CompletedPrompt(
+                    phone_number=self.phone_number,
+                    user_profile=UserProfile(validated=True),
+                    prompt=Prompt(slug="one", messages=[PromptMessage(text="one")]),
+                    response=f"response {seq}",
+                    drill_instance_id=uuid.uuid4(),
+                )
+            ],
+        )
+
+    def _state(self, seq):
+        return DialogState(
+            phone_number=self.phone_number,
+            seq=seq,
+            user_profile=UserProfile(validated=True, language="es"),
+        )
+
+    def test_fetch_missing_state(self):
+        dialog_state = self.repo.fetch_dialog_state(self.phone_number)
+        self.assertEqual(self.phone_number, dialog_state.phone_number)
+        self.assertEqual("0", dialog_state.seq)
+
+    def test_save_and_fetch(self):
+        batch = self._batch(0, "1")
+        self.repo.persist_dialog_state(batch, self._state("1"))
+        dialog_state = self.repo.fetch_dialog_state(self.phone_number)
+        self.assertEqual("1", dialog_state.seq)
+        self.assertEqual("es", dialog_state.user_profile.language)
+        retrieved = self.repo.fetch_dialog_event_batch(self.phone_number, batch.batch_id)
+        self.assertEqual("response 1", retrieved.events[0].response)
+        self.assertEqual(
+            {self.phone_number: UserProfile(validated=True, language="es")},
+            self.repo.fetch_user_profiles([self.phone_number, "987654321"]),
+        )
+
+    def test_batch_without_events_not_persisted(self):
+        batch = DialogEventBatch(phone_number=self.phone_number, seq="1", events=[])
+        self.repo.persist_dialog_state(batch, self._state("1"))
+        self.assertEqual("0", self.repo.fetch_dialog_state(self.phone_number).seq)
+        self.assertEqual([], list(self.repo.fetch_dialog_event_batches(self.phone_number)))
+
+    def test_fetched_state_is_a_copy(self):
+        self.repo.persist_dialog_state(self._batch(0, "1"), self._state("1"))
+        self.repo.fetch_dialog_state(self.phone_number).user_profile.language = "fr"
+        self.assertEqual(
+            "es", self.repo.fetch_dialog_state(self.phone_number).user_profile.language
+        )
+
+    def test_fetch_batches_in_created_order(self):
+        for minutes, seq in [(2, "3"), (0, "1"), (1, "2")]:
+            self.repo.persist_dialog_state(self._batch(minutes, seq), self._state(seq))
+        self.assertEqual(
+            ["1", "2", "3"],
+            [batch.seq for batch in self.repo.fetch_dialog_event_batches(self.phone_number)],
+        )
+        self.assertEqual(
+            ["3"],
+            [
+                batch.seq
+                for batch in self.repo.fetch_dialog_event_batches(
+                    self.phone_number, created_after=self.now + datetime.timedelta(minutes=1)
+                )
+            ],
+        )
+        self.assertEqual([], list(self.repo.fetch_dialog_event_batches("987654321")))
+
+    def test_replace_dialog_state(self):
+        self.assertTrue(self.repo.replace_dialog_state(self._state("1"), "0"))
+        self.assertEqual("1", self.repo.fetch_dialog_state(self.phone_number).seq)
+        self.assertFalse(self.repo.replace_dialog_state(self._state("3"), "2"))
+        self.assertEqual("1", self.repo.fetch_dialog_state(self.phone_number).seq)
+        self.assertTrue(self.repo.replace_dialog_state(self._state("2"), "1"))
+        self.assertEqual("2", self.repo.fetch_dialog_state(self.phone_number).seq)
+        self.assertEqual([], list(self.repo.fetch_dialog_event_batches(self.phone_number)))
+
+    def _snapshot(self, minutes, seq):
+        return DialogStateSnapshot(
+            phone_number=self.phone_number,
+            dialog_state=self._state(seq),
+            seq=seq,
+            created_time=self.now + datetime.timedelta(minutes=minutes),
+            batch_count=int(seq),
+        )
+
+    def test_save_and_fetch_snapshot(self):
+        self.assertIsNone(self.repo.fetch_dialog_state_snapshot(self.phone_number))
+        self.repo.save_dialog_state_snapshot(self._snapshot(1, "2"))
+        self.assertEqual(
+            self._snapshot(1, "2"), self.repo.fetch_dialog_state_snapshot(self.phone_number)
+        )
+        # an older snapshot doesn't replace a newer one
+        self.repo.save_dialog_state_snapshot(self._snapshot(0, "1"))
+        self.assertEqual("2", self.repo.fetch_dialog_state_snapshot(self.phone_number).seq)
+        self.repo.save_dialog_state_snapshot(self._snapshot(2, "3"))
+        self.assertEqual("3", self.repo.fetch_dialog_state_snapshot(self.phone_number).seq)
+
+
+class TestInMemoryDialogRepository(LocalRepositoryTests, unittest.TestCase):
+    def make_repo(self):
+        return InMemoryDialogRepository()
+
+
+class TestSQLiteDialogRepository(LocalRepositoryTests, unittest.TestCase):
+    def make_repo(self):
+        return SQLiteDialogRepository()
+
+    def test_failed_write_stores_nothing(self):
+        self.repo.connection.execute("DROP TABLE dialog_state")
+        self.repo.connection.execute(
+            "CREATE TABLE dialog_state (phone_number TEXT PRIMARY KEY, state TEXT NOT NULL, "
+            "CHECK (state = ''))"
+        )
+        with self.assertRaises(Exception):
+            self.repo.persist_dialog_state(self._batch(0, "1"), self._state("1"))
+        self.assertEqual([], list(self.repo.fetch_dialog_event_batches(self.phone_number)))
+
+
+class TestDynamoDBReplaceDialogState(unittest.TestCase):
+    def setUp(self):
+        self.repo = DynamoDBDialogRepository(table_name_suffix="test", region_name="us-west-2")
+        self.repo.dynamodb = MagicMock()
+        self.dialog_state = DialogState(phone_number="123456789", seq="2")
+
+    def test_conditional_on_seq(self):
+        self.assertTrue(self.repo.replace_dialog_state(self.dialog_state, "1"))
+        kwargs = self.repo.dynamodb.put_item.call_args[1]
+        self.assertEqual("dialog-state-test", kwargs["TableName"])
+        self.assertEqual("#seq = :seq", kwargs["ConditionExpression"])
+        self.assertEqual({":seq": {"S": "1"}}, kwargs["ExpressionAttributeValues"])
+        self.assertEqual({"S": "2"}, kwargs["Item"]["seq"])
+
+    def test_conditional_on_no_state(self):
+        self.repo.replace_dialog_state(self.dialog_state, "0")
+        self.assertEqual(
+            "attribute_not_exists(phone_number)",
+            self.repo.dynamodb.put_item.call_args[1]["ConditionExpression"],
+        )
+
+    def test_condition_failed(self):
+        self.repo.dynamodb.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"
+        )
+        self.assertFalse(self.repo.replace_dialog_state(self.dialog_state, "1"))
+
+    def test_other_errors_raised(self):
+        self.repo.dynamodb.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ProvisionedThroughputExceededException"}}, "PutItem"
+        )
+        with self.assertRaises(ClientError):
+            self.repo.replace_dialog_state(self.dialog_state, "1")
+
+
+class TestDynamoDBDialogStateSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.repo = DynamoDBDialogRepository(table_name_suffix="test", region_name="us-west-2")
+        self.repo.dynamodb = MagicMock()
+        self.snapshot = DialogStateSnapshot(
+            phone_number="123456789",
+            dialog_state=DialogState(phone_number="123456789", seq="2"),
+            seq="2",
+            created_time=datetime.datetime(2020, 5, 1, tzinfo=datetime.timezone.utc),
+            batch_count=2,
+        )
+
+    def test_save_only_if_newer(self):
+        self.repo.save_dialog_state_snapshot(self.snapshot)
+        kwargs = self.repo.dynamodb.put_item.call_args[1]
+        self.assertEqual("dialog-state-snapshots-test", kwargs["TableName"])
+        self.assertEqual(
+            {":created_time": {"S": "2020-05-01T00:00:00+00:00"}},
+            kwargs["ExpressionAttributeValues"],
+        )
+        self.repo.dynamodb.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"
+        )
+        self.repo.save_dialog_state_snapshot(self.snapshot)
+
+    def test_fetch(self):
+        self.repo.dynamodb.get_item.return_value = {
+            "Item": dynamodb_utils.serialize(json.loads(self.snapshot.json()))
+        }
+        self.assertEqual(self.snapshot, self.repo.fetch_dialog_state_snapshot("123456789"))
+        self.repo.dynamodb.get_item.return_value = {}
+        self.assertIsNone(self.repo.fetch_dialog_state_snapshot("123456789"))
+
+
+class TestDynamoDBFetchDialogEventBatches(unittest.TestCase):
+    def test_query_by_created_time(self):
+        repo = DynamoDBDialogRepository(region_name="us-west-2")
+        repo.dynamodb = MagicMock()
+        repo.dynamodb.query.return_value = {"Items": []}
+        created_after = datetime.datetime(2020, 5, 1, tzinfo=datetime.timezone.utc)
+        self.assertEqual([], list(repo.fetch_dialog_event_batches("123", created_after)))
+        kwargs = repo.dynamodb.query.call_args[1]
+        self.assertEqual("by_created_time", kwargs["IndexName"])
+        self.assertEqual(
+            "phone_number = :phone_number AND created_time > :created_after",
+            kwargs["KeyConditionExpression"],
+        )
+        self.assertEqual(
+            {"S": "2020-05-01T00:00:00+00:00"},
+            kwargs["ExpressionAttributeValues"][":created_after"],
+        )
@@ -0,0 +1,129 @@
+import json
+import unittest
+import uuid
+from unittest.mock import patch
+
+from stopcovid.dialog import rebuild
+from stopcovid.dialog.engine import StartDrill, UpdateUser, process_command
+from stopcovid.dialog.persistence import InMemoryDialogRepository
+from stopcovid.drills.bundle import get_drill_loader
+
+
+class TestRebuild(unittest.TestCase):
+    def setUp(self):
+        self.repo = InMemoryDialogRepository()
+        self.phone_number = "+15551234567"
+        self._process(self.phone_number)
+
+    def _process(self, phone_number):
+        drill = get_drill_loader().get_drill(get_drill_loader().get_slugs_for_language("en")[0])
+        process_command(
+            UpdateUser(phone_number, {"language": "en", "name": "Jo", "validated": True}),
+            "1",
+            repo=self.repo,
+        )
+        process_command(
+            StartDrill(phone_number, drill.slug, drill.dict(), uuid.uuid4()), "2", repo=self.repo
+        )
+
+    def _corrupt(self, phone_number):
+        state = json.loads(self.repo.states[phone_number])
+        state["user_profile"]["language"] = "es"
+        state["current_prompt_state"] = None
+        self.repo.states[phone_number] = json.dumps(state)
+
+    def test_matched(self):
+        self.assertEqual(
+            rebuild.RebuildResult(self.phone_number, rebuild.MATCHED, 2),
+            rebuild.rebuild_state(self.repo, self.phone_number),
+        )
+
+    def test_no_history(self):
+        self.assertEqual(
+            rebuild.NO_HISTORY, rebuild.rebuild_state(self.repo, "+15557654321").status
+        )
+
+    def test_different(self):
+        self._corrupt(self.phone_number)
+        result = rebuild.rebuild_state(self.repo, self.phone_number)
+        self.assertEqual(rebuild.DIFFERENT, result.status)
+        self.assertEqual(("current_prompt_state", "user_profile.language"), result.differences)
+        self.assertEqual(
+            "es", self.repo.fetch_dialog_state(self.phone_number).user_profile.language
+        )
+
+    def test_corrected(self):
+        self._corrupt(self.phone_number)
+        result = rebuild.rebuild_state(self.repo, self.phone_number, correct=True)
+        self.assertEqual(rebuild.CORRECTED, result.status)
+        dialog_state = self.repo.fetch_dialog_state(self.phone_number)
+        self.assertEqual("en", dialog_state.user_profile.language)
+        self.assertEqual("2", dialog_state.seq)
+        self.assertEqual(
+            rebuild.MATCHED, rebuild.rebuild_state(self.repo, self.phone_number).status
+        )
+
+    def test_snapshots(self):
+        result = rebuild.rebuild_state(self.repo, self.phone_number, snapshot_every=2)
+        self.assertTrue(result.snapshot_saved)
+        snapshot = self.repo.fetch_dialog_state_snapshot(self.phone_number)
+        self.assertEqual("2", snapshot.seq)
+        self.assertEqual(2, snapshot.batch_count)
+        self.assertEqual(self.repo.fetch_dialog_state(self.phone_number), snapshot.dialog_state)
+
+        # only the batches created after the snapshot are applied
+        process_command(UpdateUser(self.phone_number, {"name": "Al"}), "3", repo=self.repo)
+        result = rebuild.rebuild_state(self.repo, self.phone_number, snapshot_every=2)
+        self.assertEqual(rebuild.RebuildResult(self.phone_number, rebuild.MATCHED, 1), result)
+        full = rebuild.rebuild_state(self.repo, self.phone_number, use_snapshot=False)
+        self.assertEqual(rebuild.RebuildResult(self.phone_number, rebuild.MATCHED, 3), full)
+
+    def test_snapshot_state_on_demand(self):
+        snapshot = rebuild.snapshot_state(self.repo, self.phone_number)
+        self.assertEqual(snapshot, self.repo.fetch_dialog_state_snapshot(self.phone_number))
+        self.assertEqual(snapshot, rebuild.snapshot_state(self.repo, self.phone_number))
+        self.assertIsNone(rebuild.snapshot_state(self.repo, "+15557654321"))
+
+    def test_bad_snapshot_found_by_full_rebuild(self):
+        snapshot = rebuild.snapshot_state(self.repo, self.phone_number)
+        snapshot.dialog_state.user_profile.language = "es"
+        self.repo.snapshots[self.phone_number] = snapshot.json()
+        self._corrupt(self.phone_number)
+        self.assertEqual(
+            ("current_prompt_state",),
+            rebuild.rebuild_state(self.repo, self.phone_number).differences,
+        )
+        self.assertEqual(
+            ("current_prompt_state", "user_profile.language"),
+            rebuild.rebuild_state(self.repo, self.phone_number, use_snapshot=False).differences,
+        )
+
+    def test_changed_while_rebuilding(self):
+        self._corrupt(self.phone_number)
+        with patch.object(self.repo, "replace_dialog_state", return_value=False):
+            result = rebuild.rebuild_state(self.repo, self.phone_number, correct=True)
+        self.assertEqual(rebuild.CHANGED, result.status)
+
+    def test_rebuild_states(self):
+        phone_numbers = [f"+1555000000{i}" for i in range(10)]
+        for phone_number in phone_numbers:
+            self._process(phone_number)
+        self._corrupt(phone_numbers[3])
+        fetch_dialog_state = self.repo.fetch_dialog_state
+
+        def failing_fetch(phone_number):
+            if phone_number == phone_numbers[5]:
+                raise RuntimeError("throttled")
+            return fetch_dialog_state(phone_number)
+
+        with patch.object(self.repo, "fetch_dialog_state", side_effect=failing_fetch):
+            results = {
+                result.phone_number: result.status
+                for result in rebuild.rebuild_states(
+                    self.repo, iter(phone_numbers), workers=2, skip={phone_numbers[0]}
+                )
+            }
+        self.assertEqual(set(phone_numbers[1:]), set(results))
+        self.assertEqual(rebuild.DIFFERENT, results[phone_numbers[3]])
+        self.assertEqual(rebuild.FAILED, results[phone_numbers[5]])
+        self.assertEqual(7, sum(1 for status in results.values() if status == rebuild.MATCHED))
@@ -1,9 +1,24 @@
+import base64
+import hashlib
+import json
+import threading
+import time
 import unittest
 import os
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest.mock import patch
 
+import requests
 import requests_mock
 
 from stopcovid.dialog.registration import (
+    ALLOW_ALL,
+    CODE_FILTER_REFRESH_SECONDS,
+    INVALID_CODE_TTL_SECONDS,
+    VALID_CODE_TTL_SECONDS,
+    CodeShapeFilter,
     DefaultRegistrationValidator,
     CodeValidationPayload,
     AccountInfo,
@@ -129,3 +144,277 @@ class TestRegistration(unittest.TestCase):
 
         # json serialization doesnt blow up
         payload.json()
+
+
+def _bloom(codes, size_bytes=128, hashes=7):
+    bits = bytearray(size_bytes)
+    for code in codes:
+        digest = hashlib.sha256(code.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big")
+        for j in range(hashes):
+            bit = (h1 + j * h2) % (size_bytes * 8)
+            bits[bit // 8] |= 1 << (bit % 8)
+    return {"bits": base64.b64encode(bytes(bits)).decode("ascii"), "hashes": hashes}
+
+
+class TestCodeShapeFilter(unittest.TestCase):
+    def test_length_and_alphabet(self):
+        code_filter = CodeShapeFilter.from_dict(
+            {"min_length": 4, "max_length": 6, "alphabet": "ABC123"}
+        )
+        self.assertTrue(code_filter.might_be_valid("abc1"))
+        self.assertTrue(code_filter.might_be_valid("a1b2c3"))
+        self.assertFalse(code_filter.might_be_valid("ab1"))
+        self.assertFalse(code_filter.might_be_valid("abc1234"))
+        self.assertFalse(code_filter.might_be_valid("abcd"))
+        self.assertFalse(code_filter.might_be_valid("hi there"))
+
+    def test_bloom_filter(self):
+        live_codes = ["abc123", "def456", "demo"]
+        code_filter = CodeShapeFilter.from_dict({"bloom": _bloom(live_codes)})
+        for code in live_codes:
+            self.assertTrue(code_filter.might_be_valid(code))
+        self.assertFalse(code_filter.might_be_valid("abc124"))
+        self.assertFalse(code_filter.might_be_valid("yes"))
+
+    def test_empty_spec_allows_everything(self):
+        code_filter = CodeShapeFilter.from_dict({})
+        self.assertTrue(code_filter.might_be_valid("anything at all"))
+        self.assertTrue(code_filter.might_be_valid(""))
+
+    def test_allow_all(self):
+        self.assertTrue(ALLOW_ALL.might_be_valid(""))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubValidationHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append((self.client_address, body))
+        time.sleep(server.delay)
+        if self.path == "/batch":
+            if server.batch_fails:
+                self._respond(500, {})
+            else:
+                self._respond(
+                    200,
+                    {"results": {code: {"valid": code == "valid"} for code in body["codes"]}},
+                )
+        elif body["code"] == "error":
+            self._respond(500, {})
+        elif body["code"] == "valid":
+            self._respond(200, {"valid": True, "account_info": {"employer_id": 1}})
+        else:
+            self._respond(200, {"valid": False})
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.filter_requests += 1
+        time.sleep(server.filter_delay)
+        if server.code_filter is None:
+            self._respond(500, {})
+        else:
+            self._respond(200, server.code_filter)
+
+    def _respond(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRegistrationWithStubServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), _StubValidationHandler)
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.server.delay = 0
+        self.server.batch_fails = False
+        self.server.code_filter = None
+        self.server.filter_requests = 0
+        self.server.filter_delay = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/validate"
+        self.batch_url = f"http://127.0.0.1:{self.server.server_address[1]}/batch"
+        self.filter_url = f"http://127.0.0.1:{self.server.server_address[1]}/filter"
+        self.validator = DefaultRegistrationValidator()
+        self.now = 0.0
+        self.validator._cache.clock = lambda: self.now
+
+    def _validate(self, code):
+        return self.validator.validate_code(code, url=self.url, key="key")
+
+    def test_valid_and_invalid_codes_expire_separately(self):
+        self.assertTrue(self._validate("valid").valid)
+        self.assertFalse(self._validate("nope").valid)
+        self.assertEqual(2, len(self.server.requests))
+
+        self.now += INVALID_CODE_TTL_SECONDS
+        self._validate("valid")
+        self._validate("nope")
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual("nope", self.server.requests[-1][1]["code"])
+
+        self.now += VALID_CODE_TTL_SECONDS
+        self._validate("valid")
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_connections_are_reused(self):
+        for code in ["a", "b", "c"]:
+            self._validate(code)
+        self.assertEqual(1, len({client_address for client_address, _ in self.server.requests}))
+
+    def test_concurrent_lookups_share_one_request(self):
+        self.server.delay = 0.2
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            payloads = list(executor.map(self._validate, ["valid"] * 5))
+        self.assertEqual(1, len(self.server.requests))
+        self.assertTrue(all(payload.valid for payload in payloads))
+
+    def test_errors_are_not_cached(self):
+        with self.assertRaises(requests.HTTPError):
+            self._validate("error")
+        with self.assertRaises(requests.HTTPError):
+            self._validate("error")
+        self.assertEqual(2, len(self.server.requests))
+
+    @patch("stopcovid.dialog.registration.READ_TIMEOUT_SECONDS", 0.05)
+    def test_requests_time_out(self):
+        self.server.delay = 0.5
+        with self.assertRaises(requests.Timeout):
+            self._validate("valid")
+
+    def _validate_many(self, codes, batch_url=None):
+        return self.validator.validate_codes(codes, url=self.url, key="key", batch_url=batch_url)
+
+    def test_validate_codes_in_one_batch_request(self):
+        results = self._validate_many(["valid", "nope", "valid"], self.batch_url)
+        self.assertEqual({"valid", "nope"}, set(results))
+        self.assertTrue(results["valid"].valid)
+        self.assertFalse(results["nope"].valid)
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual(["valid", "nope"], self.server.requests[0][1]["codes"])
+
+        # and the results are cached for single lookups
+        self.assertTrue(self._validate("valid").valid)
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_validate_codes_only_requests_uncached_codes(self):
+        self._validate("valid")
+        self._validate_many(["valid", "nope"], self.batch_url)
+        self.assertEqual(["nope"], self.server.requests[-1][1]["codes"])
+
+    def test_validate_codes_falls_back_to_single_requests(self):
+        self.server.batch_fails = True
+        results = self._validate_many(["valid", "nope"], self.batch_url)
+        self.assertTrue(results["valid"].valid)
+        self.assertFalse(results["nope"].valid)
+        self.assertEqual(
+            ["batch", "single", "single"],
+            ["batch" if "codes" in body else "single" for _, body in self.server.requests],
+        )
+
+    def test_validate_codes_without_batch_endpoint(self):
+        results = self._validate_many(["valid", "nope"])
+        self.assertEqual({"valid", "nope"}, set(results))
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_codes_rejected_by_filter_are_not_sent(self):
+        self.server.code_filter = {"min_length": 4, "bloom": _bloom(["valid", "other"])}
+        validate = self.validator.validate_code
+        self.assertTrue(
+            validate("valid", url=self.url, key="key", filter_url=self.filter_url).valid
+        )
+        self.assertFalse(
+            validate("nope", url=self.url, key="key", filter_url=self.filter_url).valid
+        )
+        self.assertFalse(validate("hi", url=self.url, key="key", filter_url=self.filter_url).valid)
+        self.assertEqual(["valid"], [body["code"] for _, body in self.server.requests])
+        self.assertEqual(1, self.server.filter_requests)
+
+    def test_validate_codes_skips_codes_rejected_by_filter(self):
+        self.server.code_filter = {"bloom": _bloom(["valid", "other"])}
+        results = self.validator.validate_codes(
+            ["valid", "nope", "other"],
+            url=self.url,
+            key="key",
+            batch_url=self.batch_url,
+            filter_url=self.filter_url,
+        )
+        self.assertTrue(results["valid"].valid)
+        self.assertFalse(results["nope"].valid)
+        self.assertFalse(results["other"].valid)
+        self.assertEqual(["valid", "other"], self.server.requests[0][1]["codes"])
+
+    def test_unavailable_filter_lets_every_code_through(self):
+        validate = self.validator.validate_code
+        self.assertTrue(
+            validate("valid", url=self.url, key="key", filter_url=self.filter_url).valid
+        )
+        self.assertFalse(
+            validate("nope", url=self.url, key="key", filter_url=self.filter_url).valid
+        )
+        self.assertEqual(2, len(self.server.requests))
+        # and the failed fetch isn't retried on every lookup
+        self.assertEqual(1, self.server.filter_requests)
+
+    def test_filter_is_refreshed(self):
+        self.server.code_filter = {"bloom": _bloom(["valid"])}
+        with patch("stopcovid.dialog.registration.time.monotonic", return_value=1000.0):
+            self.validator.get_code_filter(key="key", filter_url=self.filter_url)
+        self.server.code_filter = {"bloom": _bloom(["valid", "new"])}
+        with patch("stopcovid.dialog.registration.time.monotonic", return_value=1001.0):
+            code_filter = self.validator.get_code_filter(key="key", filter_url=self.filter_url)
+        self.assertFalse(code_filter.might_be_valid("new"))
+        with patch(
+            "stopcovid.dialog.registration.time.monotonic",
+            return_value=1000.0 + CODE_FILTER_REFRESH_SECONDS,
+        ):
+            code_filter = self.validator.get_code_filter(key="key", filter_url=self.filter_url)
+        self.assertTrue(code_filter.might_be_valid("new"))
+        self.assertEqual(2, self.server.filter_requests)
+
+    def test_filter_is_not_used_after_failed_refresh(self):
+        self.server.code_filter = {"bloom": _bloom(["valid"])}
+        with patch("stopcovid.dialog.registration.time.monotonic", return_value=1000.0):
+            code_filter = self.validator.get_code_filter(key="key", filter_url=self.filter_url)
+        self.assertFalse(code_filter.might_be_valid("new"))
+        self.server.code_filter = None
+        with patch(
+            "stopcovid.dialog.registration.time.monotonic",
+            return_value=1000.0 + CODE_FILTER_REFRESH_SECONDS,
+        ):
+            code_filter = self.validator.get_code_filter(key="key", filter_url=self.filter_url)
+        self.assertTrue(code_filter.might_be_valid("new"))
+
+    def test_filter_refresh_does_not_block_lookups(self):
+        self.server.code_filter = {}
+        self.server.filter_delay = 0.5
+        refresh = threading.Thread(
+            target=self.validator.get_code_filter,
+            kwargs={"key": "key", "filter_url": self.filter_url},
+        )
+        refresh.start()
+        self.addCleanup(refresh.join)
+        while not self.server.filter_requests:
+            time.sleep(0.01)
+        start = time.monotonic()
+        self.assertTrue(self._validate("valid").valid)
+        self.assertLess(time.monotonic() - start, self.server.filter_delay)
@@ -0,0 +1,74 @@
+import unittest
+import uuid
+from unittest.mock import MagicMock, patch
+
+from stopcovid.dialog.persistence import REMINDER_BUCKET_SECONDS, DueReminder
+from stopcovid.drill_progress.reminders import (
+    MAX_SWEEP_BUCKETS,
+    SWEEP_LOOKBACK_BUCKETS,
+    sweep_due_reminders,
+)
+
+
+@patch("stopcovid.drill_progress.reminders.increment")
+class TestSweepDueReminders(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 1588341600 + 30
+        self.current_bucket = 1588341600
+        self.buckets = {}
+        self.repo = MagicMock()
+        self.repo.fetch_due_reminders.side_effect = lambda bucket, due_before: self.buckets.get(
+            bucket, []
+        )
+        self.publisher = MagicMock()
+        self.publisher.publish_trigger_reminder_commands.return_value = []
+        self.watermark_repo = MagicMock()
+        self.watermark_repo.fetch_watermark.return_value = None
+
+    def _sweep(self):
+        return sweep_due_reminders(self.now, self.repo, self.publisher, self.watermark_repo)
+
+    def _buckets_read(self):
+        return [call[0][0] for call in self.repo.fetch_due_reminders.call_args_list]
+
+    def test_only_due_buckets_are_read(self, increment_mock):
+        late = DueReminder("1", uuid.uuid4(), "prompt-1")
+        current = DueReminder("2", uuid.uuid4(), "prompt-2")
+        self.buckets = {
+            self.current_bucket - 10 * REMINDER_BUCKET_SECONDS: [late],
+            self.current_bucket: [current],
+        }
+        self.assertEqual(2, self._sweep())
+        self.publisher.publish_trigger_reminder_commands.assert_called_once_with(
+            [tuple(late), tuple(current)]
+        )
+        buckets_read = self._buckets_read()
+        self.assertEqual(SWEEP_LOOKBACK_BUCKETS + 1, len(buckets_read))
+        self.assertEqual(self.current_bucket, max(buckets_read))
+        for call in self.repo.fetch_due_reminders.call_args_list:
+            self.assertEqual(self.now, call[0][1])
+        self.watermark_repo.save_watermark.assert_called_once_with("reminders", self.current_bucket)
+
+    def test_sweeps_from_watermark(self, increment_mock):
+        # the last sweep was two hours ago, longer than the first sweep looks back
+        watermark = self.current_bucket - 120 * REMINDER_BUCKET_SECONDS
+        self.watermark_repo.fetch_watermark.return_value = watermark
+        overdue = DueReminder("1", uuid.uuid4(), "prompt-1")
+        self.buckets = {watermark: [overdue]}
+        self.assertEqual(1, self._sweep())
+        self.assertEqual(
+            list(range(watermark, self.current_bucket + 1, REMINDER_BUCKET_SECONDS)),
+            self._buckets_read(),
+        )
+
+    def test_sweep_after_long_outage_is_bounded(self, increment_mock):
+        self.watermark_repo.fetch_watermark.return_value = self.current_bucket - 86400 * 7
+        self._sweep()
+        self.assertEqual(MAX_SWEEP_BUCKETS + 1, len(self._buckets_read()))
+
+    def test_failures_are_not_counted(self, increment_mock):
+        self.buckets = {self.current_bucket: [DueReminder("2", uuid.uuid4(), "prompt-2")]}
+        self.publisher.publish_trigger_reminder_commands.return_value = [("2", {})]
+        self.assertEqual(0, self._sweep())
+        # the next sweep tries them again
+        self.watermark_repo.save_watermark.assert_not_called()
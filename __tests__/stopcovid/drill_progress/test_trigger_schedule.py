@@ -0,0 +1,248 @@
+import datetime
+import logging
+import os
+import random
+import unittest
+import uuid
+from collections import Counter
+from unittest.mock import MagicMock, patch
+
+from stopcovid.drill_progress.trigger_schedule import (
+    BUCKET_SECONDS,
+    DRAIN_LOOKBACK_BUCKETS,
+    MAX_DRAIN_BUCKETS,
+    DrillTriggerScheduleRepository,
+    ScheduledDrill,
+    bucket_for,
+    drain_due_buckets,
+    schedule_cohort,
+)
+
+
+class TestScheduleCohort(unittest.TestCase):
+    def setUp(self) -> None:
+        self.start = datetime.datetime(2020, 5, 1, 14, tzinfo=datetime.timezone.utc)
+        self.window = datetime.timedelta(hours=3)
+
+    def test_trigger_times_are_within_window_and_bucketed(self):
+        phone_numbers = [f"+1555{i:07d}" for i in range(1000)]
+        scheduled = schedule_cohort(
+            "01-sample-drill-en", phone_numbers, "cohort", self.start, self.window
+        )
+        self.assertEqual(sorted(phone_numbers), sorted(s.phone_number for s in scheduled))
+        start_ts = self.start.timestamp()
+        for scheduled_drill in scheduled:
+            self.assertGreaterEqual(scheduled_drill.trigger_ts, start_ts)
+            self.assertLess(scheduled_drill.trigger_ts, start_ts + self.window.total_seconds())
+            self.assertEqual(0, scheduled_drill.bucket % BUCKET_SECONDS)
+            self.assertLessEqual(scheduled_drill.bucket, scheduled_drill.trigger_ts)
+            self.assertEqual("cohort", scheduled_drill.idempotency_key)
+
+    def test_buckets_are_evenly_loaded(self):
+        phone_numbers = [f"+1555{i:07d}" for i in range(1800)]
+        scheduled = schedule_cohort(
+            "01-sample-drill-en",
+            phone_numbers,
+            "cohort",
+            self.start,
+            self.window,
+            rng=random.Random(0),
+        )
+        per_bucket = Counter(s.bucket for s in scheduled)
+        self.assertEqual(180, len(per_bucket))
+        self.assertLessEqual(max(per_bucket.values()) - min(per_bucket.values()), 2)
+
+    def test_duplicate_recipients_scheduled_once(self):
+        scheduled = schedule_cohort("drill", ["1", "2", "1"], "cohort", self.start, self.window)
+        self.assertEqual(["1", "2"], sorted(s.phone_number for s in scheduled))
+
+    def test_empty_cohort(self):
+        self.assertEqual([], schedule_cohort("drill", [], "cohort", self.start, self.window))
+
+
+@patch("stopcovid.drill_progress.trigger_schedule.increment")
+class TestDrainDueBuckets(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.now = 1588341600 + 30
+        self.current_bucket = 1588341600
+        self.buckets = {}
+        self.repo = MagicMock()
+        self.repo.fetch_bucket.side_effect = lambda bucket, due_by: [
+            scheduled_drill
+            for scheduled_drill in self.buckets.get(bucket, [])
+            if scheduled_drill.trigger_ts <= due_by
+        ]
+        self.publisher = MagicMock()
+        self.publisher.publish_start_drill_commands.return_value = []
+        self.watermark_repo = MagicMock()
+        self.watermark_repo.fetch_watermark.return_value = None
+
+    def _drain(self):
+        return drain_due_buckets(self.now, self.repo, self.publisher, self.watermark_repo)
+
+    def _buckets_read(self):
+        return [call[0][0] for call in self.repo.fetch_bucket.call_args_list]
+
+    def _scheduled(self, phone_number, bucket, offset=5):
+        return ScheduledDrill(
+            phone_number=phone_number,
+            idempotency_key="cohort",
+            drill_slug="01-sample-drill-en",
+            drill_instance_id=uuid.uuid4(),
+            trigger_ts=bucket + offset,
+            bucket=bucket,
+        )
+
+    def test_publishes_due_buckets_in_bulk(self, increment_mock):
+        late = [self._scheduled("1", self.current_bucket - BUCKET_SECONDS)]
+        current = [
+            self._scheduled("2", self.current_bucket),
+            self._scheduled("3", self.current_bucket),
+        ]
+        future = [self._scheduled("4", self.current_bucket + BUCKET_SECONDS)]
+        self.buckets = {
+            self.current_bucket - BUCKET_SECONDS: late,
+            self.current_bucket: current,
+            self.current_bucket + BUCKET_SECONDS: future,
+        }
+        published = self._drain()
+        self.assertEqual(3, published)
+        calls = self.publisher.publish_start_drill_commands.call_args_list
+        self.assertEqual(2, len(calls))
+        self.assertEqual(
+            [(s.phone_number, s.drill_slug, s.drill_instance_id) for s in current], calls[1][0][0]
+        )
+        self.repo.delete_scheduled_drills.assert_any_call(late)
+        self.repo.delete_scheduled_drills.assert_any_call(current)
+        self.assertEqual(DRAIN_LOOKBACK_BUCKETS + 1, len(self._buckets_read()))
+        self.assertEqual(self.current_bucket, max(self._buckets_read()))
+        self.watermark_repo.save_watermark.assert_called_once_with(
+            "drill-triggers", self.current_bucket
+        )
+
+    def test_drains_from_watermark(self, increment_mock):
+        # the last run was two hours ago, longer than the first run looks back
+        watermark = self.current_bucket - 120 * BUCKET_SECONDS
+        self.watermark_repo.fetch_watermark.return_value = watermark
+        overdue = self._scheduled("1", watermark)
+        self.buckets = {watermark: [overdue]}
+        self.assertEqual(1, self._drain())
+        self.assertEqual(
+            list(range(watermark, self.current_bucket + 1, BUCKET_SECONDS)),
+            self._buckets_read(),
+        )
+
+    def test_drain_after_long_outage_is_bounded(self, increment_mock):
+        self.watermark_repo.fetch_watermark.return_value = self.current_bucket - 86400 * 7
+        self._drain()
+        self.assertEqual(MAX_DRAIN_BUCKETS + 1, len(self._buckets_read()))
+
+    def test_current_bucket_not_drained_early(self, increment_mock):
+        due = self._scheduled("2", self.current_bucket, offset=30)
+        early = self._scheduled("3", self.current_bucket, offset=31)
+        self.buckets = {self.current_bucket: [due, early]}
+        self.assertEqual(1, self._drain())
+        self.repo.delete_scheduled_drills.assert_called_once_with([due])
+        self.repo.fetch_bucket.assert_called_with(self.current_bucket, self.now)
+
+    def test_failed_commands_stay_scheduled(self, increment_mock):
+        current = [
+            self._scheduled("2", self.current_bucket),
+            self._scheduled("3", self.current_bucket),
+        ]
+        self.buckets = {self.current_bucket: current}
+        self.publisher.publish_start_drill_commands.return_value = [("2", {})]
+        self.assertEqual(1, self._drain())
+        self.repo.delete_scheduled_drills.assert_called_once_with(current[1:])
+        # the next run tries them again
+        self.watermark_repo.save_watermark.assert_not_called()
+
+
+class TestDrillTriggerScheduleRepository(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dynamodb = MagicMock()
+        get_client_patch = patch(
+            "stopcovid.drill_progress.trigger_schedule.get_boto3_client",
+            return_value=self.dynamodb,
+        )
+        get_client_patch.start()
+        self.addCleanup(get_client_patch.stop)
+        self.repo = DrillTriggerScheduleRepository()
+
+    @patch("stopcovid.utils.dynamodb.time.sleep")
+    def test_save_writes_in_batches_and_retries_unprocessed(self, sleep_mock):
+        scheduled = schedule_cohort(
+            "drill",
+            [str(i) for i in range(30)],
+            "cohort",
+            datetime.datetime.now(tz=datetime.timezone.utc),
+        )
+        unprocessed = {self.repo._table_name(): [{"PutRequest": {}}]}
+        self.dynamodb.batch_write_item.side_effect = [
+            {"UnprocessedItems": unprocessed},
+            {},
+            {},
+        ]
+        self.repo.save_scheduled_drills(scheduled)
+        calls = self.dynamodb.batch_write_item.call_args_list
+        self.assertEqual(3, len(calls))
+        table_name = self.repo._table_name()
+        self.assertEqual(25, len(calls[0][1]["RequestItems"][table_name]))
+        self.assertEqual(unprocessed, calls[1][1]["RequestItems"])
+        self.assertEqual(5, len(calls[2][1]["RequestItems"][table_name]))
+        item = calls[2][1]["RequestItems"][table_name][0]["PutRequest"]["Item"]
+        self.assertIn("bucket", item)
+        self.assertIn("expiration_ts", item)
+
+    def test_fetch_bucket_only_due_drills(self):
+        self.dynamodb.query.return_value = {"Items": []}
+        self.assertEqual([], self.repo.fetch_bucket(1588341600, 1588341630))
+        kwargs = self.dynamodb.query.call_args[1]
+        self.assertEqual(
+            "#bucket = :bucket AND trigger_ts <= :due_by", kwargs["KeyConditionExpression"]
+        )
+        self.assertEqual({"#bucket": "bucket"}, kwargs["ExpressionAttributeNames"])
+        self.assertEqual(
+            {":bucket": {"N": "1588341600"}, ":due_by": {"N": "1588341630"}},
+            kwargs["ExpressionAttributeValues"],
+        )
+
+
+class TestDrillTriggerSchedulePersistence(unittest.TestCase):
+    """
+    requires local dynamoDB to be running: docker-compose up in the dynamodb_local directory
+    """
+
+    def setUp(self) -> None:
+        os.environ["STAGE"] = "test"
+        self.repo = DrillTriggerScheduleRepository(
+            region_name="us-west-2",
+            endpoint_url="http://localhost:9000",
+            aws_access_key_id="fake-key",
+            aws_secret_access_key="fake-secret",
+        )
+        self.repo.drop_and_recreate_table()
+
+    def _scheduled(self, phone_number, trigger_ts):
+        return ScheduledDrill(
+            phone_number=phone_number,
+            idempotency_key="cohort",
+            drill_slug="01-sample-drill-en",
+            drill_instance_id=uuid.uuid4(),
+            trigger_ts=trigger_ts,
+            bucket=bucket_for(trigger_ts),
+        )
+
+    def test_save_fetch_and_delete(self):
+        bucket = 1588341600
+        due = self._scheduled("1", bucket + 10)
+        not_yet_due = self._scheduled("2", bucket + 50)
+        next_bucket = self._scheduled("3", bucket + BUCKET_SECONDS + 10)
+        self.repo.save_scheduled_drills([due, not_yet_due, next_bucket])
+        self.assertEqual([due], self.repo.fetch_bucket(bucket, bucket + 30))
+        self.assertEqual(
+            [due, not_yet_due], self.repo.fetch_bucket(bucket, bucket + BUCKET_SECONDS)
+        )
+        self.repo.delete_scheduled_drills([due])
+        self.assertEqual([not_yet_due], self.repo.fetch_bucket(bucket, bucket + BUCKET_SECONDS))
@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from stopcovid.drills import bundle
+from stopcovid.drills.content_loader import SourceRepoDrillLoader
+
+
+class TestDrillBundle(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.tmpdir.name, "drills.json")
+        self.bundle_path = os.path.join(self.tmpdir.name, "drills.bundle")
+        self._write_source({"drill-b": self._drill("drill-b"), "drill-a": self._drill("drill-a")})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _build_and_open(self):
+        bundle.build_bundle(self.source_path, self.bundle_path)
+        loader = bundle.open_bundle(self.bundle_path)
+        self.addCleanup(loader.close)
+        return loader
+
+    def _drill(self, slug):
+        return {
+            "slug": slug,
+            "name": slug,
+            "prompts": [{"slug": "p1", "messages": [{"text": "hi"}], "correct_response": "a"}],
+        }
+
+    def _write_source(self, drills):
+        with open(self.source_path, "w") as f:
+            json.dump(drills, f)
+
+    def test_committed_bundle_is_up_to_date(self):
+        self.assertTrue(bundle.is_up_to_date(), "run python -m stopcovid.drills.bundle")
+
+    def test_bundled_drills_match_source(self):
+        loader = bundle.open_bundle()
+        self.addCleanup(loader.close)
+        self.assertEqual(SourceRepoDrillLoader().get_drills(), loader.get_drills())
+
+    def test_build_and_load(self):
+        loader = self._build_and_open()
+        self.assertEqual(["drill-a", "drill-b"], loader.all_drill_slugs)
+        drill = loader.get_drill("drill-a")
+        self.assertEqual("drill-a", drill.slug)
+        self.assertEqual("a", drill.first_prompt().correct_response)
+        self.assertIs(drill, loader.get_drill("drill-a"))
+        with self.assertRaises(KeyError):
+            loader.get_drill("drill-c")
+
+    def test_drills_are_loaded_lazily(self):
+        loader = self._build_and_open()
+        loader.get_drill("drill-b")
+        self.assertEqual(["drill-b"], list(loader._drills))
+
+    def test_stale_bundle(self):
+        bundle.build_bundle(self.source_path, self.bundle_path)
+        self.assertTrue(bundle.is_up_to_date(self.source_path, self.bundle_path))
+        self._write_source({"drill-a": self._drill("drill-a")})
+        self.assertFalse(bundle.is_up_to_date(self.source_path, self.bundle_path))
+
+    def test_bundle_is_stale_when_models_change(self):
+        bundle.build_bundle(self.source_path, self.bundle_path)
+        with patch.object(bundle.Drill, "schema_json", return_value='{"changed": true}'):
+            self.assertFalse(bundle.is_up_to_date(self.source_path, self.bundle_path))
+
+    def test_missing_bundle(self):
+        self.assertIsNone(bundle.open_bundle(self.bundle_path))
+        self.assertFalse(bundle.is_up_to_date(self.source_path, self.bundle_path))
+
+    def test_unsupported_bundle(self):
+        with open(self.bundle_path, "wb") as f:
+            f.write(b"not a drill bundle")
+        self.assertIsNone(bundle.open_bundle(self.bundle_path))
+
+    def test_drill_cache_is_bounded(self):
+        self._write_source({f"drill-{i}": self._drill(f"drill-{i}") for i in range(10)})
+        loader = self._build_and_open()
+        with patch.object(bundle, "DRILL_CACHE_SIZE", 3):
+            for slug in loader.all_drill_slugs:
+                loader.get_drill(slug)
+        self.assertEqual(["drill-7", "drill-8", "drill-9"], list(loader._drills))
+
+    def test_slugs_for_language(self):
+        self._write_source(
+            {
+                "00-language": self._drill("00-language"),
+                "01-intake-en": self._drill("01-intake-en"),
+                "01-intake-es": self._drill("01-intake-es"),
+                "02-sample-en": self._drill("02-sample-en"),
+            }
+        )
+        loader = self._build_and_open()
+        self.assertEqual(["en", "es"], loader.languages())
+        self.assertEqual(["01-intake-en", "02-sample-en"], loader.get_slugs_for_language("en"))
+        self.assertEqual(["01-intake-es"], loader.get_slugs_for_language("es"))
+        self.assertEqual([], loader.get_slugs_for_language("fr"))
+
+    def test_in_memory_bundle(self):
+        with open(self.source_path, "rb") as f:
+            loader = bundle.BundledDrillLoader(bundle.compile_bundle(f.read()))
+        self.assertEqual("drill-b", loader.get_drill("drill-b").slug)
+
+    def test_drill_loader_is_a_singleton(self):
+        self.assertIs(bundle.get_drill_loader(), bundle.get_drill_loader())
@@ -1,6 +1,11 @@
 import unittest
 
-from stopcovid.drills.content_loader import translate, SupportedTranslation
+from stopcovid.drills.content_loader import (
+    translate,
+    SupportedTranslation,
+    get_template,
+    template_additional_args,
+)
 
 
 class TestTranslate(unittest.TestCase):
@@ -57,3 +62,20 @@ class TestTranslate(unittest.TestCase):
         self.assertEqual(
             translate("fr", SupportedTranslation.MATCH_CORRECT_ANSWER), "C'est Correct!"
         )
+
+
+class TestTemplateAdditionalArgs(unittest.TestCase):
+    def test_templates_are_compiled_once(self):
+        self.assertIs(get_template("Hi {{name}}"), get_template("Hi {{name}}"))
+
+    def test_values_are_not_escaped(self):
+        self.assertEqual(template_additional_args("{{answer}}", answer="a & <b>"), "a & <b>")
+
+    def test_arguments_can_contain_templates(self):
+        self.assertEqual(
+            template_additional_args("{{greeting}}", greeting="Hi {{name}}", name="Ada"), "Hi Ada"
+        )
+
+    def test_plain_text(self):
+        self.assertEqual(template_additional_args("Hello\n", name="Ada"), "Hello")
+        self.assertEqual(template_additional_args("Hello", name="Ada"), "Hello")
@@ -1,5 +1,6 @@
 import json
 import logging
+import random
 import unittest
 import uuid
 from typing import List
@@ -8,7 +9,9 @@ from unittest.mock import patch, MagicMock
 from stopcovid.dialog.models.state import UserProfile
 from stopcovid.sms.enqueue_outbound_sms import (
     get_messages,
+    get_outbound_messages,
     get_outbound_sms_commands,
+    project_batch_item,
     USER_VALIDATION_FAILED_COPY,
     publish_outbound_sms_messages,
     OutboundSMS,
@@ -20,13 +23,19 @@ from stopcovid.dialog.models.events import (
     CompletedPrompt,
     FailedPrompt,
     AdvancedToNextPrompt,
+    ReminderTriggered,
     DrillCompleted,
     DialogEvent,
     AdHocMessageSent,
+    DialogEventBatch,
+    MenuRequested,
+    OptedOut,
+    batch_from_dict,
 )
 from stopcovid.drills.drills import Drill, Prompt, PromptMessage
 from stopcovid.dialog.registration import CodeValidationPayload, AccountInfo
 from stopcovid.sms.types import SMS
+from stopcovid.utils import dynamodb as dynamodb_utils, sqs
 
 
 class TestHandleCommand(unittest.TestCase):
@@ -229,19 +238,143 @@ class TestHandleCommand(unittest.TestCase):
         self.assertEqual(outbound_messages[0].body, body)
         self.assertEqual(outbound_messages[0].media_url, None)
 
+    def test_reminder_triggered_resends_prompt(self):
+        dialog_events: List[DialogEvent] = [
+            ReminderTriggered(
+                phone_number=self.phone,
+                user_profile=self.validated_user_profile,
+                prompt=self.drill.prompts[1],
+                drill_instance_id=uuid.uuid4(),
+            )
+        ]
+        outbound_messages = get_outbound_sms_commands(dialog_events)
+        self.assertEqual(
+            [message.text for message in self.drill.prompts[1].messages],
+            [message.body for message in outbound_messages],
+        )
+
+
+class TestProjection(unittest.TestCase):
+    def setUp(self):
+        self.phone = "+15554238324"
+        self.drill = Drill(
+            name="Test Drill",
+            slug="test-drill",
+            prompts=[
+                Prompt(
+                    slug="ignore-response-1",
+                    messages=[
+                        PromptMessage(text="Hello"),
+                        PromptMessage(text=None, media_url="https://example.com/a.png"),
+                        PromptMessage(text=""),
+                    ],
+                ),
+                Prompt(
+                    slug="graded-response-1",
+                    messages=[PromptMessage(text="Question 1")],
+                    correct_response="a) {{name}}",
+                ),
+            ],
+        )
+
+    def _events(self, user_profile):
+        common = {"phone_number": self.phone, "user_profile": user_profile}
+        drill_instance_id = uuid.uuid4()
+        ungraded, graded = self.drill.prompts
+        return [
+            DrillStarted(
+                drill=self.drill,
+                first_prompt=ungraded,
+                drill_instance_id=drill_instance_id,
+                **common,
+            ),
+            AdvancedToNextPrompt(prompt=ungraded, drill_instance_id=drill_instance_id, **common),
+            ReminderTriggered(prompt=ungraded, drill_instance_id=drill_instance_id, **common),
+            CompletedPrompt(
+                prompt=ungraded, response="a", drill_instance_id=drill_instance_id, **common
+            ),
+            CompletedPrompt(
+                prompt=graded, response="a", drill_instance_id=drill_instance_id, **common
+            ),
+            FailedPrompt(
+                prompt=graded,
+                response="b",
+                abandoned=False,
+                drill_instance_id=drill_instance_id,
+                **common,
+            ),
+            FailedPrompt(
+                prompt=graded,
+                response="b",
+                abandoned=True,
+                drill_instance_id=drill_instance_id,
+                **common,
+            ),
+            FailedPrompt(
+                prompt=ungraded,
+                response="b",
+                abandoned=True,
+                drill_instance_id=drill_instance_id,
+                **common,
+            ),
+            DrillCompleted(drill_instance_id=drill_instance_id, last_prompt_response="a", **common),
+            UserValidated(
+                code_validation_payload=CodeValidationPayload(valid=True, is_demo=False), **common
+            ),
+            UserValidationFailed(**common),
+            AdHocMessageSent(sms=SMS(body="hi", media_url="https://example.com/b.png"), **common),
+            AdHocMessageSent(sms=SMS(body=None), **common),
+            OptedOut(drill_instance_id=None, **common),
+            MenuRequested(**common),
+        ]
 
-@patch("stopcovid.sms.enqueue_outbound_sms.get_boto3_resource")
+    def _assert_equivalent(self, user_profile):
+        batch = DialogEventBatch(
+            phone_number=self.phone, seq="1", events=self._events(user_profile)
+        )
+        # the image the dialog event batches table's stream delivers
+        image = dynamodb_utils.serialize(json.loads(batch.json()))
+
+        random.seed(0)
+        expected = get_outbound_sms_commands(
+            batch_from_dict(dynamodb_utils.deserialize(image)).events
+        )
+        random.seed(0)
+        actual = get_outbound_messages(project_batch_item(image))
+        self.assertEqual(expected, actual)
+        return actual
+
+    def test_projection_matches_full_decoding(self):
+        messages = self._assert_equivalent(
+            UserProfile(validated=True, language="es", messaging_service_sid="MG123")
+        )
+        self.assertEqual(15, len(messages))
+        self.assertEqual("https://example.com/a.png", messages[1].media_url)
+        self.assertIsNone(messages[2].body)
+        self.assertEqual("MG123", messages[0].messaging_service_sid)
+
+    def test_projection_matches_full_decoding_without_language(self):
+        self._assert_equivalent(UserProfile(validated=False))
+
+    def test_batch_without_events(self):
+        batch = DialogEventBatch(phone_number=self.phone, seq="1", events=[])
+        image = dynamodb_utils.serialize(json.loads(batch.json()))
+        self.assertEqual([], project_batch_item(image))
+
+
+@patch("stopcovid.utils.sqs.get_boto3_client")
 class TestPublishOutboundSMS(unittest.TestCase):
     def setUp(self) -> None:
         logging.disable(logging.CRITICAL)
+        sqs.get_client.cache_clear()
+        sqs.get_queue_url.cache_clear()
 
-    def _get_mocked_send_messages(self, get_resource_mock):
+    def _get_mocked_send_messages(self, get_client_mock):
         sqs_mock = MagicMock()
-        get_resource_mock.return_value = sqs_mock
-        queue = MagicMock(name="queue")
-        send_messages_mock = MagicMock()
-        queue.send_messages = send_messages_mock
-        sqs_mock.get_queue_by_name = MagicMock(return_value=queue)
+        get_client_mock.return_value = sqs_mock
+        sqs_mock.get_queue_url = MagicMock(return_value={"QueueUrl": "queue-url"})
+        send_messages_mock = MagicMock(return_value={"Successful": [], "Failed": []})
+        sqs_mock.send_message_batch = send_messages_mock
         return send_messages_mock
 
     def _get_send_message_entries(self, send_messages_mock):
@@ -250,13 +383,30 @@ class TestPublishOutboundSMS(unittest.TestCase):
         _, *kwargs = call
         return kwargs[1]["Entries"]  # type: ignore
 
-    def test_no_messages(self, get_resource_mock):
-        send_messages_mock = self._get_mocked_send_messages(get_resource_mock)
+    def test_sends_messages_to_more_than_ten_phone_numbers(self, get_client_mock):
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
+        messages = [
+            OutboundSMS(event_id=uuid.uuid4(), phone_number=f"+1555000{i:04d}", body="hi")
+            for i in range(25)
+        ]
+        publish_outbound_sms_messages(messages)
+        self.assertEqual(3, send_messages_mock.call_count)
+        phone_numbers = [
+            entry["MessageGroupId"]
+            for call in send_messages_mock.call_args_list
+            for entry in call[1]["Entries"]
+        ]
+        self.assertEqual(
+            sorted(message.phone_number for message in messages), sorted(phone_numbers)
+        )
+
+    def test_no_messages(self, get_client_mock):
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
         publish_outbound_sms_messages([])
         send_messages_mock.assert_not_called()
 
-    def test_sends_messages_to_one_phone_number_for_one_event(self, get_resource_mock):
-        send_messages_mock = self._get_mocked_send_messages(get_resource_mock)
+    def test_sends_messages_to_one_phone_number_for_one_event(self, get_client_mock):
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
         phone_number = "+15551234321"
 
         event_id = uuid.uuid4()
@@ -284,8 +434,8 @@ class TestPublishOutboundSMS(unittest.TestCase):
         )
         self.assertEqual(entry["MessageGroupId"], phone_number)
 
-    def test_sends_messages_to_one_phone_number_for_multiple_events(self, get_resource_mock):
-        send_messages_mock = self._get_mocked_send_messages(get_resource_mock)
+    def test_sends_messages_to_one_phone_number_for_multiple_events(self, get_client_mock):
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
         phone_number = "+15551234321"
 
         event_1_id = uuid.uuid4()
@@ -314,8 +464,8 @@ class TestPublishOutboundSMS(unittest.TestCase):
         ),
         self.assertEqual(entry["MessageGroupId"], phone_number)
 
-    def test_sends_messages_to_multiple_phone_numbers_for_one_event_each(self, get_resource_mock):
-        send_messages_mock = self._get_mocked_send_messages(get_resource_mock)
+    def test_sends_messages_to_multiple_phone_numbers_for_one_event_each(self, get_client_mock):
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
         phone_number_1 = "+15551234321"
         phone_number_2 = "+15559998888"
         event_1_id = uuid.uuid4()
@@ -355,9 +505,9 @@ class TestPublishOutboundSMS(unittest.TestCase):
         self.assertEqual(entry["MessageGroupId"], phone_number_2)
 
     def test_sends_messages_to_multiple_phone_numbers_for_multiple_events_each(
-        self, get_resource_mock
+        self, get_client_mock
     ):
-        send_messages_mock = self._get_mocked_send_messages(get_resource_mock)
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
         phone_number_1 = "+15551234321"
         phone_number_2 = "+15559998888"
         phone_number_3 = "+15551110000"
@@ -452,8 +602,8 @@ class TestPublishOutboundSMS(unittest.TestCase):
         )
         self.assertEqual(entry["MessageGroupId"], phone_number_3)
 
-    def test_sends_messages_to_multiple_messaging_services(self, get_resource_mock):
-        send_messages_mock = self._get_mocked_send_messages(get_resource_mock)
+    def test_sends_messages_to_multiple_messaging_services(self, get_client_mock):
+        send_messages_mock = self._get_mocked_send_messages(get_client_mock)
         phone_number_1 = "+15551234321"
         phone_number_2 = "+15559998888"
         phone_number_3 = "+15551110000"
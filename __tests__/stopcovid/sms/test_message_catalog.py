@@ -0,0 +1,59 @@
+import random
+import unittest
+
+from stopcovid.drills.content_loader import (
+    TRANSLATIONS,
+    SupportedTranslation,
+    correct_answer_response,
+    translate,
+)
+from stopcovid.sms.message_catalog import MessageCatalog, MessageTemplate
+
+
+class TestMessageCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = MessageCatalog()
+
+    def test_matches_translate(self):
+        answers = [
+            "a) Philadelphia",
+            "",
+            "{{correct_answer}}",
+            "{% if true %}yes{% endif %}",
+            "line\r\nbreak",
+            "trailing newline\n",
+            "a & <b>",
+        ]
+        for language in [*TRANSLATIONS, "zh", None]:
+            for translation in SupportedTranslation:
+                self.assertEqual(
+                    translate(language, translation),
+                    self.catalog.translate(language, translation),
+                )
+                for answer in answers:
+                    self.assertEqual(
+                        translate(language, translation, correct_answer=answer),
+                        self.catalog.translate(language, translation, correct_answer=answer),
+                    )
+
+    def test_correct_answer_response_matches(self):
+        for language in [*TRANSLATIONS, "zh", None]:
+            random.seed(str(language))
+            expected = [correct_answer_response(language) for _ in range(20)]
+            random.seed(str(language))
+            actual = [self.catalog.correct_answer_response(language) for _ in range(20)]
+            self.assertEqual(expected, actual)
+
+    def test_template_slots(self):
+        template = MessageTemplate("Hi {{ name }}, it's *{{answer}}*.")
+        self.assertTrue(template.is_simple)
+        self.assertEqual(("name", "answer"), template.slots)
+        self.assertEqual("Hi Ada, it's *b*.", template.render(name="Ada", answer="b"))
+        self.assertEqual("Hi , it's *b*.", template.render(answer="b"))
+
+    def test_complex_template_is_rendered_by_jinja(self):
+        source = "{% if answer %}*{{answer}}*{% endif %}"
+        template = MessageTemplate(source)
+        self.assertFalse(template.is_simple)
+        self.assertEqual("*b*", template.render(answer="b"))
+        self.assertEqual("", template.render(answer=""))
@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import patch
+
+from stopcovid.sms.segments import (
+    MergePolicy,
+    get_merge_policy,
+    is_gsm7,
+    merge_messages,
+    segment_count,
+)
+from stopcovid.sms.types import SMS
+
+ENABLED = MergePolicy(enabled=True)
+
+
+class TestSegmentCount(unittest.TestCase):
+    def test_gsm7(self):
+        self.assertTrue(is_gsm7("Hello, ¿qué tal? ñ"))
+        self.assertEqual(1, segment_count("a" * 160))
+        self.assertEqual(2, segment_count("a" * 161))
+        self.assertEqual(2, segment_count("a" * 306))
+        self.assertEqual(3, segment_count("a" * 307))
+
+    def test_gsm7_extension_characters_take_two_septets(self):
+        self.assertEqual(1, segment_count("€" * 80))
+        self.assertEqual(2, segment_count("€" * 81))
+
+    def test_ucs2(self):
+        self.assertFalse(is_gsm7("🤖 hi"))
+        self.assertEqual(1, segment_count("á" * 70))
+        self.assertEqual(2, segment_count("á" * 71))
+        # emoji are two UTF-16 code units
+        self.assertEqual(1, segment_count("🤖" * 35))
+        self.assertEqual(2, segment_count("🤖" * 36))
+
+
+class TestMergeMessages(unittest.TestCase):
+    def test_disabled_by_default(self):
+        messages = [SMS(body="a"), SMS(body="b")]
+        self.assertEqual(messages, merge_messages(messages, MergePolicy()))
+
+    def test_merges_short_text_messages(self):
+        self.assertEqual(
+            [SMS(body="a\n\nb\n\nc")],
+            merge_messages([SMS(body="a"), SMS(body="b"), SMS(body="c")], ENABLED),
+        )
+
+    def test_never_merges_across_media(self):
+        messages = [
+            SMS(body="a"),
+            SMS(body="b", media_url="https://example.com/cat.gif"),
+            SMS(body="c"),
+            SMS(body="d"),
+        ]
+        self.assertEqual(
+            [messages[0], messages[1], SMS(body="c\n\nd")], merge_messages(messages, ENABLED)
+        )
+
+    def test_merges_when_it_adds_no_segments(self):
+        # 100 + 2 + 100 GSM characters needs 2 segments, the same as sending both
+        self.assertEqual(
+            1, len(merge_messages([SMS(body="a" * 100), SMS(body="b" * 100)], ENABLED))
+        )
+
+    def test_does_not_merge_when_it_adds_segments(self):
+        # 160 + 2 + 160 GSM characters needs 3 segments, one more than sending both
+        messages = [SMS(body="a" * 160), SMS(body="b" * 160)]
+        self.assertEqual(messages, merge_messages(messages, ENABLED))
+        # a GSM message merged with a UCS-2 message is re-encoded as UCS-2
+        messages = [SMS(body="a" * 150), SMS(body="🤖")]
+        self.assertEqual(messages, merge_messages(messages, ENABLED))
+
+    def test_respects_max_segments(self):
+        messages = [SMS(body="a" * 100), SMS(body="b" * 100)]
+        self.assertEqual(
+            messages, merge_messages(messages, MergePolicy(enabled=True, max_segments=1))
+        )
+
+    def test_skips_empty_messages(self):
+        messages = [SMS(body="a"), SMS(body=None), SMS(body="b")]
+        self.assertEqual(messages, merge_messages(messages, ENABLED))
+
+
+class TestMergePolicy(unittest.TestCase):
+    @patch.dict(
+        "os.environ",
+        {"SMS_MERGE_POLICY": '{"default": {"enabled": true}, "MG1": {"separator": " "}}'},
+    )
+    def test_policy_per_messaging_service(self):
+        self.assertEqual(MergePolicy(enabled=True), get_merge_policy(None))
+        self.assertEqual(MergePolicy(enabled=True), get_merge_policy("MG2"))
+        self.assertEqual(MergePolicy(separator=" "), get_merge_policy("MG1"))
+
+    @patch.dict("os.environ", {"SMS_MERGE_POLICY": ""})
+    def test_no_policy(self):
+        self.assertEqual(MergePolicy(), get_merge_policy("MG1"))
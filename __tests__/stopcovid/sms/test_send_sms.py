@@ -150,3 +150,22 @@ class TestSendSMS(unittest.TestCase):
         ]
         send_sms_batches(batches)
         self.assertEqual(sleep_mock.call_count, 0)
+
+    @patch.dict("os.environ", {"SMS_MERGE_POLICY": '{"MG1": {"enabled": true}}'})
+    def test_merges_messages_when_enabled(self, sleep_mock, twilio_mock, *args):
+        messages = [SMS(body="hello"), SMS(body="how are you"), SMS(body="goodbye")]
+        send_sms_batches(
+            [
+                SMSBatch(
+                    phone_number="+14801234321",
+                    messages=messages,
+                    idempotency_key="foo",
+                    messaging_service_sid="MG1",
+                ),
+                SMSBatch(phone_number="+14801234321", messages=messages, idempotency_key="bar"),
+            ]
+        )
+        call_args = self._get_twilio_call_args(twilio_mock)
+        self.assertEqual(4, len(call_args))
+        self.assertEqual("hello\n\nhow are you\n\ngoodbye", call_args[0][1])
+        self.assertEqual(2, sleep_mock.call_count)
@@ -0,0 +1,163 @@
+import json
+import unittest
+import uuid
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from stopcovid.dialog.models.events import (
+    DialogEventBatch,
+    FailedPrompt,
+    UserValidated,
+)
+from stopcovid.dialog.models.state import UserProfile
+from stopcovid.dialog.registration import AccountInfo, CodeValidationPayload
+from stopcovid.drills.drills import Prompt, PromptMessage
+from stopcovid.utils import dynamodb as dynamodb_utils
+
+
+class TestDeserializeToJSON(unittest.TestCase):
+    def test_matches_model_json(self):
+        user_profile = UserProfile(
+            validated=True,
+            language="en",
+            account_info=AccountInfo(employer_id=165, unit_id=429, employer_name="Crab Shack"),
+        )
+        batch = DialogEventBatch(
+            phone_number="123456789",
+            seq="216",
+            user_profile=user_profile,
+            events=[
+                UserValidated(
+                    phone_number="123456789",
+                    user_profile=user_profile,
+                    code_validation_payload=CodeValidationPayload(
+                        valid=True, account_info=user_profile.account_info
+                    ),
+                ),
+                FailedPrompt(
+                    phone_number="123456789",
+                    user_profile=user_profile,
+                    prompt=Prompt(slug="one", messages=[PromptMessage(text="one")]),
+                    abandoned=False,
+                    response=None,
+                    drill_instance_id=uuid.uuid4(),
+                ),
+            ],
+        )
+        item = dynamodb_utils.serialize(json.loads(batch.json()))
+        self.assertEqual(
+            json.loads(batch.json()), json.loads(dynamodb_utils.deserialize_to_json(item))
+        )
+
+    def test_decimals(self):
+        item = dynamodb_utils.serialize({"count": Decimal(3), "ratio": Decimal("0.5")})
+        self.assertEqual(
+            {"count": 3, "ratio": 0.5}, json.loads(dynamodb_utils.deserialize_to_json(item))
+        )
+
+
+class TestBatchWrite(unittest.TestCase):
+    @patch("stopcovid.utils.dynamodb.time.sleep")
+    def test_chunks_and_retries_unprocessed_items(self, sleep_mock):
+        dynamodb = MagicMock()
+        requests = [{"DeleteRequest": {"Key": {"id": {"S": str(i)}}}} for i in range(30)]
+        dynamodb.batch_write_item.side_effect = [
+            {"UnprocessedItems": {"table": requests[:2]}},
+            {"UnprocessedItems": {}},
+            {},
+        ]
+        dynamodb_utils.batch_write(dynamodb, "table", requests)
+        calls = [
+            call[1]["RequestItems"]["table"] for call in dynamodb.batch_write_item.call_args_list
+        ]
+        self.assertEqual([requests[:25], requests[:2], requests[25:]], calls)
+
+    @patch("stopcovid.utils.dynamodb.time.sleep")
+    def test_gives_up(self, sleep_mock):
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.return_value = {"UnprocessedItems": {"table": [{}]}}
+        with self.assertRaises(RuntimeError):
+            dynamodb_utils.batch_write(dynamodb, "table", [{}])
+
+
+class TestQueryItems(unittest.TestCase):
+    def test_follows_pages(self):
+        dynamodb = MagicMock()
+        dynamodb.query.side_effect = [
+            {"Items": [{"id": 1}], "LastEvaluatedKey": {"id": 1}},
+            {"Items": [{"id": 2}]},
+        ]
+        self.assertEqual(
+            [{"id": 1}, {"id": 2}], list(dynamodb_utils.query_items(dynamodb, TableName="table"))
+        )
+        self.assertEqual({"id": 1}, dynamodb.query.call_args[1]["ExclusiveStartKey"])
+
+
+class TestProjectionExpression(unittest.TestCase):
+    def test_substitutes_every_name(self):
+        projection, names = dynamodb_utils.projection_expression(
+            ["phone_number", "user_profile.language", "user_profile.opted_out"]
+        )
+        self.assertEqual("#a0, #a1.#a2, #a1.#a3", projection)
+        self.assertEqual(
+            {"#a0": "phone_number", "#a1": "user_profile", "#a2": "language", "#a3": "opted_out"},
+            names,
+        )
+
+
+class TestParallelScan(unittest.TestCase):
+    def _dynamodb(self, pages_by_segment):
+        def scan(**kwargs):
+            pages = pages_by_segment[kwargs["Segment"]]
+            page = int(kwargs.get("ExclusiveStartKey", {}).get("page", 0))
+            response = {"Items": pages[page], "ConsumedCapacity": {"CapacityUnits": 2.0}}
+            if page + 1 < len(pages):
+                response["LastEvaluatedKey"] = {"page": page + 1}
+            return response
+
+        dynamodb = MagicMock()
+        dynamodb.scan.side_effect = scan
+        return dynamodb
+
+    def test_scans_every_segment(self):
+        dynamodb = self._dynamodb(
+            {0: [[{"id": 1}, {"id": 2}], [{"id": 3}]], 1: [[]], 2: [[{"id": 4}]]}
+        )
+        items = list(
+            dynamodb_utils.parallel_scan(
+                dynamodb, total_segments=3, TableName="table", ProjectionExpression="id"
+            )
+        )
+        self.assertEqual([1, 2, 3, 4], sorted(item["id"] for item in items))
+        for call in dynamodb.scan.call_args_list:
+            self.assertEqual("table", call[1]["TableName"])
+            self.assertEqual("id", call[1]["ProjectionExpression"])
+            self.assertEqual(3, call[1]["TotalSegments"])
+            self.assertNotIn("ReturnConsumedCapacity", call[1])
+        self.assertEqual(4, dynamodb.scan.call_count)
+
+    def test_raises_segment_errors(self):
+        dynamodb = self._dynamodb({0: [[{"id": 1}]]})
+        dynamodb.scan.side_effect = [RuntimeError("throttled")]
+        with self.assertRaises(RuntimeError):
+            list(dynamodb_utils.parallel_scan(dynamodb, total_segments=1, TableName="table"))
+
+    def test_stops_when_caller_stops(self):
+        dynamodb = self._dynamodb({0: [[{"id": i}] for i in range(100)]})
+        items = dynamodb_utils.parallel_scan(dynamodb, total_segments=1, TableName="table")
+        self.assertEqual({"id": 0}, next(items))
+        items.close()
+        self.assertLess(dynamodb.scan.call_count, 100)
+
+    @patch("stopcovid.utils.dynamodb.time.sleep")
+    def test_paces_consumed_capacity(self, sleep_mock):
+        dynamodb = self._dynamodb({0: [[{"id": 1}], [{"id": 2}], [{"id": 3}]]})
+        with patch("stopcovid.utils.dynamodb.time.monotonic", return_value=100.0):
+            list(
+                dynamodb_utils.parallel_scan(
+                    dynamodb, total_segments=1, max_capacity_per_second=1, TableName="table"
+                )
+            )
+        self.assertEqual("TOTAL", dynamodb.scan.call_args[1]["ReturnConsumedCapacity"])
+        # each page consumes 2 units, at 1 unit per second
+        self.assertEqual([2.0, 4.0], [call[0][0] for call in sleep_mock.call_args_list])
@@ -0,0 +1,46 @@
+import io
+import json
+import unittest
+from decimal import Decimal
+
+from stopcovid.utils import export
+
+ITEMS = [
+    {"phone_number": "+15551234567", "user_profile": {"language": "en", "opted_out": False}},
+    {"phone_number": "+15557654321", "user_profile": {"account_info": {"employer_id": Decimal(3)}}},
+]
+COLUMNS = ["phone_number", "user_profile.language", "user_profile.account_info.employer_id"]
+
+
+class TestWriteItems(unittest.TestCase):
+    def test_text(self):
+        out = io.StringIO()
+        self.assertEqual(2, export.write_items(ITEMS, COLUMNS, "text", out))
+        self.assertEqual("+15551234567\ten\t\n+15557654321\t\t3\n", out.getvalue())
+
+    def test_jsonl(self):
+        out = io.StringIO()
+        export.write_items(ITEMS, COLUMNS, "jsonl", out)
+        self.assertEqual(
+            [
+                {
+                    "phone_number": "+15551234567",
+                    "user_profile.language": "en",
+                    "user_profile.account_info.employer_id": None,
+                },
+                {
+                    "phone_number": "+15557654321",
+                    "user_profile.language": None,
+                    "user_profile.account_info.employer_id": 3,
+                },
+            ],
+            [json.loads(line) for line in out.getvalue().splitlines()],
+        )
+
+    def test_csv(self):
+        out = io.StringIO()
+        export.write_items(ITEMS, ["phone_number", "user_profile"], "csv", out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual("phone_number,user_profile", lines[0])
+        self.assertEqual('+15551234567,"{""language"": ""en"", ""opted_out"": false}"', lines[1])
+        self.assertEqual(3, len(lines))
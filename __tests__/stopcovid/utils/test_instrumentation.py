@@ -0,0 +1,74 @@
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from stopcovid.utils import instrumentation
+from stopcovid.utils.instrumentation import (
+    MetricsRecorder,
+    MAX_VALUES_PER_METRIC,
+    flush_metrics,
+    increment,
+    timer,
+)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def _flush(self, function_name: str = "handle_command"):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            flush_metrics(function_name)
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_emits_embedded_metric_format(self):
+        with patch.object(instrumentation, "RECORDER", MetricsRecorder(enabled=True)):
+            with timer("execute_command"):
+                pass
+            with timer("execute_command"):
+                pass
+            increment("commands_processed")
+            increment("events_produced", 3)
+            records = self._flush()
+
+        self.assertEqual(1, len(records))
+        record = records[0]
+        self.assertEqual("handle_command", record["function"])
+        self.assertEqual(2, len(record["execute_command"]))
+        self.assertEqual(1, record["commands_processed"])
+        self.assertEqual(3, record["events_produced"])
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual([["function"]], directive["Dimensions"])
+        self.assertEqual(
+            {
+                "execute_command": "Milliseconds",
+                "commands_processed": "Count",
+                "events_produced": "Count",
+            },
+            {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]},
+        )
+
+    def test_flush_resets(self):
+        with patch.object(instrumentation, "RECORDER", MetricsRecorder(enabled=True)):
+            increment("commands_processed")
+            self.assertEqual(1, len(self._flush()))
+            self.assertEqual([], self._flush())
+
+    def test_splits_large_timing_series(self):
+        with patch.object(instrumentation, "RECORDER", MetricsRecorder(enabled=True)):
+            for _ in range(MAX_VALUES_PER_METRIC + 1):
+                with timer("twilio_send_message"):
+                    pass
+            records = self._flush()
+        self.assertEqual(2, len(records))
+        self.assertEqual(MAX_VALUES_PER_METRIC, len(records[0]["twilio_send_message"]))
+        self.assertEqual(1, len(records[1]["twilio_send_message"]))
+
+    def test_disabled(self):
+        with patch.object(instrumentation, "RECORDER", MetricsRecorder(enabled=False)):
+            with timer("execute_command") as execute_timer:
+                pass
+            increment("commands_processed")
+            self.assertEqual([], self._flush())
+        # elapsed time is still available to callers when metrics are disabled
+        self.assertGreaterEqual(execute_timer.elapsed_ms, 0)
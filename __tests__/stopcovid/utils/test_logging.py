@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from stopcovid.utils.logging import LazyField, log_structured, should_sample
+
+
+class TestLogStructured(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.NOTSET)
+        self.addCleanup(logging.disable, logging.CRITICAL)
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        root = logging.getLogger()
+        self.original_level = root.level
+        root.addHandler(self.handler)
+        root.setLevel(logging.INFO)
+        self.addCleanup(root.removeHandler, self.handler)
+        self.addCleanup(root.setLevel, self.original_level)
+
+    def _records(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_emits_json_record(self):
+        log_structured(logging.INFO, "hello", phone_number="123", event_types=["FOO"])
+        self.assertEqual(
+            [{"message": "hello", "phone_number": "123", "event_types": ["FOO"]}],
+            self._records(),
+        )
+
+    def test_debug_fields_not_computed_at_info(self):
+        compute = MagicMock(return_value="big")
+        log_structured(logging.INFO, "hello", state=LazyField(compute))
+        compute.assert_not_called()
+        self.assertEqual([{"message": "hello"}], self._records())
+
+    def test_debug_fields_computed_at_debug(self):
+        logging.getLogger().setLevel(logging.DEBUG)
+        log_structured(logging.INFO, "hello", state=LazyField(lambda: {"seq": "1"}))
+        self.assertEqual([{"message": "hello", "state": {"seq": "1"}}], self._records())
+
+    def test_debug_fields_computed_when_sampled(self):
+        log_structured(logging.INFO, "hello", sampled=True, state=LazyField(lambda: "big"))
+        self.assertEqual([{"message": "hello", "state": "big"}], self._records())
+
+    def test_nothing_computed_when_level_disabled(self):
+        compute = MagicMock(return_value="cheap")
+        log_structured(logging.DEBUG, "hello", command=LazyField(compute, level=logging.INFO))
+        compute.assert_not_called()
+        self.assertEqual("", self.stream.getvalue())
+
+    def test_should_sample(self):
+        with patch.dict(os.environ, {"LOG_SAMPLE_RATE": "0"}):
+            self.assertFalse(should_sample())
+        with patch.dict(os.environ, {"LOG_SAMPLE_RATE": "1"}):
+            self.assertTrue(should_sample())
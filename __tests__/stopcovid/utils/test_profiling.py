@@ -0,0 +1,73 @@
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from stopcovid.utils.profiling import profile_handler, SamplingProfiler
+
+
+def _busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@profile_handler
+def handler(event: dict, context: dict) -> dict:
+    _busy(0.05)
+    return {"statusCode": 200}
+
+
+@patch("stopcovid.utils.profiling.log_structured")
+class TestProfileHandler(unittest.TestCase):
+    def test_not_profiled_by_default(self, log_mock):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual({"statusCode": 200}, handler({}, {}))
+        log_mock.assert_not_called()
+
+    def test_cprofile(self, log_mock):
+        with patch.dict(os.environ, {"PROFILE_SAMPLE_RATE": "1", "PROFILE_TOP_N": "5"}):
+            self.assertEqual({"statusCode": 200}, handler({}, {}))
+        log_mock.assert_called_once()
+        fields = log_mock.call_args[1]
+        self.assertEqual("cprofile", fields["mode"])
+        self.assertTrue(fields["function"].endswith(".handler"))
+        self.assertTrue(any("_busy" in line for line in fields["top"]))
+
+    def test_sampling(self, log_mock):
+        with patch.dict(os.environ, {"PROFILE_SAMPLE_RATE": "1", "PROFILE_MODE": "sampling"}):
+            self.assertEqual({"statusCode": 200}, handler({}, {}))
+        fields = log_mock.call_args[1]
+        self.assertEqual("sampling", fields["mode"])
+        self.assertGreater(fields["samples"], 0)
+        self.assertIn(":_busy", fields["top"][0])
+
+    def test_writes_profile_locally(self, log_mock):
+        with patch.dict(os.environ, {"PROFILE_SAMPLE_RATE": "1", "STAGE": "local"}):
+            handler({}, {})
+        path = log_mock.call_args[1]["path"]
+        self.addCleanup(os.remove, path)
+        self.assertTrue(os.path.exists(path))
+
+    def test_profiles_even_if_handler_raises(self, log_mock):
+        @profile_handler
+        def failing_handler(event: dict, context: dict) -> dict:
+            raise ValueError("oops")
+
+        with patch.dict(os.environ, {"PROFILE_SAMPLE_RATE": "1"}):
+            with self.assertRaises(ValueError):
+                failing_handler({}, {})
+        log_mock.assert_called_once()
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_collapsed_stacks(self):
+        profiler = SamplingProfiler(interval_seconds=0.001)
+        profiler.start()
+        _busy(0.03)
+        profiler.stop()
+        stacks = profiler.collapsed_stacks()
+        self.assertTrue(stacks)
+        stack, count = stacks[0].rsplit(" ", 1)
+        self.assertIn(";", stack)
+        self.assertGreater(int(count), 0)
@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from stopcovid.utils import rollbar
+
+
+class TestLambdaFunction(unittest.TestCase):
+    def setUp(self) -> None:
+        self.rollbar_module = MagicMock()
+        get_rollbar_patch = patch(
+            "stopcovid.utils.rollbar._get_rollbar", return_value=self.rollbar_module
+        )
+        get_rollbar_patch.start()
+        self.addCleanup(get_rollbar_patch.stop)
+        configured_patch = patch("stopcovid.utils.rollbar._configured", True)
+        configured_patch.start()
+        self.addCleanup(configured_patch.stop)
+
+    def test_returns_handler_result(self):
+        @rollbar.lambda_function
+        def handler(event, context):
+            return {"statusCode": 200}
+
+        with patch("stopcovid.utils.rollbar._rollbar", None):
+            self.assertEqual({"statusCode": 200}, handler({}, {}))
+        self.rollbar_module.report_exc_info.assert_not_called()
+        self.rollbar_module.wait.assert_not_called()
+
+    def test_waits_for_reports_made_by_handler(self):
+        @rollbar.lambda_function
+        def handler(event, context):
+            rollbar.report_exc_info(extra_data={"foo": "bar"})
+            return {"statusCode": 200}
+
+        with patch("stopcovid.utils.rollbar._rollbar", self.rollbar_module):
+            self.assertEqual({"statusCode": 200}, handler({}, {}))
+        self.rollbar_module.wait.assert_called_once()
+
+    def test_reports_and_reraises(self):
+        @rollbar.lambda_function
+        def handler(event, context):
+            raise ValueError("oops")
+
+        with self.assertRaises(ValueError):
+            handler({}, {})
+        self.rollbar_module.report_exc_info.assert_called_once()
+        self.assertIs(ValueError, self.rollbar_module.report_exc_info.call_args[0][0][0])
+        self.rollbar_module.wait.assert_called_once()
+
+    def test_report_exc_info(self):
+        rollbar.report_exc_info(extra_data={"foo": "bar"})
+        self.rollbar_module.report_exc_info.assert_called_once_with(extra_data={"foo": "bar"})
@@ -0,0 +1,110 @@
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from stopcovid.utils import sqs
+
+
+def _entry(i, body="body"):
+    return {"Id": str(i), "MessageBody": body}
+
+
+class TestChunkEntries(unittest.TestCase):
+    def test_chunks_by_size(self):
+        entries = [_entry(i, "x" * 100 * 1024) for i in range(5)]
+        chunks = sqs.chunk_entries(entries)
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        for chunk in chunks:
+            self.assertLessEqual(sum(sqs.entry_size(entry) for entry in chunk), sqs.MAX_BATCH_BYTES)
+
+    def test_entry_size_includes_attributes(self):
+        entry = {
+            "Id": "1",
+            "MessageBody": "é",
+            "MessageAttributes": {"name": {"DataType": "String", "StringValue": "value"}},
+        }
+        self.assertEqual(2 + 4 + 6 + 5, sqs.entry_size(entry))
+
+
+@patch("stopcovid.utils.sqs.RETRY_DELAY_SECONDS", 0)
+@patch("stopcovid.utils.sqs.get_boto3_client")
+class TestSendMessageBatches(unittest.TestCase):
+    def setUp(self):
+        sqs.get_client.cache_clear()
+        sqs.get_queue_url.cache_clear()
+
+    def _mock_client(self, get_client_mock, responses=None):
+        client = MagicMock()
+        client.get_queue_url = MagicMock(return_value={"QueueUrl": "queue-url"})
+        lock = threading.Lock()
+        self.sent = []
+
+        def send_message_batch(QueueUrl, Entries):
+            with lock:
+                self.sent.append([entry["Id"] for entry in Entries])
+                if responses:
+                    return responses.pop(0)
+            return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+        client.send_message_batch = MagicMock(side_effect=send_message_batch)
+        get_client_mock.return_value = client
+        return client
+
+    def test_no_entries(self, get_client_mock):
+        client = self._mock_client(get_client_mock)
+        sqs.send_message_batches("queue", [])
+        client.get_queue_url.assert_not_called()
+        client.send_message_batch.assert_not_called()
+
+    def test_chunks_by_entry_count(self, get_client_mock):
+        self._mock_client(get_client_mock)
+        sqs.send_message_batches("queue", [_entry(i) for i in range(25)])
+        self.assertEqual([10, 10, 5], sorted((len(ids) for ids in self.sent), reverse=True))
+        self.assertEqual(
+            sorted(str(i) for i in range(25)), sorted(id for ids in self.sent for id in ids)
+        )
+
+    def test_queue_url_is_cached(self, get_client_mock):
+        client = self._mock_client(get_client_mock)
+        sqs.send_message_batches("queue", [_entry(1)])
+        sqs.send_message_batches("queue", [_entry(2)])
+        client.get_queue_url.assert_called_once_with(QueueName="queue")
+        get_client_mock.assert_called_once_with("sqs")
+
+    def test_retries_only_failed_entries(self, get_client_mock):
+        self._mock_client(
+            get_client_mock,
+            responses=[
+                {
+                    "Successful": [{"Id": "0"}, {"Id": "2"}],
+                    "Failed": [{"Id": "1", "SenderFault": False, "Code": "InternalError"}],
+                },
+            ],
+        )
+        sqs.send_message_batches("queue", [_entry(i) for i in range(3)])
+        self.assertEqual([["0", "1", "2"], ["1"]], self.sent)
+
+    def test_sender_faults_are_not_retried(self, get_client_mock):
+        self._mock_client(
+            get_client_mock,
+            responses=[
+                {
+                    "Successful": [{"Id": "0"}],
+                    "Failed": [
+                        {"Id": "1", "SenderFault": True, "Code": "InvalidMessageContents"},
+                        {"Id": "2", "SenderFault": False, "Code": "InternalError"},
+                    ],
+                },
+            ],
+        )
+        with self.assertRaises(sqs.SQSPublishError) as context:
+            sqs.send_message_batches("queue", [_entry(i) for i in range(3)])
+        self.assertEqual([["0", "1", "2"], ["2"]], self.sent)
+        self.assertEqual(["1"], [failure["Id"] for failure in context.exception.failed])
+
+    def test_raises_after_max_attempts(self, get_client_mock):
+        failure = {"Successful": [], "Failed": [{"Id": "0", "SenderFault": False}]}
+        self._mock_client(get_client_mock, responses=[failure] * sqs.MAX_ATTEMPTS)
+        with self.assertRaises(sqs.SQSPublishError):
+            sqs.send_message_batches("queue", [_entry(0)])
+        self.assertEqual(sqs.MAX_ATTEMPTS, len(self.sent))
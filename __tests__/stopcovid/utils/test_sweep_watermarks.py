@@ -0,0 +1,27 @@
+import os
+import unittest
+
+from stopcovid.utils.sweep_watermarks import SweepWatermarkRepository
+
+
+class TestSweepWatermarks(unittest.TestCase):
+    """
+    requires local dynamoDB to be running: docker-compose up in the dynamodb_local directory
+    """
+
+    def setUp(self) -> None:
+        os.environ["STAGE"] = "test"
+        self.repo = SweepWatermarkRepository(
+            region_name="us-west-2",
+            endpoint_url="http://localhost:9000",
+            aws_access_key_id="fake-key",
+            aws_secret_access_key="fake-secret",
+        )
+        self.repo.drop_and_recreate_table()
+
+    def test_save_and_fetch(self):
+        self.assertIsNone(self.repo.fetch_watermark("reminders"))
+        self.repo.save_watermark("reminders", 1588341600)
+        self.repo.save_watermark("reminders", 1588341660)
+        self.assertEqual(1588341660, self.repo.fetch_watermark("reminders"))
+        self.assertIsNone(self.repo.fetch_watermark("other"))
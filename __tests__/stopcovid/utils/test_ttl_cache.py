@@ -0,0 +1,28 @@
+import unittest
+
+from stopcovid.utils.ttl_cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.cache = TTLCache(maxsize=2, clock=lambda: self.now)
+
+    def test_entries_expire_after_their_own_ttl(self):
+        self.cache.set("short", 1, ttl_seconds=10)
+        self.cache.set("long", 2, ttl_seconds=100)
+        self.now = 9
+        self.assertEqual(1, self.cache.get("short"))
+        self.now = 10
+        self.assertIsNone(self.cache.get("short"))
+        self.assertEqual(2, self.cache.get("long"))
+        self.assertEqual(1, len(self.cache))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set("a", 1, ttl_seconds=10)
+        self.cache.set("b", 2, ttl_seconds=10)
+        self.cache.get("a")
+        self.cache.set("c", 3, ttl_seconds=10)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(1, self.cache.get("a"))
+        self.assertEqual(3, self.cache.get("c"))
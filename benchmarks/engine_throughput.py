@@ -0,0 +1,154 @@
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.workload import ScriptedCommand, WorkloadMix, build_workload, deterministic
+from stopcovid.dialog.engine import process_command
+from stopcovid.dialog.persistence import (
+    DialogRepository,
+    InMemoryDialogRepository,
+    SQLiteDialogRepository,
+)
+
+# Drives process_command with a scripted workload against a local repository and reports
+# throughput, latency percentiles and allocations per kind of command, as JSON:
+#
+#   python -m benchmarks.engine_throughput --users 500 --output engine.json
+#
+# Ids and times are seeded, so the same arguments always produce the same dialog states. The
+# state digest in the report changes only if the engine's behavior does.
+
+# simulated time between consecutive commands
+COMMAND_INTERVAL = datetime.timedelta(seconds=1)
+
+
+def _make_repo(kind: str) -> DialogRepository:
+    if kind == "sqlite":
+        return SQLiteDialogRepository()
+    return InMemoryDialogRepository()
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    # nearest rank
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _run(
+    workload: List[ScriptedCommand], repo_kind: str, seed: int, trace_memory: bool
+) -> Tuple[Dict[str, List[float]], DialogRepository]:
+    # returns the per-command measurements for each kind of command (latencies in microseconds,
+    # or bytes allocated at peak while the command ran if trace_memory is set) and the repo
+    repo = _make_repo(repo_kind)
+    measurements: Dict[str, List[float]] = {}
+    with deterministic(seed) as clock:
+        start_time = clock.now
+        for seq, (kind, command) in enumerate(workload, start=1):
+            clock.now = start_time + seq * COMMAND_INTERVAL
+            if trace_memory:
+                tracemalloc.clear_traces()
+                process_command(command, str(seq), repo=repo)
+                measurement = float(tracemalloc.get_traced_memory()[1])
+            else:
+                start = time.perf_counter()
+                process_command(command, str(seq), repo=repo)
+                measurement = (time.perf_counter() - start) * 1e6
+            measurements.setdefault(kind, []).append(measurement)
+    return measurements, repo
+
+
+def _state_digest(repo: DialogRepository, workload: List[ScriptedCommand]) -> str:
+    digest = hashlib.sha256()
+    for phone_number in sorted({scripted.command.phone_number for scripted in workload}):
+        digest.update(repo.fetch_dialog_state(phone_number).json(sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _peak_rss_kib() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    # kilobytes on Linux
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def benchmark(
+    users: int, seed: int, repo_kind: str, mix: WorkloadMix, trace_memory: bool = True
+) -> dict:
+    workload = build_workload(users, seed, mix)
+    wall_start = time.perf_counter()
+    latencies, repo = _run(workload, repo_kind, seed, trace_memory=False)
+    elapsed = time.perf_counter() - wall_start
+
+    allocations: Dict[str, List[float]] = {}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            allocations, _ = _run(workload, repo_kind, seed, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+
+    by_kind = {}
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        by_kind[kind] = {
+            "count": len(values),
+            "p50_us": round(_percentile(values, 0.5), 1),
+            "p99_us": round(_percentile(values, 0.99), 1),
+            "mean_us": round(sum(values) / len(values), 1),
+        }
+        if kind in allocations:
+            by_kind[kind]["peak_alloc_bytes_mean"] = round(
+                sum(allocations[kind]) / len(allocations[kind])
+            )
+    all_latencies = sorted(value for values in latencies.values() for value in values)
+    return {
+        "config": {"users": users, "seed": seed, "repo": repo_kind, "mix": mix._asdict()},
+        "commands": len(workload),
+        "seconds": round(elapsed, 4),
+        "commands_per_second": round(len(workload) / elapsed),
+        "p50_us": round(_percentile(all_latencies, 0.5), 1),
+        "p99_us": round(_percentile(all_latencies, 0.99), 1),
+        "by_kind": by_kind,
+        "peak_rss_kib": _peak_rss_kib(),
+        "state_digest": _state_digest(repo, workload),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repo", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--drills-per-user", type=int, default=2)
+    parser.add_argument("--wrong", type=float, default=0.25)
+    parser.add_argument("--opt-out", type=float, default=0.05)
+    parser.add_argument(
+        "--no-tracemalloc", action="store_true", help="skip the allocation measurement pass"
+    )
+    parser.add_argument("--output", help="write the report to this file instead of stdout")
+    args = parser.parse_args()
+
+    # the engine's logging isn't what's being measured
+    logging.getLogger().setLevel(logging.ERROR)
+    mix = WorkloadMix(drills_per_user=args.drills_per_user, wrong=args.wrong, opt_out=args.opt_out)
+    report = json.dumps(
+        benchmark(args.users, args.seed, args.repo, mix, trace_memory=not args.no_tracemalloc),
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
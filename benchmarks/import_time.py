@@ -0,0 +1,125 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Measures what each lambda handler pays at import time, i.e. during a cold start.
+#
+#   python -m benchmarks.import_time                       # report
+#   python -m benchmarks.import_time --save baseline.json  # record a baseline
+#   python -m benchmarks.import_time --baseline baseline.json --tolerance 0.2
+#
+# The last form exits non-zero if any handler's cold start regressed by more than the tolerance.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_DEPENDENCIES = ["boto3", "jinja2", "pydantic", "requests", "rollbar", "twilio"]
+
+
+def handler_modules() -> List[str]:
+    paths = glob.glob(os.path.join(REPO_ROOT, "stopcovid", "*", "aws_lambdas", "*.py"))
+    modules = [
+        os.path.relpath(path, REPO_ROOT)[: -len(".py")].replace(os.sep, ".")
+        for path in paths
+        if not path.endswith("__init__.py")
+    ]
+    return sorted(modules)
+
+
+def _environment() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("STAGE", "local")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env["PYTHONPATH"] = REPO_ROOT
+    return env
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    # returns (module, self_us, cumulative_us, depth) for every "import time:" line
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def measure(module: str, repeat: int) -> dict:
+    wall_ms = []
+    imports: List[Tuple[str, int, int, int]] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=_environment(),
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        wall_ms.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+        imports = _parse_importtime(result.stderr)
+
+    imported = {name for name, _, _, _ in imports}
+    cumulative = {name: cumulative_us for name, _, cumulative_us, _ in imports}
+    handler_children = [
+        (name, cumulative_us) for name, _, cumulative_us, depth in imports if depth == 1
+    ]
+    return {
+        "import_ms": round(cumulative.get(module, 0) / 1000, 2),
+        "process_wall_ms": round(statistics.median(wall_ms), 2),
+        "modules_imported": len(imported),
+        "heavy_dependencies": sorted(
+            dependency for dependency in HEAVY_DEPENDENCIES if dependency in imported
+        ),
+        "top_imports": [
+            {"module": name, "cumulative_ms": round(cumulative_us / 1000, 2)}
+            for name, cumulative_us in sorted(handler_children, key=lambda c: -c[1])[:10]
+        ],
+    }
+
+
+def _regressions(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for module, result in results.items():
+        if module not in baseline:
+            continue
+        before = baseline[module]["import_ms"]
+        after = result["import_ms"]
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{module}: {before}ms -> {after}ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", action="append", help="defaults to every lambda handler")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write results to this file")
+    parser.add_argument("--baseline", help="compare results to a file written with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = {module: measure(module, args.repeat) for module in args.module or handler_modules()}
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = _regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Cold start regressions:\n" + "\n".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
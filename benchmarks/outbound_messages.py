@@ -0,0 +1,105 @@
+import argparse
+import json
+import random
+import time
+import uuid
+from typing import List
+
+from stopcovid.dialog.models.events import (
+    AdvancedToNextPrompt,
+    CompletedPrompt,
+    DialogEvent,
+    DrillCompleted,
+    DrillStarted,
+    FailedPrompt,
+)
+from stopcovid.dialog.models.state import UserProfile
+from stopcovid.drills.bundle import get_drill_loader
+from stopcovid.sms.enqueue_outbound_sms import get_outbound_sms_commands
+
+# Pushes synthetic event batches, shaped like the ones a drill produces, through
+# get_outbound_sms_commands.
+#
+#   python -m benchmarks.outbound_messages --batches 10000
+
+
+def _batches(count: int, seed: int) -> List[List[DialogEvent]]:
+    rng = random.Random(seed)
+    loader = get_drill_loader()
+    drills = [
+        loader.get_drill(slug)
+        for language in ["en", "es"]
+        for slug in loader.get_slugs_for_language(language)
+    ]
+    batches: List[List[DialogEvent]] = []
+    for i in range(count):
+        drill = rng.choice(drills)
+        prompt = rng.choice(drill.prompts)
+        profile = UserProfile(validated=True, language=drill.slug[-2:])
+        common = {
+            "phone_number": f"+1555{i % 1000:07d}",
+            "user_profile": profile,
+            "drill_instance_id": uuid.UUID(int=rng.getrandbits(128)),
+        }
+        kind = rng.random()
+        if kind < 0.1:
+            batch: List[DialogEvent] = [
+                DrillStarted(drill=drill, first_prompt=drill.first_prompt(), **common)
+            ]
+        elif kind < 0.6:
+            batch = [
+                CompletedPrompt(prompt=prompt, response="a", **common),
+                AdvancedToNextPrompt(prompt=prompt, **common),
+            ]
+        elif kind < 0.8:
+            batch = [FailedPrompt(prompt=prompt, response="b", abandoned=False, **common)]
+        elif kind < 0.9:
+            batch = [
+                FailedPrompt(prompt=prompt, response="b", abandoned=True, **common),
+                AdvancedToNextPrompt(prompt=prompt, **common),
+            ]
+        else:
+            batch = [
+                CompletedPrompt(prompt=prompt, response="a", **common),
+                DrillCompleted(last_prompt_response="a", **common),
+            ]
+        batches.append(batch)
+    return batches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="report the fastest of this many runs"
+    )
+    args = parser.parse_args()
+
+    batches = _batches(args.batches, args.seed)
+    events = sum(len(batch) for batch in batches)
+    timings = []
+    for _ in range(args.repeat):
+        messages = 0
+        start = time.perf_counter()
+        for batch in batches:
+            messages += len(get_outbound_sms_commands(batch))
+        timings.append(time.perf_counter() - start)
+    elapsed = min(timings)
+    print(
+        json.dumps(
+            {
+                "batches": len(batches),
+                "events": events,
+                "messages": messages,
+                "seconds": round(elapsed, 4),
+                "us_per_batch": round(elapsed / len(batches) * 1e6, 2),
+                "batches_per_second": round(len(batches) / elapsed),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
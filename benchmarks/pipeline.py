@@ -0,0 +1,699 @@
+import argparse
+import base64
+import collections
+import contextlib
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from unittest.mock import patch
+from urllib.parse import quote_plus
+
+from benchmarks.workload import (
+    BenchmarkValidator,
+    ScriptedCommand,
+    WorkloadMix,
+    build_workload,
+)
+from stopcovid.dialog.engine import ProcessSMSMessage, StartDrill, UpdateUser
+
+# Replays synthetic traffic through the real lambda handlers, wired together the way they are in
+# AWS, and reports end to end latency and where the time goes:
+#
+#   twilio webhook -> command stream -> handle_command -> dialog-event-batches stream
+#     -> enqueue_sms_batch -> outbound SMS FIFO queue -> send_sms_batch -> Twilio
+#
+#   python -m benchmarks.pipeline --users 200 --kinesis-shards 4 --sqs-batch-size 10
+#
+# AWS is replaced by in-process fakes driven by a discrete event simulation on a virtual clock.
+# Kinesis and DynamoDB streams deliver each shard's records in order to one invocation at a time,
+# and the FIFO queue never hands out a message while an earlier one in its group is in flight.
+# An invocation takes as long in virtual time as the handler takes to run, plus any modeled
+# waits: Twilio API calls and the pacing sleeps between messages. With --cpu-scale 0 only the
+# modeled waits count, which makes a run fully reproducible.
+
+STAGE = "bench"
+PHONE_PREFIX = "+1202"
+TWILIO_AUTH_TOKEN = "bench-token"
+WEBHOOK_HOST = "bench.example.com"
+WEBHOOK_PATH = "/webhooks/twilio"
+# how long SQS remembers a deduplication id
+DEDUPLICATION_WINDOW_SECONDS = 5 * 60
+
+
+@dataclass
+class Trace:
+    # one unit of traffic (an inbound SMS or a published command) and the SMS it led to
+    kind: str
+    origin: float
+    sms_times: List[float] = field(default_factory=list)
+
+
+@dataclass
+class StageStats:
+    waits: List[float] = field(default_factory=list)
+    durations: List[float] = field(default_factory=list)
+    batch_sizes: List[int] = field(default_factory=list)
+
+
+class _LambdaContext:
+    # the handlers' timeouts aren't modeled
+    def get_remaining_time_in_millis(self) -> int:
+        return 60 * 1000
+
+
+class Simulation:
+    def __init__(self, cpu_scale: float) -> None:
+        self.cpu_scale = cpu_scale
+        self.time = 0.0
+        self._queue: List[Tuple[float, int, Callable[[], None]]] = []
+        self._counter = itertools.count()
+        self._invocation: Optional[Tuple[float, float]] = None
+        self._modeled = 0.0
+        # the traffic an invocation's outputs belong to, by what the fakes can look it up by, e.g.
+        # "phone:+1..." or "seq:123"
+        self.context: Dict[str, List[Trace]] = {}
+        self.stages: Dict[str, StageStats] = collections.defaultdict(StageStats)
+
+    def now(self) -> float:
+        if self._invocation is None:
+            return self.time
+        start, real_start = self._invocation
+        return start + (time.perf_counter() - real_start) * self.cpu_scale + self._modeled
+
+    def sleep(self, seconds: float) -> None:
+        # stands in for time.sleep inside handlers
+        self._modeled += seconds
+
+    def traces_for(self, key: str) -> List[Trace]:
+        return self.context.get(key, [])
+
+    def schedule(self, at: float, callback: Callable[[], None]) -> None:
+        heapq.heappush(self._queue, (at, next(self._counter), callback))
+
+    def invoke(
+        self,
+        stage: str,
+        handler: Callable[[dict, Any], Any],
+        event: dict,
+        context: Dict[str, List[Trace]],
+    ) -> float:
+        # runs a handler starting now and returns the virtual time it finished
+        self.context = context
+        self._modeled = 0.0
+        self._invocation = (self.time, time.perf_counter())
+        try:
+            handler(event, _LambdaContext())
+        except Exception:
+            logging.exception(f"{stage} invocation failed")
+        finally:
+            end = self.now()
+            self._invocation = None
+            self.context = {}
+        self.stages[stage].durations.append(end - self.time)
+        return end
+
+    def run(self) -> None:
+        while self._queue:
+            self.time, _, callback = heapq.heappop(self._queue)
+            callback()
+
+
+def shard_for(partition_key: str, shards: int) -> int:
+    # Kinesis splits the 128 bit MD5 hash key space evenly between shards
+    return (int(hashlib.md5(partition_key.encode("utf-8")).hexdigest(), 16) * shards) >> 128
+
+
+@dataclass
+class _Record:
+    arrival: float
+    data: dict
+    traces: List[Trace]
+    key: str
+
+
+class StreamEventSource:
+    # A Kinesis or DynamoDB stream feeding a lambda: each shard's records go to one invocation at
+    # a time, in order, in batches of up to batch_size. A shard waits up to batching_window
+    # seconds for a batch to fill.
+
+    def __init__(
+        self,
+        sim: Simulation,
+        stage: str,
+        handler: Callable[[dict, dict], Any],
+        shards: int,
+        batch_size: int,
+        batching_window: float,
+        poll_delay: float,
+        context_key: Callable[[_Record], str],
+    ) -> None:
+        self.sim = sim
+        self.stage = stage
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batching_window = batching_window
+        self.poll_delay = poll_delay
+        self.context_key = context_key
+        self.shards: List[Deque[_Record]] = [collections.deque() for _ in range(shards)]
+        self.busy = [False] * shards
+
+    def put(self, partition_key: str, data: dict, traces: List[Trace]) -> None:
+        record = _Record(self.sim.now(), data, traces, partition_key)
+        shard = shard_for(partition_key, len(self.shards))
+        self.sim.schedule(record.arrival + self.poll_delay, lambda: self._arrive(shard, record))
+
+    def _arrive(self, shard: int, record: _Record) -> None:
+        self.shards[shard].append(record)
+        if len(self.shards[shard]) >= self.batch_size:
+            self._poll(shard)
+        else:
+            self.sim.schedule(self.sim.time + self.batching_window, lambda: self._poll(shard))
+
+    def _poll(self, shard: int) -> None:
+        records = self.shards[shard]
+        if self.busy[shard] or not records:
+            return
+        if (
+            len(records) < self.batch_size
+            and self.sim.time < records[0].arrival + self.poll_delay + self.batching_window
+        ):
+            return
+        batch = [records.popleft() for _ in range(min(self.batch_size, len(records)))]
+        stats = self.sim.stages[self.stage]
+        stats.batch_sizes.append(len(batch))
+        stats.waits.extend(self.sim.time - record.arrival for record in batch)
+        context: Dict[str, List[Trace]] = collections.defaultdict(list)
+        for record in batch:
+            context[self.context_key(record)].extend(record.traces)
+        self.busy[shard] = True
+        end = self.sim.invoke(
+            self.stage, self.handler, {"Records": [record.data for record in batch]}, context
+        )
+
+        def done() -> None:
+            self.busy[shard] = False
+            self._poll(shard)
+
+        self.sim.schedule(end, done)
+
+
+class FifoQueueEventSource:
+    # An SQS FIFO queue feeding a lambda. Messages are received in batches of up to batch_size
+    # from message groups that have nothing in flight, by up to concurrency invocations at once.
+
+    def __init__(
+        self,
+        sim: Simulation,
+        stage: str,
+        handler: Callable[[dict, dict], Any],
+        batch_size: int,
+        concurrency: int,
+    ) -> None:
+        self.sim = sim
+        self.stage = stage
+        self.handler = handler
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.running = 0
+        self.groups: Dict[str, Deque[_Record]] = collections.OrderedDict()
+        self.in_flight: set = set()
+        self.deduplication: Dict[str, float] = {}
+
+    def send(self, entry: dict, traces: List[Trace]) -> None:
+        now = self.sim.now()
+        deduplication_id = entry["MessageDeduplicationId"]
+        if now - self.deduplication.get(deduplication_id, -DEDUPLICATION_WINDOW_SECONDS) < (
+            DEDUPLICATION_WINDOW_SECONDS
+        ):
+            return
+        self.deduplication[deduplication_id] = now
+        record = _Record(now, {"body": entry["MessageBody"]}, traces, entry["MessageGroupId"])
+        self.sim.schedule(now, lambda: self._arrive(record))
+
+    def _arrive(self, record: _Record) -> None:
+        self.groups.setdefault(record.key, collections.deque()).append(record)
+        self._poll()
+
+    def _receive(self) -> List[_Record]:
+        batch: List[_Record] = []
+        for group, records in self.groups.items():
+            if group in self.in_flight:
+                continue
+            while records and len(batch) < self.batch_size:
+                batch.append(records.popleft())
+            if len(batch) == self.batch_size:
+                break
+        for record in batch:
+            self.in_flight.add(record.key)
+        for group in [group for group, records in self.groups.items() if not records]:
+            del self.groups[group]
+        return batch
+
+    def _poll(self) -> None:
+        while self.running < self.concurrency:
+            batch = self._receive()
+            if not batch:
+                return
+            stats = self.sim.stages[self.stage]
+            stats.batch_sizes.append(len(batch))
+            stats.waits.extend(self.sim.time - record.arrival for record in batch)
+            context: Dict[str, List[Trace]] = collections.defaultdict(list)
+            for record in batch:
+                context[f"phone:{record.key}"].extend(record.traces)
+            self.running += 1
+            end = self.sim.invoke(
+                self.stage, self.handler, {"Records": [record.data for record in batch]}, context
+            )
+            self.sim.schedule(end, lambda batch=batch: self._done(batch))  # type: ignore
+
+    def _done(self, batch: List[_Record]) -> None:
+        self.running -= 1
+        for record in batch:
+            self.in_flight.discard(record.key)
+        self._poll()
+
+
+class FakeKinesis:
+    def __init__(self, sim: Simulation, streams: Dict[str, StreamEventSource]) -> None:
+        self.sim = sim
+        self.streams = streams
+        self.sequence = itertools.count(1)
+        self.discarded = 0
+
+    def put_record(self, StreamName: str, Data: str, PartitionKey: str) -> dict:
+        self.put_records(StreamName, [{"Data": Data, "PartitionKey": PartitionKey}])
+        return {}
+
+    def put_records(self, StreamName: str, Records: List[dict]) -> dict:
+        source = self.streams.get(StreamName)
+        results = []
+        for record in Records:
+            sequence_number = f"{next(self.sequence):021d}"
+            results.append({"SequenceNumber": sequence_number})
+            if source is None:
+                # e.g. the message log, which nothing in the pipeline reads
+                self.discarded += 1
+                continue
+            data = record["Data"]
+            source.put(
+                record["PartitionKey"],
+                {
+                    "kinesis": {
+                        "partitionKey": record["PartitionKey"],
+                        "sequenceNumber": sequence_number,
+                        "data": base64.b64encode(
+                            data.encode("utf-8") if isinstance(data, str) else data
+                        ).decode("ascii"),
+                    }
+                },
+                self.sim.traces_for(f"phone:{record['PartitionKey']}"),
+            )
+        return {"FailedRecordCount": 0, "Records": results}
+
+
+class FakeDynamoDB:
+    # Just enough of DynamoDB for the dialog repository and idempotency checks. Writes to tables
+    # with a stream are passed on as stream records.
+
+    def __init__(
+        self,
+        sim: Simulation,
+        key_schemas: Dict[str, List[str]],
+        streams: Dict[str, StreamEventSource],
+    ) -> None:
+        self.sim = sim
+        self.key_schemas = key_schemas
+        self.streams = streams
+        self.tables: Dict[str, Dict[tuple, dict]] = collections.defaultdict(dict)
+
+    def _key(self, table_name: str, item: dict) -> tuple:
+        return tuple(
+            json.dumps(item[name], sort_keys=True) for name in self.key_schemas[table_name]
+        )
+
+    def get_item(self, TableName: str, Key: dict, **kwargs: Any) -> dict:
+        item = self.tables[TableName].get(self._key(TableName, Key))
+        return {"Item": item} if item is not None else {}
+
+    def put_item(self, TableName: str, Item: dict, **kwargs: Any) -> dict:
+        self.tables[TableName][self._key(TableName, Item)] = Item
+        source = self.streams.get(TableName)
+        if source is not None:
+            phone_number = Item["phone_number"]["S"]
+            source.put(
+                phone_number,
+                {"eventName": "INSERT", "dynamodb": {"NewImage": Item}},
+                self.sim.traces_for(f"seq:{Item['seq']['S']}"),
+            )
+        return {}
+
+    def transact_write_items(self, TransactItems: List[dict]) -> dict:
+        for item in TransactItems:
+            self.put_item(**item["Put"])
+        return {}
+
+    def batch_get_item(self, RequestItems: Dict[str, dict]) -> dict:
+        responses = {}
+        for table_name, request in RequestItems.items():
+            items = [
+                self.tables[table_name].get(self._key(table_name, key)) for key in request["Keys"]
+            ]
+            responses[table_name] = [item for item in items if item is not None]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+class FakeSQS:
+    def __init__(self, sim: Simulation, queues: Dict[str, FifoQueueEventSource]) -> None:
+        self.sim = sim
+        self.queues = queues
+
+    def get_queue_url(self, QueueName: str) -> dict:
+        return {"QueueUrl": QueueName}
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[dict]) -> dict:
+        for entry in Entries:
+            self.queues[QueueUrl].send(
+                entry, self.sim.traces_for(f"phone:{entry['MessageGroupId']}")
+            )
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+
+class _FakeMessages:
+    def __init__(self, sim: Simulation, latency: float) -> None:
+        self.sim = sim
+        self.latency = latency
+        self.sent = itertools.count(1)
+
+    def create(self, to: str, body: Optional[str], **kwargs: Any) -> Any:
+        self.sim.sleep(self.latency)
+        for trace in self.sim.traces_for(f"phone:{to}"):
+            trace.sms_times.append(self.sim.now())
+        return _FakeMessage(f"SM{next(self.sent):032d}", to, body)
+
+
+@dataclass
+class _FakeMessage:
+    sid: str
+    to: str
+    body: Optional[str]
+    status: str = "queued"
+    error_code: Optional[str] = None
+    error_message: Optional[str] = None
+
+
+class FakeTwilio:
+    def __init__(self, sim: Simulation, latency: float) -> None:
+        self.messages = _FakeMessages(sim, latency)
+
+
+def _webhook_event(phone_number: str, body: str, token: str) -> dict:
+    from twilio.request_validator import RequestValidator
+
+    form = {
+        "From": phone_number,
+        "To": "+15005550006",
+        "Body": body,
+        "MessageSid": f"SM{hashlib.md5(token.encode('utf-8')).hexdigest()}",
+    }
+    url = f"https://{WEBHOOK_HOST}/{STAGE}{WEBHOOK_PATH}"
+    return {
+        "body": "&".join(f"{key}={quote_plus(value)}" for key, value in form.items()),
+        "path": WEBHOOK_PATH,
+        "headers": {
+            "Host": WEBHOOK_HOST,
+            "X-Twilio-Signature": RequestValidator(TWILIO_AUTH_TOKEN).compute_signature(url, form),
+            "I-Twilio-Idempotency-Token": token,
+        },
+    }
+
+
+def _command_data(command: Any) -> Tuple[str, Dict[str, Any]]:
+    if isinstance(command, StartDrill):
+        return (
+            command.phone_number,
+            {
+                "type": "START_DRILL",
+                "payload": {
+                    "phone_number": command.phone_number,
+                    "drill_slug": command.drill_slug,
+                    "drill_body": json.loads(command.drill.json()),
+                    "drill_instance_id": str(command.drill_instance_id),
+                },
+            },
+        )
+    assert isinstance(command, UpdateUser)
+    return (
+        command.phone_number,
+        {
+            "type": "UPDATE_USER",
+            "payload": {
+                "phone_number": command.phone_number,
+                "user_profile_data": command.user_profile_data,
+            },
+        },
+    )
+
+
+@contextlib.contextmanager
+def _fake_aws(
+    sim: Simulation, kinesis: FakeKinesis, dynamodb: FakeDynamoDB, sqs: FakeSQS, twilio: FakeTwilio
+) -> Iterator[None]:
+    from stopcovid.dialog import engine
+    from stopcovid.utils import sqs as sqs_utils
+
+    clients = {"kinesis": kinesis, "dynamodb": dynamodb, "sqs": sqs}
+    validator = BenchmarkValidator()
+    environment = {
+        "STAGE": STAGE,
+        "DEPLOY_STAGE": STAGE,
+        "DIALOG_TABLE_NAME_SUFFIX": STAGE,
+        "TWILIO_AUTH_TOKEN": TWILIO_AUTH_TOKEN,
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_MESSAGING_SERVICE_SID": "MGbench",
+        "REGISTRATION_VALIDATION_URL": "http://registration.invalid/validate",
+    }
+    sqs_utils.get_client.cache_clear()
+    sqs_utils.get_queue_url.cache_clear()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patch.dict(os.environ, environment))
+        stack.enter_context(
+            patch(
+                "stopcovid.utils.boto3.client",
+                lambda service_name, **kwargs: clients[service_name],
+            )
+        )
+        stack.enter_context(patch("stopcovid.sms.twilio._get_client", lambda: twilio))
+        stack.enter_context(patch("stopcovid.sms.send_sms.sleep", sim.sleep))
+        stack.enter_context(
+            patch.object(
+                engine.DEFAULT_REGISTRATION_VALIDATOR, "validate_code", validator.validate_code
+            )
+        )
+        stack.enter_context(
+            patch.object(
+                engine.DEFAULT_REGISTRATION_VALIDATOR, "validate_codes", validator.validate_codes
+            )
+        )
+        try:
+            yield
+        finally:
+            sqs_utils.get_client.cache_clear()
+            sqs_utils.get_queue_url.cache_clear()
+
+
+def _percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(
+            values[max(0, min(len(values) - 1, int(round(q * len(values))) - 1))] * 1000, 1
+        )
+
+    return {"p50_ms": rank(0.5), "p90_ms": rank(0.9), "p99_ms": rank(0.99), "max_ms": rank(1.0)}
+
+
+@dataclass
+class PipelineConfig:
+    users: int = 200
+    seed: int = 0
+    # users start over this many seconds, then wait think_time seconds (on average) between
+    # messages
+    ramp: float = 60.0
+    think_time: float = 10.0
+    kinesis_shards: int = 4
+    kinesis_batch_size: int = 100
+    kinesis_batching_window: float = 0.0
+    stream_shards: int = 4
+    stream_batch_size: int = 100
+    stream_batching_window: float = 0.0
+    # between a record being written and its event source seeing it
+    poll_delay: float = 0.0
+    sqs_batch_size: int = 10
+    sqs_concurrency: int = 50
+    twilio_latency: float = 0.2
+    pacing_delay: Optional[float] = None
+    cpu_scale: float = 1.0
+
+
+def run_pipeline(config: PipelineConfig, mix: WorkloadMix = WorkloadMix()) -> dict:
+    # imported here so the handlers configure logging before we quiet it
+    from stopcovid.dialog.aws_lambdas import handle_command
+    from stopcovid.dialog.command_stream.publish import CommandPublisher
+    from stopcovid.sms import send_sms
+    from stopcovid.sms.aws_lambdas import enqueue_sms_batch, send_sms_batch, twilio_webhook
+
+    logging.getLogger().setLevel(logging.ERROR)
+    sim = Simulation(config.cpu_scale)
+    command_stream = StreamEventSource(
+        sim,
+        "command_stream",
+        handle_command.handler,
+        config.kinesis_shards,
+        config.kinesis_batch_size,
+        config.kinesis_batching_window,
+        config.poll_delay,
+        lambda record: f"seq:{record.data['kinesis']['sequenceNumber']}",
+    )
+    dialog_event_stream = StreamEventSource(
+        sim,
+        "dialog_event_stream",
+        enqueue_sms_batch.handler,
+        config.stream_shards,
+        config.stream_batch_size,
+        config.stream_batching_window,
+        config.poll_delay,
+        lambda record: f"phone:{record.key}",
+    )
+    outbound_queue = FifoQueueEventSource(
+        sim,
+        "outbound_sms_queue",
+        send_sms_batch.handler,
+        config.sqs_batch_size,
+        config.sqs_concurrency,
+    )
+    kinesis = FakeKinesis(sim, {f"command-stream-{STAGE}": command_stream})
+    dynamodb = FakeDynamoDB(
+        sim,
+        {
+            f"dialog-state-{STAGE}": ["phone_number"],
+            f"dialog-event-batches-{STAGE}": ["phone_number", "batch_id"],
+            f"idempotency-checks-{STAGE}": ["idempotency_key", "realm"],
+        },
+        {f"dialog-event-batches-{STAGE}": dialog_event_stream},
+    )
+    sqs = FakeSQS(sim, {f"outbound-sms-{STAGE}.fifo": outbound_queue})
+    twilio = FakeTwilio(sim, config.twilio_latency)
+
+    rng = random.Random(config.seed)
+    workload = build_workload(config.users, config.seed, mix, phone_prefix=PHONE_PREFIX)
+    scripts: Dict[str, List[ScriptedCommand]] = collections.defaultdict(list)
+    for scripted in workload:
+        scripts[scripted.command.phone_number].append(scripted)
+    traces: List[Trace] = []
+    tokens = itertools.count(1)
+
+    def send(scripted: ScriptedCommand) -> None:
+        trace = Trace(scripted.kind, sim.time)
+        traces.append(trace)
+        command = scripted.command
+        if isinstance(command, ProcessSMSMessage):
+            sim.stages["webhook"].waits.append(0.0)
+            sim.invoke(
+                "webhook",
+                twilio_webhook.handler,
+                _webhook_event(command.phone_number, command.content, f"token-{next(tokens)}"),
+                {f"phone:{command.phone_number}": [trace]},
+            )
+        else:
+            # published by an operator or a scheduler, not through the webhook
+            sim.context = {f"phone:{command.phone_number}": [trace]}
+            CommandPublisher().publish_commands([_command_data(command)])
+            sim.context = {}
+
+    for script in scripts.values():
+        at = rng.uniform(0, config.ramp)
+        for scripted in script:
+            sim.schedule(at, lambda scripted=scripted: send(scripted))  # type: ignore
+            at += rng.expovariate(1 / config.think_time) if config.think_time else 0
+
+    pacing = (
+        patch.object(send_sms, "DELAY_SECONDS_BETWEEN_MESSAGES", config.pacing_delay)
+        if config.pacing_delay is not None
+        else contextlib.nullcontext()
+    )
+    wall_start = time.perf_counter()
+    with _fake_aws(sim, kinesis, dynamodb, sqs, twilio), pacing:
+        sim.run()
+    wall_seconds = time.perf_counter() - wall_start
+
+    first_sms = [trace.sms_times[0] - trace.origin for trace in traces if trace.sms_times]
+    last_sms = [trace.sms_times[-1] - trace.origin for trace in traces if trace.sms_times]
+    by_kind = {}
+    for kind in sorted({trace.kind for trace in traces}):
+        kind_traces = [trace for trace in traces if trace.kind == kind]
+        by_kind[kind] = {
+            "count": len(kind_traces),
+            "with_sms": sum(1 for trace in kind_traces if trace.sms_times),
+            "first_sms": _percentiles(
+                [trace.sms_times[0] - trace.origin for trace in kind_traces if trace.sms_times]
+            ),
+        }
+    stages = {}
+    for stage, stats in sim.stages.items():
+        stages[stage] = {
+            "invocations": len(stats.durations),
+            "mean_batch_size": (
+                round(sum(stats.batch_sizes) / len(stats.batch_sizes), 2)
+                if stats.batch_sizes
+                else 1
+            ),
+            "queueing": _percentiles(stats.waits),
+            "duration": _percentiles(stats.durations),
+        }
+    return {
+        "config": {**config.__dict__, "mix": mix._asdict()},
+        "traffic": len(traces),
+        "sms_sent": sum(len(trace.sms_times) for trace in traces),
+        "virtual_seconds": round(sim.time, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "end_to_end": {"first_sms": _percentiles(first_sms), "last_sms": _percentiles(last_sms)},
+        "by_kind": by_kind,
+        "stages": stages,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    defaults = PipelineConfig()
+    for name, value in defaults.__dict__.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            type=type(value) if value is not None else float,
+            default=value,
+        )
+    parser.add_argument("--drills-per-user", type=int, default=2)
+    parser.add_argument("--output", help="write the report to this file instead of stdout")
+    args = parser.parse_args()
+
+    config = PipelineConfig(**{name: getattr(args, name) for name in defaults.__dict__})
+    report = json.dumps(
+        run_pipeline(config, WorkloadMix(drills_per_user=args.drills_per_user)), indent=2
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
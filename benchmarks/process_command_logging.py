@@ -0,0 +1,132 @@
+import argparse
+import datetime
+import json
+import logging
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+from stopcovid.dialog.engine import process_command, Command, StartDrill, ProcessSMSMessage
+from stopcovid.dialog.models.events import DialogEventBatch
+from stopcovid.dialog.models.state import DialogState, DialogStateSnapshot, UserProfile
+from stopcovid.dialog.persistence import DialogRepository
+from stopcovid.drills.bundle import get_drill_loader
+
+# Compares the cost of process_command's logging at INFO (the production default) and at DEBUG,
+# which dumps the full dialog state on every command the way process_command used to.
+#
+#   python -m benchmarks.process_command_logging --users 200
+
+
+class _ByteCountingStream:
+    def __init__(self) -> None:
+        self.bytes_written = 0
+
+    def write(self, value: str) -> None:
+        self.bytes_written += len(value.encode("utf-8"))
+
+    def flush(self) -> None:
+        pass
+
+
+class _DictRepository(DialogRepository):
+    def __init__(self) -> None:
+        self.states: Dict[str, str] = {}
+        self.event_batches: Dict[str, List[DialogEventBatch]] = {}
+        self.snapshots: Dict[str, DialogStateSnapshot] = {}
+
+    def fetch_dialog_state(self, phone_number: str) -> DialogState:
+        if phone_number in self.states:
+            return DialogState.parse_raw(self.states[phone_number])
+        return DialogState(
+            phone_number=phone_number,
+            seq="0",
+            user_profile=UserProfile(validated=True, language="en"),
+        )
+
+    def persist_dialog_state(
+        self, event_batch: DialogEventBatch, dialog_state: DialogState
+    ) -> None:
+        if event_batch.events:
+            self.event_batches.setdefault(dialog_state.phone_number, []).append(event_batch)
+        self.states[dialog_state.phone_number] = dialog_state.json()
+
+    def fetch_dialog_event_batches(
+        self, phone_number: str, created_after: Optional[datetime.datetime] = None
+    ) -> Iterator[DialogEventBatch]:
+        for event_batch in self.event_batches.get(phone_number, []):
+            if created_after is None or event_batch.created_time > created_after:
+                yield event_batch
+
+    def replace_dialog_state(self, dialog_state: DialogState, expected_seq: str) -> bool:
+        if self.fetch_dialog_state(dialog_state.phone_number).seq != expected_seq:
+            return False
+        self.states[dialog_state.phone_number] = dialog_state.json()
+        return True
+
+    def fetch_dialog_state_snapshot(self, phone_number: str) -> Optional[DialogStateSnapshot]:
+        return self.snapshots.get(phone_number)
+
+    def save_dialog_state_snapshot(self, snapshot: DialogStateSnapshot) -> None:
+        stored = self.snapshots.get(snapshot.phone_number)
+        if stored is None or stored.created_time < snapshot.created_time:
+            self.snapshots[snapshot.phone_number] = snapshot
+
+
+def _workload(users: int) -> List[Command]:
+    drill = get_drill_loader().get_drill("01-sample-drill-en")
+    commands: List[Command] = []
+    for i in range(users):
+        phone_number = f"+1555{i:07d}"
+        commands.append(StartDrill(phone_number, drill.slug, drill.dict(), uuid.uuid4()))
+        for prompt in drill.prompts:
+            commands.append(ProcessSMSMessage(phone_number, prompt.correct_response or "ok"))
+    return commands
+
+
+def _run(level: int, users: int) -> Dict[str, float]:
+    stream = _ByteCountingStream()
+    handler = logging.StreamHandler(stream)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    commands = _workload(users)
+    repo = _DictRepository()
+    try:
+        start = time.process_time()
+        for seq, command in enumerate(commands, start=1):
+            process_command(command, str(seq), repo=repo)
+        cpu_seconds = time.process_time() - start
+    finally:
+        root.removeHandler(handler)
+    return {
+        "commands": len(commands),
+        "cpu_seconds": round(cpu_seconds, 4),
+        "cpu_us_per_command": round(cpu_seconds / len(commands) * 1e6, 1),
+        "log_bytes": stream.bytes_written,
+        "log_bytes_per_command": round(stream.bytes_written / len(commands), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    info = _run(logging.INFO, args.users)
+    debug = _run(logging.DEBUG, args.users)
+    print(
+        json.dumps(
+            {
+                "info": info,
+                "debug": debug,
+                "cpu_reduction": round(1 - info["cpu_seconds"] / debug["cpu_seconds"], 3),
+                "log_volume_reduction": round(1 - info["log_bytes"] / debug["log_bytes"], 3),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
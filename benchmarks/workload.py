@@ -0,0 +1,236 @@
+import contextlib
+import datetime
+import random
+import uuid
+from typing import Any, Iterator, List, NamedTuple, Optional
+
+from stopcovid.dialog.engine import Command, ProcessSMSMessage, StartDrill, UpdateUser
+from stopcovid.dialog.models import events as events_module
+from stopcovid.dialog.models.events import DialogEvent, DialogEventBatch
+from stopcovid.dialog.registration import AccountInfo, CodeValidationPayload, RegistrationValidator
+from stopcovid.drills.bundle import get_drill_loader
+
+# Synthetic traffic for benchmarks and load tests: virtual users who register, set their
+# language, and work through drills from drills.json, answering correctly, wrongly or with
+# gibberish, with some of them opting out along the way.
+
+REGISTRATION_CODE = "bench-code"
+LANGUAGES = ["en", "es"]
+WRONG_ANSWER = "zzz"
+GIBBERISH = "asdf qwerty"
+START = datetime.datetime(2020, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+class WorkloadMix(NamedTuple):
+    drills_per_user: int = 2
+    # chance of each wrong answer to a prompt that has a correct response
+    wrong: float = 0.25
+    wrong_code: float = 0.1
+    gibberish: float = 0.1
+    # chance of a user opting out at some point in the workload
+    opt_out: float = 0.05
+
+
+class ScriptedCommand(NamedTuple):
+    # what the command is, for reporting, e.g. "answer_correct" or "start_drill"
+    kind: str
+    command: Command
+
+
+class BenchmarkValidator(RegistrationValidator):
+    def validate_code(self, code: str) -> CodeValidationPayload:
+        if code != REGISTRATION_CODE:
+            return CodeValidationPayload(valid=False)
+        return CodeValidationPayload(
+            valid=True,
+            account_info=AccountInfo(
+                employer_id=1, employer_name="Benchmark", unit_id=1, unit_name="Unit"
+            ),
+        )
+
+
+class _Clock:
+    def __init__(self, now: datetime.datetime) -> None:
+        self.now = now
+
+
+@contextlib.contextmanager
+def deterministic(seed: int, start: datetime.datetime = START) -> Iterator[_Clock]:
+    # Makes the ids and created times of events and event batches reproducible: ids come from
+    # a seeded random number generator and times from the clock this yields, which the caller
+    # advances. Two runs of the same workload produce identical dialog states.
+    rng = random.Random(seed)
+    clock = _Clock(start)
+
+    class _ClockDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz: Optional[datetime.tzinfo] = None) -> datetime.datetime:  # type: ignore
+            return clock.now
+
+    def seeded_uuid4() -> uuid.UUID:
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    models: List[Any] = [DialogEventBatch]
+    pending: List[type] = [DialogEvent]
+    while pending:
+        model = pending.pop()
+        models.append(model)
+        pending.extend(model.__subclasses__())
+    patched = [
+        field
+        for model in models
+        for field in model.__fields__.values()
+        if field.default_factory is uuid.uuid4
+    ]
+    original_datetime = events_module.datetime
+    for field in patched:
+        field.default_factory = seeded_uuid4
+    events_module.datetime = _ClockDatetime  # type: ignore
+    try:
+        yield clock
+    finally:
+        events_module.datetime = original_datetime  # type: ignore
+        for field in patched:
+            field.default_factory = uuid.uuid4
+
+
+def phone_number_for(user: int, prefix: str = "+1555") -> str:
+    # +1555 numbers are fake: nothing is ever sent to them
+    return f"{prefix}{user:07d}"
+
+
+def _drill_answers(
+    phone_number: str,
+    drill_slug: str,
+    rng: random.Random,
+    mix: WorkloadMix,
+    validator: RegistrationValidator,
+) -> List[ScriptedCommand]:
+    drill = get_drill_loader().get_drill(drill_slug)
+    answers = []
+    for prompt in drill.prompts:
+        if prompt.correct_response is None:
+            answers.append(
+                ScriptedCommand("answer_correct", ProcessSMSMessage(phone_number, "ok", validator))
+            )
+            continue
+        max_failures = prompt.max_failures or 1
+        failures = 0
+        while failures < max_failures and rng.random() < mix.wrong:
+            failures += 1
+            answers.append(
+                ScriptedCommand(
+                    "answer_wrong", ProcessSMSMessage(phone_number, WRONG_ANSWER, validator)
+                )
+            )
+        # the engine moves on by itself after too many wrong answers
+        if failures < max_failures:
+            answers.append(
+                ScriptedCommand(
+                    "answer_correct",
+                    ProcessSMSMessage(phone_number, prompt.correct_response, validator),
+                )
+            )
+    return answers
+
+
+def _interleave(per_user: List[List[ScriptedCommand]], rng: random.Random) -> List[ScriptedCommand]:
+    # merges the users' scripts in a random order, keeping each user's own commands in order
+    positions = [0] * len(per_user)
+    active = [user for user, script in enumerate(per_user) if script]
+    merged = []
+    while active:
+        i = rng.randrange(len(active))
+        user = active[i]
+        merged.append(per_user[user][positions[user]])
+        positions[user] += 1
+        if positions[user] == len(per_user[user]):
+            active[i] = active[-1]
+            active.pop()
+    return merged
+
+
+def build_workload(
+    users: int,
+    seed: int,
+    mix: WorkloadMix = WorkloadMix(),
+    validator: Optional[RegistrationValidator] = None,
+    phone_prefix: str = "+1555",
+) -> List[ScriptedCommand]:
+    # The workload runs in phases: every user registers and sets their language, then for each
+    # drill there's a burst of START_DRILL commands for everyone followed by everyone's answers,
+    # interleaved. A user who opts out does so at a random point in one of the drills.
+    rng = random.Random(seed)
+    validator = validator or BenchmarkValidator()
+    loader = get_drill_loader()
+    phone_numbers = [phone_number_for(user, phone_prefix) for user in range(users)]
+    languages = [rng.choice(LANGUAGES) for _ in range(users)]
+
+    workload: List[ScriptedCommand] = []
+    registration: List[List[ScriptedCommand]] = []
+    for phone_number, language in zip(phone_numbers, languages):
+        script = []
+        if rng.random() < mix.wrong_code:
+            script.append(
+                ScriptedCommand(
+                    "registration", ProcessSMSMessage(phone_number, WRONG_ANSWER, validator)
+                )
+            )
+        script.append(
+            ScriptedCommand(
+                "registration", ProcessSMSMessage(phone_number, REGISTRATION_CODE, validator)
+            )
+        )
+        script.append(
+            ScriptedCommand(
+                "update_user",
+                UpdateUser(phone_number, {"language": language, "name": f"User {phone_number}"}),
+            )
+        )
+        registration.append(script)
+    workload.extend(_interleave(registration, rng))
+
+    opt_outs = {
+        user: (rng.randrange(mix.drills_per_user), rng.random())
+        for user in range(users)
+        if mix.drills_per_user and rng.random() < mix.opt_out
+    }
+    drill_bodies = {}
+    for round_number in range(mix.drills_per_user):
+        drill_slugs = []
+        for phone_number, language in zip(phone_numbers, languages):
+            slugs = loader.get_slugs_for_language(language)
+            drill_slug = slugs[round_number % len(slugs)]
+            drill = loader.get_drill(drill_slug)
+            if drill_slug not in drill_bodies:
+                drill_bodies[drill_slug] = drill.dict()
+            drill_slugs.append(drill_slug)
+            workload.append(
+                ScriptedCommand(
+                    "start_drill",
+                    StartDrill(
+                        phone_number,
+                        drill.slug,
+                        drill_bodies[drill_slug],
+                        uuid.UUID(int=rng.getrandbits(128), version=4),
+                    ),
+                )
+            )
+        answers = []
+        for user, (phone_number, drill_slug) in enumerate(zip(phone_numbers, drill_slugs)):
+            script = _drill_answers(phone_number, drill_slug, rng, mix, validator)
+            if rng.random() < mix.gibberish:
+                script.append(
+                    ScriptedCommand(
+                        "gibberish", ProcessSMSMessage(phone_number, GIBBERISH, validator)
+                    )
+                )
+            if user in opt_outs and opt_outs[user][0] == round_number:
+                position = int(opt_outs[user][1] * (len(script) + 1))
+                script.insert(
+                    position,
+                    ScriptedCommand("opt_out", ProcessSMSMessage(phone_number, "STOP", validator)),
+                )
+            answers.append(script)
+        workload.extend(_interleave(answers, rng))
+    return workload
@@ -1,11 +1,19 @@
 import argparse
+import datetime
 import sys
 import uuid
-from typing import Dict, Iterator, Any
+from typing import Dict, Iterable, Any, List, Set
 import json
 
-from stopcovid.dialog.models.events import batch_from_dict, DialogEventBatch
-from stopcovid.utils import dynamodb as dynamodb_utils
+from stopcovid.dialog.command_stream.broadcast import (
+    BroadcastAdHocMessage,
+    BroadcastProgressRepository,
+)
+from stopcovid.dialog.command_stream.publish import CommandPublisher
+from stopcovid.dialog import rebuild
+from stopcovid.dialog.persistence import DynamoDBDialogRepository
+from stopcovid.drill_progress.trigger_schedule import DrillTriggerScheduleRepository, launch_cohort
+from stopcovid.utils import dynamodb as dynamodb_utils, export
 from stopcovid.utils.logging import configure_logging
 from stopcovid.utils.boto3 import get_boto3_client, get_boto3_resource
 
@@ -102,36 +110,74 @@ def handle_replay_sqs_failures(args: Any) -> None:
                 print(f"Skipping message {message.message_id}\n")
 
 
-def _get_dialog_events(phone_number: str, stage: str) -> Iterator[DialogEventBatch]:
+def get_all_users(args: Any) -> None:
+    # Streams the requested attributes of every user as they're scanned. The table is split
+    # into segments scanned in parallel, paced to the read capacity allowed, if any.
     dynamodb = get_boto3_client("dynamodb")
-    table_name = f"dialog-event-batches-{stage}"
-    args: Dict[str, str] = {}
-    while True:
-        result = dynamodb.query(
-            TableName=table_name,
-            IndexName="by_created_time",
-            KeyConditionExpression="phone_number=:phone_number",
-            ExpressionAttributeValues={":phone_number": {"S": phone_number}},
-            **args,
-        )
-        for item in result["Items"]:
-            yield batch_from_dict(dynamodb_utils.deserialize(item))
-        if not result.get("LastEvaluatedKey"):
-            break
-        args["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+    attributes = [attribute.strip() for attribute in args.attributes.split(",")]
+    projection, names = dynamodb_utils.projection_expression(attributes)
+    items = dynamodb_utils.parallel_scan(
+        dynamodb,
+        total_segments=args.segments,
+        max_capacity_per_second=args.max_rcu,
+        TableName=f"dialog-state-{args.stage}",
+        ProjectionExpression=projection,
+        ExpressionAttributeNames=names,
+    )
+    count = export.write_items(
+        (dynamodb_utils.deserialize(item) for item in items), attributes, args.format, sys.stdout
+    )
+    print(f"Exported {count} users", file=sys.stderr)
 
 
-def get_all_users(args: Any) -> None:
-    dynamodb = get_boto3_client("dynamodb")
-    table_name = f"dialog-state-{args.stage}"
-    args = {}
-    while True:
-        result = dynamodb.scan(TableName=table_name, **args)
-        for item in result["Items"]:
-            print(item["phone_number"]["S"])
-        if not result.get("LastEvaluatedKey"):
-            break
-        args["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+def _read_checkpoint(path: str) -> Set[str]:
+    # the users an earlier run rebuilt, apart from those it failed to
+    try:
+        with open(path) as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return set()
+    return {result["phone_number"] for result in results if result["status"] != rebuild.FAILED}
+
+
+def handle_rebuild_state(args: Any) -> None:
+    # Results are appended to the checkpoint file as they finish, and users already in it are
+    # skipped, so an interrupted run picks up where it left off when run again.
+    repo = DynamoDBDialogRepository(table_name_suffix=args.stage)
+    if args.phone_file:
+        phone_numbers: Iterable[str] = _read_phone_file(args.phone_file)
+    else:
+        phone_numbers = (
+            item["phone_number"]["S"]
+            for item in dynamodb_utils.parallel_scan(
+                repo.dynamodb,
+                total_segments=args.segments,
+                max_capacity_per_second=args.max_rcu,
+                TableName=repo.state_table_name(),
+                ProjectionExpression="phone_number",
+            )
+        )
+    checkpoint = args.checkpoint or f"rebuild-state-{args.stage}.jsonl"
+    skip = _read_checkpoint(checkpoint)
+    if skip:
+        print(f"Skipping {len(skip)} users rebuilt by an earlier run", file=sys.stderr)
+    counts: Dict[str, int] = {}
+    with open(checkpoint, "a") as f:
+        for result in rebuild.rebuild_states(
+            repo,
+            phone_numbers,
+            workers=args.workers,
+            correct=args.correct,
+            skip=skip,
+            snapshot_every=args.snapshot_every,
+            use_snapshot=not args.full,
+        ):
+            f.write(json.dumps(result._asdict()) + "\n")
+            f.flush()
+            counts[result.status] = counts.get(result.status, 0) + 1
+            if result.differences:
+                print(f"{result.phone_number} {result.status}: {', '.join(result.differences)}")
+    print(json.dumps(counts), file=sys.stderr)
 
 
 def handle_show_stream_record(args: Any) -> None:
@@ -148,6 +194,58 @@ def handle_show_stream_record(args: Any) -> None:
         print(json.loads(record["Data"]))
 
 
+def handle_broadcast(args: Any) -> None:
+    phone_numbers = _read_phone_file(args.phone_file) if args.phone_file else None
+    broadcast = BroadcastAdHocMessage(
+        broadcast_id=args.broadcast_id or str(uuid.uuid4()),
+        message=args.message,
+        media_url=args.media_url,
+        phone_numbers=phone_numbers,
+        employer_id=args.employer_id,
+        unit_id=args.unit_id,
+    )
+    if args.broadcast_id:
+        # a resumed broadcast continues from its latest continuation, or it would be skipped
+        progress_repo = BroadcastProgressRepository()
+        progress_repo.stage = args.stage
+        broadcast.continuation = progress_repo.fetch_progress(args.broadcast_id).continuation
+    publisher = CommandPublisher()
+    publisher.stage = args.stage
+    publisher.publish_broadcast_command(broadcast.broadcast_id, json.loads(broadcast.json()))
+    print(f"Published broadcast {broadcast.broadcast_id}")
+
+
+def _read_phone_file(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def handle_launch_cohort(args: Any) -> None:
+    if args.phone_file:
+        phone_numbers = _read_phone_file(args.phone_file)
+    else:
+        dialog_repo = DynamoDBDialogRepository(table_name_suffix=args.stage)
+        phone_numbers = []
+        start_key = None
+        while True:
+            page, start_key = dialog_repo.scan_phone_numbers_for_account(
+                args.employer_id, args.unit_id, start_key
+            )
+            phone_numbers.extend(page)
+            if start_key is None:
+                break
+    repo = DrillTriggerScheduleRepository()
+    repo.stage = args.stage
+    scheduled = launch_cohort(
+        args.drill_slug,
+        phone_numbers,
+        cohort_id=args.cohort_id,
+        window=datetime.timedelta(hours=args.window_hours),
+        repo=repo,
+    )
+    print(f"Scheduled {args.drill_slug} for {len(scheduled)} users")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--stage", choices=["dev", "prod"], required=True)
@@ -162,10 +260,51 @@ def main() -> None:
     sqs_parser.set_defaults(func=handle_redrive_sqs)
 
     get_all_users_parser = subparsers.add_parser(
-        "get-all-users", description="print out every user's phone number"
+        "get-all-users",
+        description="print out every user's phone number, or other attributes, as they're scanned",
+    )
+    get_all_users_parser.add_argument(
+        "--attributes",
+        default="phone_number",
+        help="comma separated attribute paths, e.g. phone_number,user_profile.language",
+    )
+    get_all_users_parser.add_argument("--format", choices=export.FORMATS, default="text")
+    get_all_users_parser.add_argument("--segments", type=int, default=8)
+    get_all_users_parser.add_argument(
+        "--max_rcu", type=float, help="read capacity units to consume per second, at most"
     )
     get_all_users_parser.set_defaults(func=get_all_users)
 
+    rebuild_state_parser = subparsers.add_parser(
+        "rebuild-state",
+        description="Rebuild dialog states from their event batches and compare them to the stored ones",
+    )
+    rebuild_state_parser.add_argument(
+        "--phone_file", help="file with one phone number per line, instead of every user"
+    )
+    rebuild_state_parser.add_argument(
+        "--correct", action="store_true", help="replace stored states that differ"
+    )
+    rebuild_state_parser.add_argument(
+        "--checkpoint", help="results file, to resume from (default rebuild-state-STAGE.jsonl)"
+    )
+    rebuild_state_parser.add_argument(
+        "--full", action="store_true", help="apply every batch, rather than start from snapshots"
+    )
+    rebuild_state_parser.add_argument(
+        "--snapshot_every",
+        type=int,
+        default=rebuild.SNAPSHOT_EVERY_BATCHES,
+        help="save a snapshot of users with at least this many batches since their last one "
+        "(1 to snapshot everyone now, 0 for none)",
+    )
+    rebuild_state_parser.add_argument("--workers", type=int, default=16)
+    rebuild_state_parser.add_argument("--segments", type=int, default=8)
+    rebuild_state_parser.add_argument(
+        "--max_rcu", type=float, help="read capacity units the scan may consume per second"
+    )
+    rebuild_state_parser.set_defaults(func=handle_rebuild_state)
+
     show_stream_record_parser = subparsers.add_parser(
         "show-stream-record",
         description="Show the record at a particular sequence in a kinesis stream",
@@ -184,6 +323,35 @@ def main() -> None:
     replay_sqs_failures_parser.add_argument("--kinesis_stream")
     replay_sqs_failures_parser.add_argument("--print_only", action="store_true")
 
+    broadcast_parser = subparsers.add_parser(
+        "broadcast",
+        description="Send an ad hoc message to a list of users or to everyone at an employer",
+    )
+    broadcast_parser.add_argument("--message", required=True)
+    broadcast_parser.add_argument("--media_url")
+    broadcast_parser.add_argument("--phone_file", help="file with one phone number per line")
+    broadcast_parser.add_argument("--employer_id", type=int)
+    broadcast_parser.add_argument("--unit_id", type=int)
+    broadcast_parser.add_argument(
+        "--broadcast_id", help="re-use to resume a broadcast rather than start a new one"
+    )
+    broadcast_parser.set_defaults(func=handle_broadcast)
+
+    launch_cohort_parser = subparsers.add_parser(
+        "launch-cohort",
+        description="Start a drill for a list of users or everyone at an employer, spread over a window",
+    )
+    launch_cohort_parser.add_argument("--drill_slug", required=True)
+    cohort_recipients = launch_cohort_parser.add_mutually_exclusive_group(required=True)
+    cohort_recipients.add_argument("--phone_file", help="file with one phone number per line")
+    cohort_recipients.add_argument("--employer_id", type=int)
+    launch_cohort_parser.add_argument("--unit_id", type=int)
+    launch_cohort_parser.add_argument("--window_hours", type=float, default=3)
+    launch_cohort_parser.add_argument(
+        "--cohort_id", help="re-use to reschedule a cohort rather than schedule it twice"
+    )
+    launch_cohort_parser.set_defaults(func=handle_launch_cohort)
+
     args = parser.parse_args(sys.argv if len(sys.argv) == 1 else None)
     args.func(args)
 
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
-import json
-import sys
+import argparse
+import itertools
+import random
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, NamedTuple, Optional
 import uuid
 
-from stopcovid.dialog.persistence import DialogRepository
+from stopcovid.dialog.persistence import InMemoryDialogRepository
 from stopcovid.dialog.models.events import (
     DrillStarted,
     UserValidated,
@@ -22,19 +27,29 @@ from stopcovid.dialog.models.events import (
 from stopcovid.dialog.engine import process_command, StartDrill, ProcessSMSMessage
 from stopcovid.dialog.registration import RegistrationValidator, CodeValidationPayload, AccountInfo
 from stopcovid.dialog.models.state import DialogState, UserProfile
+from stopcovid.drills.bundle import get_drill_loader
 from stopcovid.drills.content_loader import (
-    SourceRepoDrillLoader,
     translate,
     SupportedTranslation,
     correct_answer_response,
 )
 
-SEQ = 1
 PHONE_NUMBER = "123456789"
-DRILLS = SourceRepoDrillLoader().get_drills()
+DRILL_LOADER = get_drill_loader()
+DRILLS = DRILL_LOADER.get_drills()
 
 
-STARTED_DRILLS: Dict[uuid.UUID, str] = {}
+class Session:
+    # one simulated user: their language, the seq of their next command and the drills they've
+    # started
+    def __init__(self, phone_number: str, language: Optional[str] = None) -> None:
+        self.phone_number = phone_number
+        self.language = language
+        self.seqs = itertools.count(1)
+        self.started_drills: Dict[uuid.UUID, str] = {}
+
+    def next_seq(self) -> str:
+        return str(next(self.seqs))
 
 
 def fake_sms(
@@ -51,46 +66,84 @@ def fake_sms(
         first = False
 
 
-class InMemoryRepository(DialogRepository):
-    def __init__(self, lang: str) -> None:
-        self.repo: dict = {}
+def count_sms(
+    phone_number: str,
+    user_profile: UserProfile,
+    messages: List[str],
+    with_initial_pause: bool = False,
+) -> None:
+    pass
+
+
+class InMemoryRepository(InMemoryDialogRepository):
+    # Renders the events of every batch it stores as the SMS the user would get. Headless runs
+    # pass send_sms=count_sms and notify=None, so nothing is printed or slept on.
+
+    def __init__(
+        self,
+        lang: str,
+        send_sms: Callable[..., None] = fake_sms,
+        notify: Optional[Callable[[str], None]] = print,
+    ) -> None:
+        super().__init__()
         self.lang = lang
+        self.send_sms = send_sms
+        self.notify = notify or (lambda message: None)
+        self.sessions: Dict[str, Session] = {}
+        self.sms_sent = 0
+        self.stats_lock = threading.Lock()
+
+    def session(self, phone_number: str, language: Optional[str] = None) -> Session:
+        return self.sessions.setdefault(phone_number, Session(phone_number, language))
 
     def fetch_dialog_state(self, phone_number: str) -> DialogState:
-        if phone_number in self.repo:
-            state = DialogState(**json.loads(self.repo[phone_number]))
-            return state
-        else:
-            return DialogState(
-                phone_number=phone_number,
-                seq="0",
-                user_profile=UserProfile(validated=False, language=self.lang),
-            )
+        if phone_number in self.states:
+            return super().fetch_dialog_state(phone_number)
+        session = self.sessions.get(phone_number)
+        return DialogState(
+            phone_number=phone_number,
+            seq="0",
+            user_profile=UserProfile(
+                validated=False, language=(session and session.language) or self.lang
+            ),
+        )
 
-    def get_next_unstarted_drill(self) -> Optional[str]:
-        state = self.fetch_dialog_state(PHONE_NUMBER)
+    def get_next_unstarted_drill(self, phone_number: str) -> Optional[str]:
+        state = self.fetch_dialog_state(phone_number)
         assert state.user_profile
         language = state.user_profile.language
         assert language
+        started_drills = self.session(phone_number).started_drills.values()
         unstarted_drills = [
             code
-            for code in DRILLS.keys()
-            if DRILLS[code].slug not in STARTED_DRILLS.values()
-            and DRILLS[code].slug.endswith(language)
+            for code in DRILL_LOADER.get_slugs_for_language(language)
+            if DRILLS[code].slug not in started_drills
         ]
         if unstarted_drills:
             return unstarted_drills[0]
         return None
 
+    def fake_sms(
+        self,
+        phone_number: str,
+        user_profile: UserProfile,
+        messages: List[str],
+        with_initial_pause: bool = False,
+    ) -> None:
+        with self.stats_lock:
+            self.sms_sent += len(messages)
+        self.send_sms(phone_number, user_profile, messages, with_initial_pause=with_initial_pause)
+
     def persist_dialog_state(  # noqa: C901
         self, event_batch: DialogEventBatch, dialog_state: DialogState
     ) -> None:
-        self.repo[dialog_state.phone_number] = dialog_state.json()
+        super().persist_dialog_state(event_batch, dialog_state)
         assert dialog_state.user_profile.language
+        session = self.session(dialog_state.phone_number)
         drill_to_start = None
         for event in event_batch.events:
             if isinstance(event, AdvancedToNextPrompt):
-                fake_sms(
+                self.fake_sms(
                     event.phone_number,
                     dialog_state.user_profile,
                     [message.text for message in event.prompt.messages if message.text is not None],
@@ -98,7 +151,7 @@ class InMemoryRepository(DialogRepository):
                 )
             elif isinstance(event, FailedPrompt):
                 if not event.abandoned:
-                    fake_sms(
+                    self.fake_sms(
                         event.phone_number,
                         dialog_state.user_profile,
                         [
@@ -109,7 +162,7 @@ class InMemoryRepository(DialogRepository):
                         ],
                     )
                 else:
-                    fake_sms(
+                    self.fake_sms(
                         event.phone_number,
                         dialog_state.user_profile,
                         [
@@ -122,7 +175,7 @@ class InMemoryRepository(DialogRepository):
                     )
             elif isinstance(event, CompletedPrompt):
                 if event.prompt.correct_response is not None:
-                    fake_sms(
+                    self.fake_sms(
                         event.phone_number,
                         dialog_state.user_profile,
                         [
@@ -135,19 +188,19 @@ class InMemoryRepository(DialogRepository):
                 assert dialog_state.user_profile.account_info
                 drill_to_start = dialog_state.user_profile.account_info.employer_name
             elif isinstance(event, OptedOut):
-                print("(You've been opted out.)")
+                self.notify("(You've been opted out.)")
                 if event.drill_instance_id:
-                    del STARTED_DRILLS[event.drill_instance_id]
+                    del session.started_drills[event.drill_instance_id]
             elif isinstance(event, NextDrillRequested):
-                drill_to_start = self.get_next_unstarted_drill()
+                drill_to_start = self.get_next_unstarted_drill(dialog_state.phone_number)
                 if not drill_to_start:
-                    print("(You're all out of drills.)")
+                    self.notify("(You're all out of drills.)")
             elif isinstance(event, UserValidationFailed):
-                print(f"(try {', '.join(DRILLS.keys())})")
+                self.notify(f"(try {', '.join(DRILLS.keys())})")
             elif isinstance(event, DrillStarted):
                 assert dialog_state.current_drill
-                STARTED_DRILLS[event.drill_instance_id] = dialog_state.current_drill.slug
-                fake_sms(
+                session.started_drills[event.drill_instance_id] = dialog_state.current_drill.slug
+                self.fake_sms(
                     event.phone_number,
                     dialog_state.user_profile,
                     [
@@ -157,16 +210,16 @@ class InMemoryRepository(DialogRepository):
                     ],
                 )
             elif isinstance(event, DrillCompleted):
-                print("(The drill is complete. Type 'more' for another drill or crtl-D to exit.)")
+                self.notify(
+                    "(The drill is complete. Type 'more' for another drill or crtl-D to exit.)"
+                )
             elif isinstance(event, SchedulingDrillRequested):
-                print("Scheduling drill requested")
+                self.notify("Scheduling drill requested")
         if drill_to_start:
-            global SEQ
-            SEQ += 1
             drill = DRILLS[drill_to_start]
             process_command(
-                StartDrill(PHONE_NUMBER, drill.slug, drill.dict(), uuid.uuid4()),
-                str(SEQ),
+                StartDrill(dialog_state.phone_number, drill.slug, drill.dict(), uuid.uuid4()),
+                session.next_seq(),
                 repo=self,
             )
 
@@ -186,28 +239,23 @@ class FakeRegistrationValidator(RegistrationValidator):
         return CodeValidationPayload(valid=False)
 
 
-def main() -> None:
-    global SEQ
-    if len(sys.argv) > 1:
-        lang = sys.argv[1]
-    else:
-        lang = "en"
+def interactive(lang: str) -> None:
     repo = InMemoryRepository(lang)
     validator = FakeRegistrationValidator()
+    session = repo.session(PHONE_NUMBER)
 
     # kick off the language choice drill
     process_command(
         ProcessSMSMessage(PHONE_NUMBER, "00-language", registration_validator=validator),
-        "1",
+        session.next_seq(),
         repo=repo,
     )
     try:
         while True:
             message = input("> ")
-            SEQ += 1
             process_command(
                 ProcessSMSMessage(PHONE_NUMBER, message, registration_validator=validator),
-                str(SEQ),
+                session.next_seq(),
                 repo=repo,
             )
     except EOFError:
@@ -216,5 +264,150 @@ def main() -> None:
     print(f"{dialog_state.user_profile}")
 
 
+# Headless mode runs many scripted users at once, e.g.
+#
+#   python simulator.py --headless --users 5000 --workers 16 --answers correct=0.7,wrong=0.2,stop=0.01
+#
+# Each user registers with the code of a drill in their language, answers every prompt they're
+# sent according to the answer distribution, and asks for more drills until they've done
+# --drills of them, run out, or opted out. Each user's commands run in order on one worker.
+
+ANSWER_KINDS = ["correct", "wrong", "gibberish", "stop"]
+# a user who keeps getting nowhere gives up
+MAX_MESSAGES_PER_USER = 200
+
+
+class UserResult(NamedTuple):
+    commands: int
+    drills_completed: int
+    opted_out: bool
+
+
+def parse_answers(spec: str) -> Dict[str, float]:
+    # "correct=0.7,wrong=0.2" -> {"correct": 0.7, "wrong": 0.2, "gibberish": 0, "stop": 0}
+    weights = {kind: 0.0 for kind in ANSWER_KINDS}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in weights:
+            raise argparse.ArgumentTypeError(f"unknown answer kind: {kind}")
+        weights[kind.strip()] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("at least one answer kind needs a positive weight")
+    return weights
+
+
+def _answer(prompt_correct_response: Optional[str], kind: str, rng: random.Random) -> str:
+    if kind == "stop":
+        return "STOP"
+    if kind == "gibberish":
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12)))
+    if kind == "wrong" and prompt_correct_response is not None:
+        return "zzz"
+    return prompt_correct_response or "ok"
+
+
+def run_user(
+    repo: InMemoryRepository,
+    validator: RegistrationValidator,
+    phone_number: str,
+    lang: str,
+    drills: int,
+    answers: Dict[str, float],
+    rng: random.Random,
+) -> UserResult:
+    session = repo.session(phone_number, lang)
+    commands = 0
+
+    def send(message: str) -> None:
+        nonlocal commands
+        commands += 1
+        process_command(
+            ProcessSMSMessage(phone_number, message, registration_validator=validator),
+            session.next_seq(),
+            repo=repo,
+        )
+
+    kinds = list(answers)
+    weights = [answers[kind] for kind in kinds]
+    send(rng.choice(DRILL_LOADER.get_slugs_for_language(lang)))
+    while commands < MAX_MESSAGES_PER_USER:
+        state = repo.fetch_dialog_state(phone_number)
+        if state.user_profile.opted_out:
+            break
+        prompt = state.get_prompt()
+        if prompt is None:
+            if len(session.started_drills) >= drills:
+                break
+            started = len(session.started_drills)
+            send("more")
+            if len(session.started_drills) == started:
+                # out of drills
+                break
+            continue
+        send(_answer(prompt.correct_response, rng.choices(kinds, weights)[0], rng))
+    state = repo.fetch_dialog_state(phone_number)
+    in_progress = 1 if state.get_prompt() is not None else 0
+    return UserResult(
+        commands=commands,
+        drills_completed=len(session.started_drills) - in_progress,
+        opted_out=bool(state.user_profile.opted_out),
+    )
+
+
+def headless(
+    users: int, workers: int, drills: int, answers: Dict[str, float], seed: int, lang: str
+) -> None:
+    repo = InMemoryRepository(lang, send_sms=count_sms, notify=None)
+    validator = FakeRegistrationValidator()
+    languages = [lang] if lang != "mixed" else ["en", "es"]
+
+    def run(user: int) -> UserResult:
+        # seeded per user, so a user's script doesn't depend on how the workers interleave
+        rng = random.Random(seed * 1_000_003 + user)
+        return run_user(
+            repo,
+            validator,
+            f"+1555{user:07d}",
+            rng.choice(languages),
+            drills,
+            answers,
+            rng,
+        )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, range(users)))
+    elapsed = time.perf_counter() - start
+    commands = sum(result.commands for result in results)
+    print(f"users:              {users}")
+    print(f"commands:           {commands}")
+    print(f"sms:                {repo.sms_sent}")
+    print(f"drills completed:   {sum(result.drills_completed for result in results)}")
+    print(f"opted out:          {sum(1 for result in results if result.opted_out)}")
+    print(f"elapsed:            {elapsed:.2f}s")
+    print(f"commands/sec:       {commands / elapsed:.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("lang", nargs="?", default="en", help="en, es, or mixed (headless only)")
+    parser.add_argument("--headless", action="store_true", help="run scripted users, no input")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--drills", type=int, default=2, help="drills per user")
+    parser.add_argument(
+        "--answers",
+        type=parse_answers,
+        default="correct=0.75,wrong=0.15,gibberish=0.08,stop=0.02",
+        help="relative weights of correct, wrong, gibberish and stop answers",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.headless:
+        headless(args.users, args.workers, args.drills, args.answers, args.seed, args.lang)
+    else:
+        interactive(args.lang)
+
+
 if __name__ == "__main__":
     main()
@@ -1,9 +1,13 @@
-import rollbar
+from typing import Any
+
+from stopcovid.utils import rollbar
 
 from stopcovid.utils.kinesis import get_payload_from_kinesis_record
 from stopcovid.dialog.command_stream.types import InboundCommand
 from stopcovid.dialog.command_stream.command_stream import handle_inbound_commands
+from stopcovid.utils.instrumentation import flush_metrics, increment, timer
 from stopcovid.utils.logging import configure_logging
+from stopcovid.utils.profiling import profile_handler
 from stopcovid.utils.rollbar import configure_rollbar
 from stopcovid.utils.verify_deploy_stage import verify_deploy_stage
 
@@ -20,9 +24,15 @@ def _make_inbound_command(record: dict) -> InboundCommand:
     )
 
 
-@rollbar.lambda_function  # type: ignore
-def handler(event: dict, context: dict) -> dict:
+@rollbar.lambda_function
+@profile_handler
+def handler(event: dict, context: Any) -> dict:
     verify_deploy_stage()
-    inbound_commands = [_make_inbound_command(record) for record in event["Records"]]
-    handle_inbound_commands(inbound_commands)
+    try:
+        with timer("kinesis_decode"):
+            inbound_commands = [_make_inbound_command(record) for record in event["Records"]]
+        increment("inbound_commands", len(inbound_commands))
+        handle_inbound_commands(inbound_commands, context.get_remaining_time_in_millis)
+    finally:
+        flush_metrics("handle_command")
     return {"statusCode": 200}
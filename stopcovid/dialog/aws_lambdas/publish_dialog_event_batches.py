@@ -1,11 +1,11 @@
 import os
-from typing import List
+from typing import List, Tuple
 
-import rollbar
+from stopcovid.utils import rollbar
 
-from stopcovid.dialog.models.events import batch_from_dict, DialogEventBatch
 from stopcovid.utils import dynamodb as dynamodb_utils
 from stopcovid.utils.logging import configure_logging
+from stopcovid.utils.profiling import profile_handler
 from stopcovid.utils.rollbar import configure_rollbar
 from stopcovid.utils.verify_deploy_stage import verify_deploy_stage
 from stopcovid.utils.boto3 import get_boto3_client
@@ -14,11 +14,17 @@ configure_logging()
 configure_rollbar()
 
 
-@rollbar.lambda_function  # type: ignore
+@rollbar.lambda_function
+@profile_handler
 def handler(event: dict, context: dict) -> dict:
     verify_deploy_stage()
+    # Event batches are passed through as stored. Hydrating them into models would only
+    # validate and re-serialize them, and importing the models slows our cold start.
     event_batches = [
-        batch_from_dict(dynamodb_utils.deserialize(record["dynamodb"]["NewImage"]))
+        (
+            record["dynamodb"]["NewImage"]["phone_number"]["S"],
+            dynamodb_utils.deserialize_to_json(record["dynamodb"]["NewImage"]),
+        )
         for record in event["Records"]
         if record["dynamodb"].get("NewImage")
     ]
@@ -28,16 +34,16 @@ def handler(event: dict, context: dict) -> dict:
     return {"statusCode": 200}
 
 
-def _publish_event_batches_to_kinesis(event_batches: List[DialogEventBatch]) -> None:
+def _publish_event_batches_to_kinesis(event_batches: List[Tuple[str, str]]) -> None:
     kinesis = get_boto3_client("kinesis")
     stage = os.environ.get("STAGE")
     stream_name = f"dialog-event-batches-{stage}"
     records = [
         {
-            "PartitionKey": event_batch.phone_number,
-            "Data": event_batch.json(),
+            "PartitionKey": phone_number,
+            "Data": event_batch_json,
         }
-        for event_batch in event_batches
+        for phone_number, event_batch_json in event_batches
     ]
     response = kinesis.put_records(StreamName=stream_name, Records=records)
     if response.get("FailedRecordCount"):
@@ -0,0 +1,22 @@
+from stopcovid.utils import rollbar
+
+from stopcovid.dialog.command_stream.scheduled_commands import drain_due_commands
+from stopcovid.utils.instrumentation import flush_metrics
+from stopcovid.utils.logging import configure_logging
+from stopcovid.utils.profiling import profile_handler
+from stopcovid.utils.rollbar import configure_rollbar
+from stopcovid.utils.verify_deploy_stage import verify_deploy_stage
+
+configure_logging()
+configure_rollbar()
+
+
+@rollbar.lambda_function
+@profile_handler
+def handler(event: dict, context: dict) -> dict:
+    verify_deploy_stage()
+    try:
+        drain_due_commands()
+    finally:
+        flush_metrics("tick_scheduled_commands")
+    return {"statusCode": 200}
@@ -0,0 +1,228 @@
+import datetime
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import pydantic
+
+from stopcovid.dialog.persistence import DynamoDBDialogRepository
+from stopcovid.utils import dynamodb as dynamodb_utils
+from stopcovid.utils.boto3 import get_boto3_client
+from stopcovid.utils.instrumentation import increment
+from .publish import CommandPublisher
+
+# A broadcast is fanned out into one SEND_AD_HOC_MESSAGE command per recipient, published to the
+# command stream in chunks. Each invocation works for a bounded amount of time, checkpoints its
+# progress after every chunk and, if there are recipients left, re-publishes the broadcast command
+# to continue where it left off. Delivery is at least once: if a checkpoint fails after a chunk
+# is published, the chunk is published again when the command is retried.
+#
+# Each continuation is numbered, and the progress records the number of the latest one. A
+# broadcast command whose number isn't the latest, e.g. one redelivered because a later command
+# in its batch failed, is skipped, so a retried batch doesn't start a second continuation.
+
+BROADCAST_MAX_RECORDS_PER_SECOND_ENV_VAR = "BROADCAST_MAX_RECORDS_PER_SECOND"
+BROADCAST_TIME_BUDGET_SECONDS_ENV_VAR = "BROADCAST_TIME_BUDGET_SECONDS"
+
+# each shard of the command stream accepts 1000 records per second, shared with other traffic
+DEFAULT_MAX_RECORDS_PER_SECOND = 500
+# when the remaining time of the invocation isn't known
+DEFAULT_TIME_BUDGET_SECONDS = 3.0
+# of the invocation's remaining time, left for the rest of the batch and the continuation
+RESERVED_SECONDS = 2.0
+BROADCAST_CHUNK_SIZE = 500
+PROGRESS_EXPIRATION_DAYS = 30
+
+
+class BroadcastError(Exception):
+    pass
+
+
+class BroadcastAdHocMessage(pydantic.BaseModel):
+    broadcast_id: str
+    message: str
+    media_url: Optional[str] = None
+    # either an explicit list of recipients...
+    phone_numbers: Optional[List[str]] = None
+    # ...or every user at an employer (and optionally a unit) who hasn't opted out
+    employer_id: Optional[int] = None
+    unit_id: Optional[int] = None
+    continuation: int = 0
+
+    @pydantic.root_validator
+    def check_recipients(cls, values: dict) -> dict:
+        if (values.get("phone_numbers") is None) == (values.get("employer_id") is None):
+            raise ValueError("a broadcast needs exactly one of phone_numbers or employer_id")
+        return values
+
+
+class BroadcastProgress(pydantic.BaseModel):
+    broadcast_id: str
+    published: int = 0
+    # the page of recipients being published (the scan's ExclusiveStartKey, None for the first
+    # page) and how many of its recipients have been published
+    page_key: Optional[dict] = None
+    offset: int = 0
+    complete: bool = False
+    # of the latest broadcast command published to continue the fan-out
+    continuation: int = 0
+
+
+class BroadcastProgressRepository:
+    def __init__(self, **kwargs: Any) -> None:
+        self.dynamodb = get_boto3_client("dynamodb", **kwargs)
+        self.stage = os.environ.get("STAGE")
+
+    def _table_name(self) -> str:
+        return f"broadcast-progress-{self.stage}"
+
+    def fetch_progress(self, broadcast_id: str) -> BroadcastProgress:
+        response = self.dynamodb.get_item(
+            TableName=self._table_name(),
+            Key={"broadcast_id": {"S": broadcast_id}},
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return BroadcastProgress(broadcast_id=broadcast_id)
+        return BroadcastProgress(**dynamodb_utils.deserialize(response["Item"]))
+
+    def save_progress(self, progress: BroadcastProgress) -> None:
+        expiration = datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(
+            days=PROGRESS_EXPIRATION_DAYS
+        )
+        item = json.loads(progress.json())
+        item["expiration_ts"] = int(expiration.timestamp())
+        self.dynamodb.put_item(TableName=self._table_name(), Item=dynamodb_utils.serialize(item))
+
+    def drop_and_recreate_table(self) -> None:
+        if self.stage != "test":
+            raise RuntimeError("Method unsafe to run in non test environment")
+        try:
+            self.dynamodb.delete_table(TableName=self._table_name())
+        except Exception:
+            # Table already does not exist
+            pass
+
+        self.dynamodb.create_table(
+            TableName=self._table_name(),
+            KeySchema=[{"AttributeName": "broadcast_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "broadcast_id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+class RateLimiter:
+    def __init__(self, per_second: float) -> None:
+        self.per_second = per_second
+        self.next_time = time.monotonic()
+
+    def acquire(self, count: int) -> None:
+        now = time.monotonic()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time = max(now, self.next_time) + count / self.per_second
+
+
+class BroadcastFanOut:
+    def __init__(
+        self,
+        publisher: Optional[CommandPublisher] = None,
+        progress_repo: Optional[BroadcastProgressRepository] = None,
+        dialog_repo: Optional[DynamoDBDialogRepository] = None,
+    ) -> None:
+        self.publisher = publisher or CommandPublisher()
+        self.progress_repo = progress_repo or BroadcastProgressRepository()
+        self.dialog_repo = dialog_repo or DynamoDBDialogRepository()
+        self.max_records_per_second = float(
+            os.getenv(BROADCAST_MAX_RECORDS_PER_SECOND_ENV_VAR, DEFAULT_MAX_RECORDS_PER_SECOND)
+        )
+        self.time_budget_seconds = float(
+            os.getenv(BROADCAST_TIME_BUDGET_SECONDS_ENV_VAR, DEFAULT_TIME_BUDGET_SECONDS)
+        )
+
+    def _pages(
+        self, broadcast: BroadcastAdHocMessage, page_key: Optional[dict]
+    ) -> Iterator[Tuple[List[str], Optional[dict]]]:
+        # yields each page of recipients, starting from page_key, and the key of the next page
+        if broadcast.phone_numbers is not None:
+            yield broadcast.phone_numbers, None
+            return
+        assert broadcast.employer_id is not None
+        while True:
+            phone_numbers, next_key = self.dialog_repo.scan_phone_numbers_for_account(
+                broadcast.employer_id, broadcast.unit_id, page_key
+            )
+            yield phone_numbers, next_key
+            if next_key is None:
+                return
+            page_key = next_key
+
+    def fan_out(
+        self,
+        broadcast: BroadcastAdHocMessage,
+        remaining_time_ms: Optional[Callable[[], int]] = None,
+    ) -> BroadcastProgress:
+        # remaining_time_ms is the invocation's, e.g. context.get_remaining_time_in_millis
+        progress = self.progress_repo.fetch_progress(broadcast.broadcast_id)
+        if progress.complete:
+            logging.info(f"Broadcast {broadcast.broadcast_id} already complete. Skipping.")
+            return progress
+        if broadcast.continuation != progress.continuation:
+            logging.info(
+                f"Broadcast {broadcast.broadcast_id}: skipping continuation "
+                f"{broadcast.continuation}, the latest is {progress.continuation}."
+            )
+            increment("broadcast_stale_continuations_skipped")
+            return progress
+        if remaining_time_ms is None:
+            time_budget_seconds = self.time_budget_seconds
+        else:
+            time_budget_seconds = remaining_time_ms() / 1000 - RESERVED_SECONDS
+        deadline = time.monotonic() + time_budget_seconds
+        limiter = RateLimiter(self.max_records_per_second)
+        for phone_numbers, next_key in self._pages(broadcast, progress.page_key):
+            while progress.offset < len(phone_numbers):
+                if time.monotonic() >= deadline:
+                    logging.info(
+                        f"Broadcast {broadcast.broadcast_id}: published {progress.published} "
+                        "so far. Continuing in another invocation."
+                    )
+                    # published before it's recorded: if recording it fails, the retried
+                    # command publishes it again, and the duplicate is skipped
+                    continuation = broadcast.copy(
+                        update={"continuation": progress.continuation + 1}
+                    )
+                    self.publisher.publish_broadcast_command(
+                        broadcast.broadcast_id, json.loads(continuation.json())
+                    )
+                    progress.continuation = continuation.continuation
+                    self.progress_repo.save_progress(progress)
+                    return progress
+                chunk = phone_numbers[progress.offset : progress.offset + BROADCAST_CHUNK_SIZE]
+                limiter.acquire(len(chunk))
+                failed = self.publisher.publish_ad_hoc_message_commands(
+                    chunk, broadcast.message, broadcast.media_url
+                )
+                if failed:
+                    raise BroadcastError(
+                        f"Broadcast {broadcast.broadcast_id}: failed to publish {len(failed)} "
+                        "commands"
+                    )
+                increment("broadcast_commands_published", len(chunk))
+                progress.offset += len(chunk)
+                progress.published += len(chunk)
+                self.progress_repo.save_progress(progress)
+            progress.page_key = next_key
+            progress.offset = 0
+        progress.complete = True
+        self.progress_repo.save_progress(progress)
+        logging.info(f"Broadcast {broadcast.broadcast_id} complete: {progress.published} sent")
+        return progress
+
+
+def fan_out_broadcast(
+    payload: dict, remaining_time_ms: Optional[Callable[[], int]] = None
+) -> BroadcastProgress:
+    return BroadcastFanOut().fan_out(BroadcastAdHocMessage(**payload), remaining_time_ms)
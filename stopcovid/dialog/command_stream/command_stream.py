@@ -1,4 +1,5 @@
-from typing import List
+import uuid
+from typing import Callable, List, Optional
 
 from stopcovid.dialog.engine import (
     process_command,
@@ -6,11 +7,24 @@ from stopcovid.dialog.engine import (
     ProcessSMSMessage,
     SendAdHocMessage,
     UpdateUser,
+    TriggerReminder,
+    prefetch_registration_codes,
 )
+from .broadcast import fan_out_broadcast
 from .types import InboundCommand, InboundCommandType
 
 
-def handle_inbound_commands(commands: List[InboundCommand]) -> dict:
+def handle_inbound_commands(
+    commands: List[InboundCommand], remaining_time_ms: Optional[Callable[[], int]] = None
+) -> dict:
+    inbound_messages = [
+        (command.payload["From"], command.payload["Body"])
+        for command in commands
+        if command.command_type is InboundCommandType.INBOUND_SMS
+    ]
+    # a lone message gains nothing from being validated ahead of time
+    if len(inbound_messages) > 1:
+        prefetch_registration_codes(inbound_messages)
     for command in commands:
         if command.command_type is InboundCommandType.INBOUND_SMS:
             process_command(
@@ -30,6 +44,15 @@ def handle_inbound_commands(commands: List[InboundCommand]) -> dict:
                 ),
                 command.sequence_number,
             )
+        elif command.command_type is InboundCommandType.TRIGGER_REMINDER:
+            process_command(
+                TriggerReminder(
+                    phone_number=command.payload["phone_number"],
+                    drill_instance_id=uuid.UUID(command.payload["drill_instance_id"]),
+                    prompt_slug=command.payload["prompt_slug"],
+                ),
+                command.sequence_number,
+            )
         elif command.command_type is InboundCommandType.SEND_AD_HOC_MESSAGE:
             process_command(
                 SendAdHocMessage(
@@ -48,6 +71,8 @@ def handle_inbound_commands(commands: List[InboundCommand]) -> dict:
                 ),
                 command.sequence_number,
             )
+        elif command.command_type is InboundCommandType.BROADCAST_AD_HOC_MESSAGE:
+            fan_out_broadcast(command.payload, remaining_time_ms)
         else:
             raise RuntimeError(f"Unknown command: {command.command_type}")
 
@@ -1,11 +1,41 @@
 import json
 import logging
 import os
-from typing import Dict, Any, List, Tuple
-import rollbar
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+from stopcovid.utils import rollbar
 
 from stopcovid.utils.boto3 import get_boto3_client
 
+# put_records accepts at most 500 records and 5 MB, counting data and partition keys, per call
+MAX_RECORDS_PER_PUT = 500
+MAX_BYTES_PER_PUT = 5 * 1024 * 1024
+MAX_PUT_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 0.1
+
+# (partition key, command)
+Command = Tuple[str, Dict[str, Any]]
+
+
+def chunk_commands(commands: List[Command]) -> List[List[Command]]:
+    # e.g. START_DRILL commands carry the whole drill, so a full chunk can exceed the byte limit
+    chunks: List[List[Command]] = []
+    chunk: List[Command] = []
+    chunk_bytes = 0
+    for command in commands:
+        partition_key, data = command
+        size = len(partition_key.encode("utf-8")) + len(json.dumps(data).encode("utf-8"))
+        if chunk and (len(chunk) == MAX_RECORDS_PER_PUT or chunk_bytes + size > MAX_BYTES_PER_PUT):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(command)
+        chunk_bytes += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
 
 class CommandPublisher:
     def __init__(self) -> None:
@@ -31,12 +61,117 @@ class CommandPublisher:
             ]
         )
 
-    def _publish_commands(self, commands: List[Tuple[str, Dict[str, Any]]]) -> None:
+    def publish_ad_hoc_message_commands(
+        self, phone_numbers: List[str], message: str, media_url: Optional[str] = None
+    ) -> List[Command]:
+        return self.publish_commands(
+            [
+                (
+                    phone_number,
+                    {
+                        "type": "SEND_AD_HOC_MESSAGE",
+                        "payload": {
+                            "phone_number": phone_number,
+                            "message": message,
+                            "media_url": media_url,
+                        },
+                    },
+                )
+                for phone_number in phone_numbers
+            ]
+        )
+
+    def publish_start_drill_commands(
+        self, drills: List[Tuple[str, str, uuid.UUID]]
+    ) -> List[Command]:
+        # (phone number, drill slug, drill instance id) for each drill to start
+        # the drill models stay out of the cold start of handlers that only publish SMS commands
+        from stopcovid.drills.bundle import get_drill_loader
+
+        drill_bodies: Dict[str, dict] = {}
+        commands = []
+        for phone_number, drill_slug, drill_instance_id in drills:
+            if drill_slug not in drill_bodies:
+                drill_bodies[drill_slug] = json.loads(
+                    get_drill_loader().get_drill(drill_slug).json()
+                )
+            commands.append(
+                (
+                    phone_number,
+                    {
+                        "type": "START_DRILL",
+                        "payload": {
+                            "phone_number": phone_number,
+                            "drill_slug": drill_slug,
+                            "drill_body": drill_bodies[drill_slug],
+                            "drill_instance_id": str(drill_instance_id),
+                        },
+                    },
+                )
+            )
+        logging.info(f"publishing {len(commands)} START_DRILL commands")
+        return self.publish_commands(commands)
+
+    def publish_trigger_reminder_commands(
+        self, reminders: List[Tuple[str, uuid.UUID, str]]
+    ) -> List[Command]:
+        # (phone number, drill instance id, prompt slug) for each reminder to send
+        logging.info(f"publishing {len(reminders)} TRIGGER_REMINDER commands")
+        return self.publish_commands(
+            [
+                (
+                    phone_number,
+                    {
+                        "type": "TRIGGER_REMINDER",
+                        "payload": {
+                            "phone_number": phone_number,
+                            "drill_instance_id": str(drill_instance_id),
+                            "prompt_slug": prompt_slug,
+                        },
+                    },
+                )
+                for phone_number, drill_instance_id, prompt_slug in reminders
+            ]
+        )
+
+    def publish_broadcast_command(self, broadcast_id: str, payload: Dict[str, Any]) -> None:
+        logging.info(f"publishing BROADCAST_AD_HOC_MESSAGE command for {broadcast_id}")
+        self._publish_commands(
+            [(broadcast_id, {"type": "BROADCAST_AD_HOC_MESSAGE", "payload": payload})]
+        )
+
+    def publish_commands(self, commands: List[Command]) -> List[Command]:
+        # Publishes commands in as few put_records calls as possible. Each command is keyed by
+        # phone number, so commands for the same user stay in order. Returns the commands that
+        # could not be published.
+        failed = []
+        for chunk in chunk_commands(commands):
+            failed.extend(self._publish_commands(chunk))
+        return failed
+
+    def _publish_commands(self, commands: List[Command]) -> List[Command]:
         kinesis = get_boto3_client("kinesis")
-        records = [
-            {"Data": json.dumps(data), "PartitionKey": phone_number}
-            for phone_number, data in commands
-        ]
-        response = kinesis.put_records(StreamName=f"command-stream-{self.stage}", Records=records)
-        if response.get("FailedRecordCount"):
-            rollbar.report_exc_info(extra_data=response)
+        pending = commands
+        for attempt in range(MAX_PUT_ATTEMPTS):
+            if attempt:
+                time.sleep(RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+            records = [
+                {"Data": json.dumps(data), "PartitionKey": phone_number}
+                for phone_number, data in pending
+            ]
+            response = kinesis.put_records(
+                StreamName=f"command-stream-{self.stage}", Records=records
+            )
+            if not response.get("FailedRecordCount"):
+                return []
+            # put_records returns a result for every record, in order. Only retry the failures.
+            retryable = [
+                command
+                for command, result in zip(pending, response.get("Records", []))
+                if result.get("ErrorCode")
+            ]
+            if not retryable:
+                break
+            pending = retryable
+        rollbar.report_exc_info(extra_data=response)
+        return pending
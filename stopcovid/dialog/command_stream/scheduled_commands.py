@@ -0,0 +1,245 @@
+import datetime
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import pydantic
+from botocore.exceptions import ClientError
+
+from stopcovid.utils import dynamodb as dynamodb_utils
+from stopcovid.utils.boto3 import get_boto3_client
+from stopcovid.utils.instrumentation import increment
+from stopcovid.utils.sweep_watermarks import SweepWatermarkRepository
+from .publish import Command, CommandPublisher
+
+# A timer wheel for commands that should run later, e.g. "start the next drill 24 hours after
+# this one" or "re-prompt after 10 minutes of silence". Timers are keyed by their id and indexed
+# by the minute they fire in, spread over a few shards so a popular minute doesn't become a hot
+# partition. Scheduling, rescheduling or cancelling a timer is one write, and a tick every minute
+# reads only the slots that are due and publishes their commands in bulk.
+#
+# Each tick records the slot it got up to, and the next one starts there, so timers that fired
+# while ticks were failing or not running are published once they run again. A tick that fails
+# to publish some commands doesn't move on.
+
+SLOT_SECONDS = 60
+SHARDS = 8
+# timers that are never drained, e.g. after a long outage, are dropped after this long
+TIMER_EXPIRATION = datetime.timedelta(days=2)
+SWEEP_NAME = "scheduled-commands"
+# how far back the first tick goes
+DRAIN_LOOKBACK_SLOTS = 15
+# older timers have expired
+MAX_DRAIN_SLOTS = int(TIMER_EXPIRATION.total_seconds()) // SLOT_SECONDS
+# slots are read concurrently; boto3 clients are thread safe
+MAX_WORKERS = 8
+
+SLOT_INDEX = "by_slot"
+
+
+class ScheduledCommand(pydantic.BaseModel):
+    timer_id: str
+    fire_ts: int
+    partition_key: str
+    command: Dict[str, Any]
+
+
+def slot_for(fire_ts: float) -> int:
+    return int(fire_ts // SLOT_SECONDS * SLOT_SECONDS)
+
+
+def shard_for(timer_id: str) -> int:
+    # stable across processes, unlike hash(), so a timer can be found again to cancel it
+    return zlib.crc32(timer_id.encode("utf-8")) % SHARDS
+
+
+def slot_key(slot: int, shard: int) -> str:
+    return f"{slot}#{shard}"
+
+
+class ScheduledCommandRepository:
+    def __init__(self, **kwargs: Any) -> None:
+        self.dynamodb = get_boto3_client("dynamodb", **kwargs)
+        self.stage = os.environ.get("STAGE")
+
+    def _table_name(self) -> str:
+        return f"scheduled-commands-{self.stage}"
+
+    def save(self, scheduled_command: ScheduledCommand) -> None:
+        self.dynamodb.put_item(TableName=self._table_name(), Item=self._item(scheduled_command))
+
+    def delete(self, timer_id: str) -> None:
+        self.dynamodb.delete_item(TableName=self._table_name(), Key=self._key(timer_id))
+
+    def delete_all(self, scheduled_commands: List[ScheduledCommand]) -> None:
+        # one conditional delete per timer, so a timer rescheduled since it was read isn't lost
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            list(executor.map(self._delete_if_unchanged, scheduled_commands))
+
+    def _delete_if_unchanged(self, scheduled_command: ScheduledCommand) -> None:
+        try:
+            self.dynamodb.delete_item(
+                TableName=self._table_name(),
+                Key=self._key(scheduled_command.timer_id),
+                ConditionExpression="fire_ts = :fire_ts AND #command = :command",
+                ExpressionAttributeNames={"#command": "command"},
+                ExpressionAttributeValues={
+                    ":fire_ts": {"N": str(scheduled_command.fire_ts)},
+                    ":command": {"S": json.dumps(scheduled_command.command)},
+                },
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def fetch_slot(self, slot: int, shard: int, fire_before: int) -> List[ScheduledCommand]:
+        return [
+            ScheduledCommand(
+                timer_id=item["timer_id"]["S"],
+                fire_ts=int(item["fire_ts"]["N"]),
+                partition_key=item["partition_key"]["S"],
+                command=json.loads(item["command"]["S"]),
+            )
+            for item in dynamodb_utils.query_items(
+                self.dynamodb,
+                TableName=self._table_name(),
+                IndexName=SLOT_INDEX,
+                KeyConditionExpression="slot_key = :slot_key AND fire_ts <= :fire_before",
+                ExpressionAttributeValues={
+                    ":slot_key": {"S": slot_key(slot, shard)},
+                    ":fire_before": {"N": str(fire_before)},
+                },
+            )
+        ]
+
+    @staticmethod
+    def _key(timer_id: str) -> dict:
+        return {"timer_id": {"S": timer_id}}
+
+    @staticmethod
+    def _item(scheduled_command: ScheduledCommand) -> dict:
+        return {
+            **ScheduledCommandRepository._key(scheduled_command.timer_id),
+            "slot_key": {
+                "S": slot_key(
+                    slot_for(scheduled_command.fire_ts), shard_for(scheduled_command.timer_id)
+                )
+            },
+            "fire_ts": {"N": str(scheduled_command.fire_ts)},
+            "partition_key": {"S": scheduled_command.partition_key},
+            # stored as a string: commands are only ever read back to be published as JSON
+            "command": {"S": json.dumps(scheduled_command.command)},
+            "expiration_ts": {
+                "N": str(int(scheduled_command.fire_ts + TIMER_EXPIRATION.total_seconds()))
+            },
+        }
+
+    def drop_and_recreate_table(self) -> None:
+        if self.stage != "test":
+            raise RuntimeError("Method unsafe to run in non test environment")
+        try:
+            self.dynamodb.delete_table(TableName=self._table_name())
+        except Exception:
+            # Table already does not exist
+            pass
+
+        self.dynamodb.create_table(
+            TableName=self._table_name(),
+            KeySchema=[{"AttributeName": "timer_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "timer_id", "AttributeType": "S"},
+                {"AttributeName": "slot_key", "AttributeType": "S"},
+                {"AttributeName": "fire_ts", "AttributeType": "N"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": SLOT_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "slot_key", "KeyType": "HASH"},
+                        {"AttributeName": "fire_ts", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def schedule_command(
+    partition_key: str,
+    command: Dict[str, Any],
+    fire_at: datetime.datetime,
+    timer_id: Optional[str] = None,
+    repo: Optional[ScheduledCommandRepository] = None,
+) -> ScheduledCommand:
+    # command is what CommandPublisher would put on the command stream, e.g.
+    # {"type": "SEND_AD_HOC_MESSAGE", "payload": {...}}. Pass a timer_id to be able to cancel
+    # or reschedule the timer: scheduling a timer_id again replaces its time and command.
+    scheduled_command = ScheduledCommand(
+        timer_id=timer_id or str(uuid.uuid4()),
+        # a timer in the past fires on the next tick
+        fire_ts=int(max(fire_at.timestamp(), time.time())),
+        partition_key=partition_key,
+        command=command,
+    )
+    (repo or ScheduledCommandRepository()).save(scheduled_command)
+    return scheduled_command
+
+
+def cancel_command(timer_id: str, repo: Optional[ScheduledCommandRepository] = None) -> None:
+    (repo or ScheduledCommandRepository()).delete(timer_id)
+
+
+def drain_due_commands(
+    now: Optional[float] = None,
+    repo: Optional[ScheduledCommandRepository] = None,
+    publisher: Optional[CommandPublisher] = None,
+    watermark_repo: Optional[SweepWatermarkRepository] = None,
+) -> int:
+    # Publishes every timer that has fired and deletes it. Timers whose commands couldn't be
+    # published stay in the wheel for the next tick.
+    repo = repo or ScheduledCommandRepository()
+    publisher = publisher or CommandPublisher()
+    watermark_repo = watermark_repo or SweepWatermarkRepository()
+    now = time.time() if now is None else now
+    current_slot = slot_for(now)
+    watermark = watermark_repo.fetch_watermark(SWEEP_NAME)
+    if watermark is None:
+        watermark = current_slot - DRAIN_LOOKBACK_SLOTS * SLOT_SECONDS
+    first_slot = max(watermark, current_slot - MAX_DRAIN_SLOTS * SLOT_SECONDS)
+    slots = [
+        (slot, shard)
+        for slot in range(first_slot, current_slot + 1, SLOT_SECONDS)
+        for shard in range(SHARDS)
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pages = executor.map(lambda slot: repo.fetch_slot(slot[0], slot[1], int(now)), slots)
+        due = [scheduled_command for page in pages for scheduled_command in page]
+    if not due:
+        watermark_repo.save_watermark(SWEEP_NAME, current_slot)
+        return 0
+    # timers fire in order within each partition key
+    due.sort(key=lambda scheduled_command: scheduled_command.fire_ts)
+    commands: List[Command] = [
+        (scheduled_command.partition_key, scheduled_command.command) for scheduled_command in due
+    ]
+    # publish_commands returns the failed commands themselves, so they're matched by identity
+    failed = {id(command) for command in publisher.publish_commands(commands)}
+    fired = [
+        scheduled_command
+        for scheduled_command, command in zip(due, commands)
+        if id(command) not in failed
+    ]
+    repo.delete_all(fired)
+    if len(fired) < len(due):
+        logging.warning(f"Failed to publish {len(due) - len(fired)} scheduled commands")
+    else:
+        # the current slot's later timers aren't due yet, so the next tick reads it again
+        watermark_repo.save_watermark(SWEEP_NAME, current_slot)
+    increment("scheduled_commands_fired", len(fired))
+    return len(fired)
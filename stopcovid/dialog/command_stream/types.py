@@ -6,8 +6,10 @@ import pydantic
 class InboundCommandType(Enum):
     INBOUND_SMS = "INBOUND_SMS"
     START_DRILL = "START_DRILL"
+    TRIGGER_REMINDER = "TRIGGER_REMINDER"
     SEND_AD_HOC_MESSAGE = "SEND_AD_HOC_MESSAGE"
     UPDATE_USER = "UPDATE_USER"
+    BROADCAST_AD_HOC_MESSAGE = "BROADCAST_AD_HOC_MESSAGE"
 
 
 class InboundCommand(pydantic.BaseModel):
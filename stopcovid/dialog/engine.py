@@ -2,7 +2,7 @@ import logging
 import uuid
 from abc import ABC, abstractmethod
 from copy import deepcopy
-from typing import List, Optional, Dict, Any, Callable
+from typing import List, Optional, Dict, Any, Callable, Tuple
 
 import stopcovid.dialog.models.events
 from stopcovid.dialog.models.events import (
@@ -30,15 +30,18 @@ from stopcovid.dialog.models.events import (
     UserUpdated,
     ThankYouReceived,
     DemoRequested,
+    ReminderTriggered,
 )
 from stopcovid.dialog.persistence import DialogRepository, DynamoDBDialogRepository
 from stopcovid.dialog.registration import (
     RegistrationValidator,
     DefaultRegistrationValidator,
 )
-from stopcovid.dialog.models.state import DialogState
+from stopcovid.dialog.models.state import DialogState, UserProfile
 from stopcovid.drills.drills import Drill
 from stopcovid.sms.types import SMS
+from stopcovid.utils.instrumentation import increment, timer
+from stopcovid.utils.logging import log_structured, LazyField, should_sample
 
 DEFAULT_REGISTRATION_VALIDATOR = DefaultRegistrationValidator()
 
@@ -57,44 +60,108 @@ class Command(ABC):
 def process_command(command: Command, seq: str, repo: DialogRepository = None) -> None:
     if repo is None:
         repo = DynamoDBDialogRepository()
-    dialog_state = repo.fetch_dialog_state(command.phone_number)
+    sampled = should_sample()
+    with timer("fetch_dialog_state"):
+        dialog_state = repo.fetch_dialog_state(command.phone_number)
     command_seq = int(seq)
     state_seq = int(dialog_state.seq)
     if command_seq <= state_seq:
-        logging.info(
-            f"({command.phone_number}) Processing already processed command {seq}. Current "
-            f"dialog state has sequence {dialog_state.seq}."
+        increment("commands_skipped")
+        log_structured(
+            logging.INFO,
+            "Skipping already processed command",
+            phone_number=command.phone_number,
+            seq=seq,
+            state_seq=dialog_state.seq,
         )
         return
 
-    logging.info(
-        f"({command.phone_number}) Processing command {command}. " f"Current state: {dialog_state}."
+    log_structured(
+        logging.INFO,
+        "Processing command",
+        sampled=sampled,
+        phone_number=command.phone_number,
+        seq=seq,
+        command=LazyField(command.__str__, level=logging.INFO),
+        # serialized before the command runs, so it must not be deferred past this call
+        dialog_state=LazyField(dialog_state.dict),
     )
 
-    events = command.execute(dialog_state)
-    event_types = ", ".join(f"{event.event_type}" for event in events)
-    logging.info(f"({command.phone_number}) Applying events: {event_types}")
-    for event in events:
-        # deep copying the event so that modifications to the dialog_state don't have
-        # side effects on the events that we're persisting. The user_profile on the event
-        # should reflect the user_profile *before* the event is applied to the dialog_state.
-        deepcopy(event).apply_to(dialog_state)
+    with timer("execute_command") as execute_timer:
+        events = command.execute(dialog_state)
+    with timer("apply_events"):
+        for event in events:
+            # deep copying the event so that modifications to the dialog_state don't have
+            # side effects on the events that we're persisting. The user_profile on the event
+            # should reflect the user_profile *before* the event is applied to the dialog_state.
+            deepcopy(event).apply_to(dialog_state)
 
     end_account_info = dialog_state.user_profile.account_info
     for event in events:
         event.user_profile.account_info = end_account_info
     dialog_state.seq = seq
-    repo.persist_dialog_state(
-        DialogEventBatch(
-            events=events,
-            phone_number=command.phone_number,
-            seq=seq,
-            user_profile=dialog_state.user_profile,
-        ),
-        dialog_state,
+    with timer("persist_dialog_state") as persist_timer:
+        repo.persist_dialog_state(
+            DialogEventBatch(
+                events=events,
+                phone_number=command.phone_number,
+                seq=seq,
+                user_profile=dialog_state.user_profile,
+            ),
+            dialog_state,
+        )
+    increment("commands_processed")
+    increment("events_produced", len(events))
+    log_structured(
+        logging.INFO,
+        "Processed command",
+        sampled=sampled,
+        phone_number=command.phone_number,
+        seq=seq,
+        event_types=[event.event_type.value for event in events],
+        execute_ms=round(execute_timer.elapsed_ms, 3),
+        persist_ms=round(persist_timer.elapsed_ms, 3),
+        dialog_state=LazyField(dialog_state.dict),
+    )
+
+
+def might_send_registration_code(user_profile: UserProfile) -> bool:
+    # whether ProcessSMSMessage could send a message from this user to the registration validator
+    if user_profile.opted_out:
+        return False
+    return (
+        user_profile.is_demo
+        or not user_profile.validated
+        or bool(user_profile.account_info and not user_profile.account_info.employer_id)
     )
 
 
+def prefetch_registration_codes(
+    messages: List[Tuple[str, str]],
+    repo: Optional[DynamoDBDialogRepository] = None,
+    registration_validator: RegistrationValidator = DEFAULT_REGISTRATION_VALIDATOR,
+) -> None:
+    # Validates, in one go, every (phone number, message) that might be a registration code, so
+    # the commands that validate them hit the validator's cache instead of calling it in turn.
+    # Best effort: anything that isn't prefetched is validated when its command runs.
+    try:
+        profiles = (repo or DynamoDBDialogRepository()).fetch_user_profiles(
+            [phone_number for phone_number, _ in messages]
+        )
+        codes = [
+            content.strip().lower()
+            for phone_number, content in messages
+            if might_send_registration_code(
+                profiles.get(phone_number) or UserProfile(validated=False)
+            )
+        ]
+        if codes:
+            increment("registration_codes_prefetched", len(codes))
+            registration_validator.validate_codes(codes)
+    except Exception:
+        logging.warning("Unable to prefetch registration codes", exc_info=True)
+
+
 class StartDrill(Command):
     def __init__(
         self, phone_number: str, drill_slug: str, drill_body: dict, drill_instance_id: uuid.UUID
@@ -126,6 +193,38 @@ class StartDrill(Command):
         ]
 
 
+class TriggerReminder(Command):
+    def __init__(self, phone_number: str, drill_instance_id: uuid.UUID, prompt_slug: str) -> None:
+        super().__init__(phone_number)
+        self.drill_instance_id = drill_instance_id
+        self.prompt_slug = prompt_slug
+
+    def __str__(self) -> str:
+        return f"Trigger Reminder: {self.prompt_slug}"
+
+    def execute(self, dialog_state: DialogState) -> List[DialogEvent]:
+        # the reminder is only sent if the user is still stuck on the prompt it was scheduled for
+        prompt_state = dialog_state.current_prompt_state
+        if (
+            dialog_state.user_profile.opted_out
+            or dialog_state.drill_instance_id != self.drill_instance_id
+            or prompt_state is None
+            or prompt_state.slug != self.prompt_slug
+            or prompt_state.reminder_triggered
+        ):
+            return []
+        prompt = dialog_state.get_prompt()
+        assert prompt
+        return [
+            ReminderTriggered(
+                phone_number=self.phone_number,
+                user_profile=dialog_state.user_profile,
+                prompt=prompt,
+                drill_instance_id=self.drill_instance_id,
+            )
+        ]
+
+
 class ProcessSMSMessage(Command):
     def __init__(
         self,
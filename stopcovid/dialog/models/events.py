@@ -41,6 +41,7 @@ class DialogEventType(enum.Enum):
     USER_UPDATED = "USER_UPDATED"
     THANK_YOU_RECEIVED = "THANK_YOU_RECEIVED"
     DEMO_REQUESTED = "DEMO_REQUESTED"
+    REMINDER_TRIGGERED = "REMINDER_TRIGGERED"
 
 
 class DialogEvent(pydantic.BaseModel):
@@ -142,6 +143,16 @@ class AdvancedToNextPrompt(DialogEvent):
         )
 
 
+class ReminderTriggered(DialogEvent):
+    event_type: DialogEventType = DialogEventType.REMINDER_TRIGGERED
+    prompt: drills.Prompt
+    drill_instance_id: uuid.UUID
+
+    def apply_to(self, dialog_state: DialogState) -> None:
+        assert dialog_state.current_prompt_state
+        dialog_state.current_prompt_state.reminder_triggered = True
+
+
 class DrillCompleted(DialogEvent):
     event_type: DialogEventType = DialogEventType.DRILL_COMPLETED
     drill_instance_id: uuid.UUID
@@ -310,6 +321,7 @@ TYPE_TO_SCHEMA: Dict[DialogEventType, Type[DialogEvent]] = {
     DialogEventType.USER_UPDATED: UserUpdated,
     DialogEventType.THANK_YOU_RECEIVED: ThankYouReceived,
     DialogEventType.DEMO_REQUESTED: DemoRequested,
+    DialogEventType.REMINDER_TRIGGERED: ReminderTriggered,
 }
 
 
@@ -8,6 +8,9 @@ from stopcovid.dialog.models import SCHEMA_VERSION
 from stopcovid.dialog.registration import AccountInfo
 from stopcovid.drills import drills
 
+# how long a prompt can go unanswered before the user is reminded of it
+REMINDER_DELAY = datetime.timedelta(hours=4)
+
 
 class UserProfile(pydantic.BaseModel):
     validated: bool
@@ -61,6 +64,14 @@ class DialogState(pydantic.BaseModel):
     current_prompt_state: Optional[PromptState] = None
     schema_version: int = SCHEMA_VERSION
 
+    def reminder_due_time(self) -> Optional[datetime.datetime]:
+        # Users are reminded once per prompt, REMINDER_DELAY after they last heard from us
+        # or replied to it.
+        prompt_state = self.current_prompt_state
+        if prompt_state is None or prompt_state.reminder_triggered or self.user_profile.opted_out:
+            return None
+        return (prompt_state.last_response_time or prompt_state.start_time) + REMINDER_DELAY
+
     def get_prompt(self) -> Optional[drills.Prompt]:
         if self.current_drill is None or self.current_prompt_state is None:
             return None
@@ -76,3 +87,15 @@ class DialogState(pydantic.BaseModel):
         next_prompt = self.get_next_prompt()
         assert next_prompt
         return self.current_drill.prompts[-1].slug == next_prompt.slug
+
+
+class DialogStateSnapshot(pydantic.BaseModel):
+    # A user's dialog state as folded from their event batches, up to and including the one
+    # created at created_time. Rebuilding the state only needs the batches created after it.
+    phone_number: str
+    dialog_state: DialogState
+    # of the last batch folded in
+    seq: str
+    created_time: datetime.datetime
+    # folded in since the user's first batch
+    batch_count: int
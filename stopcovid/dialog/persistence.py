@@ -1,14 +1,46 @@
+import datetime
 import json
 import os
+import sqlite3
+import threading
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from botocore.exceptions import ClientError
 
 from stopcovid.utils import dynamodb as dynamodb_utils
 from stopcovid.utils.boto3 import get_boto3_client
-from .models.state import DialogState
+from stopcovid.utils.instrumentation import timer
+from .models.state import DialogState, DialogStateSnapshot, UserProfile
 from .models.events import DialogEventBatch, batch_from_dict
 
+# Dialog states with a reminder due are indexed by the minute it's due in. The index is sparse:
+# the attributes are removed once there's no reminder to send, so a sweep only reads users who
+# are due.
+REMINDER_INDEX = "by_reminder_due"
+REMINDER_BUCKET_SECONDS = 60
+# batch_get_item accepts at most 100 keys per call
+MAX_BATCH_GET_KEYS = 100
+
+
+def reminder_bucket_for(due_ts: float) -> int:
+    return int(due_ts // REMINDER_BUCKET_SECONDS * REMINDER_BUCKET_SECONDS)
+
+
+def reminder_index_attributes(dialog_state: DialogState) -> Dict[str, Any]:
+    due_time = dialog_state.reminder_due_time()
+    if due_time is None:
+        return {}
+    due_ts = int(due_time.timestamp())
+    return {"reminder_due_bucket": reminder_bucket_for(due_ts), "reminder_due_ts": due_ts}
+
+
+class DueReminder(NamedTuple):
+    phone_number: str
+    drill_instance_id: uuid.UUID
+    prompt_slug: str
+
 
 class DialogRepository(ABC):
     @abstractmethod
@@ -21,6 +53,29 @@ class DialogRepository(ABC):
     ) -> None:
         pass
 
+    # for rebuilding dialog states from their events
+
+    @abstractmethod
+    def fetch_dialog_event_batches(
+        self, phone_number: str, created_after: Optional[datetime.datetime] = None
+    ) -> Iterator[DialogEventBatch]:
+        pass
+
+    @abstractmethod
+    def replace_dialog_state(self, dialog_state: DialogState, expected_seq: str) -> bool:
+        # Stores the state without an event batch, unless the stored state's seq is no longer
+        # expected_seq ("0" if there was none), i.e. the engine has processed a command since.
+        pass
+
+    @abstractmethod
+    def fetch_dialog_state_snapshot(self, phone_number: str) -> Optional[DialogStateSnapshot]:
+        pass
+
+    @abstractmethod
+    def save_dialog_state_snapshot(self, snapshot: DialogStateSnapshot) -> None:
+        # replaces the user's snapshot, unless theirs is more recent
+        pass
+
 
 class DynamoDBDialogRepository(DialogRepository):
     def __init__(self, table_name_suffix: str = None, **kwargs: Any) -> None:
@@ -41,17 +96,51 @@ class DynamoDBDialogRepository(DialogRepository):
             f"dialog-state-{self.table_name_suffix}" if self.table_name_suffix else "dialog-state"
         )
 
-    def fetch_dialog_state(self, phone_number: str) -> DialogState:
-        response = self.dynamodb.get_item(
-            TableName=self.state_table_name(),
-            Key={"phone_number": {"S": phone_number}},
-            ConsistentRead=True,
+    def snapshot_table_name(self) -> str:
+        return (
+            f"dialog-state-snapshots-{self.table_name_suffix}"
+            if self.table_name_suffix
+            else "dialog-state-snapshots"
         )
+
+    def fetch_dialog_state(self, phone_number: str) -> DialogState:
+        with timer("dynamodb_get_dialog_state"):
+            response = self.dynamodb.get_item(
+                TableName=self.state_table_name(),
+                Key={"phone_number": {"S": phone_number}},
+                ConsistentRead=True,
+            )
         if "Item" not in response:
             return DialogState(phone_number=phone_number, seq="0")
         dialog_dict = dynamodb_utils.deserialize(response["Item"])
         return DialogState(**dialog_dict)
 
+    def fetch_user_profiles(self, phone_numbers: List[str]) -> Dict[str, UserProfile]:
+        # The user profiles of many users in as few reads as possible. Users without a dialog
+        # state are left out.
+        profiles = {}
+        unique_phone_numbers = list(dict.fromkeys(phone_numbers))
+        for start in range(0, len(unique_phone_numbers), MAX_BATCH_GET_KEYS):
+            request: Optional[dict] = {
+                self.state_table_name(): {
+                    "Keys": [
+                        {"phone_number": {"S": phone_number}}
+                        for phone_number in unique_phone_numbers[start : start + MAX_BATCH_GET_KEYS]
+                    ],
+                    "ProjectionExpression": "phone_number, user_profile",
+                    "ConsistentRead": True,
+                }
+            }
+            while request:
+                with timer("dynamodb_batch_get_user_profiles"):
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.state_table_name(), []):
+                    profiles[item["phone_number"]["S"]] = UserProfile(
+                        **dynamodb_utils.deserialize(item["user_profile"]["M"])
+                    )
+                request = response.get("UnprocessedKeys")
+        return profiles
+
     def fetch_dialog_event_batch(self, phone_number: str, batch_id: uuid.UUID) -> DialogEventBatch:
         response = self.dynamodb.get_item(
             TableName=self.event_batch_table_name(),
@@ -62,6 +151,81 @@ class DynamoDBDialogRepository(DialogRepository):
 
         return batch_from_dict(dialog_dict)
 
+    def fetch_dialog_event_batches(
+        self, phone_number: str, created_after: Optional[datetime.datetime] = None
+    ) -> Iterator[DialogEventBatch]:
+        # a user's event batches in the order they were created
+        key_condition = "phone_number = :phone_number"
+        values = {":phone_number": {"S": phone_number}}
+        if created_after is not None:
+            key_condition += " AND created_time > :created_after"
+            values[":created_after"] = {"S": created_after.isoformat()}
+        for item in dynamodb_utils.query_items(
+            self.dynamodb,
+            TableName=self.event_batch_table_name(),
+            IndexName="by_created_time",
+            KeyConditionExpression=key_condition,
+            ExpressionAttributeValues=values,
+        ):
+            yield batch_from_dict(dynamodb_utils.deserialize(item))
+
+    def scan_phone_numbers_for_account(
+        self,
+        employer_id: int,
+        unit_id: Optional[int] = None,
+        exclusive_start_key: Optional[dict] = None,
+    ) -> Tuple[List[str], Optional[dict]]:
+        # One page of the phone numbers of users at an employer (and optionally a unit) who
+        # haven't opted out, and the key to continue the scan from, if there are more pages.
+        filter_expression = (
+            "user_profile.account_info.employer_id = :employer_id "
+            "AND user_profile.opted_out <> :opted_out"
+        )
+        values = {":employer_id": {"N": str(employer_id)}, ":opted_out": {"BOOL": True}}
+        if unit_id is not None:
+            filter_expression += " AND user_profile.account_info.unit_id = :unit_id"
+            values[":unit_id"] = {"N": str(unit_id)}
+        args: Dict[str, Any] = {}
+        if exclusive_start_key:
+            args["ExclusiveStartKey"] = exclusive_start_key
+        response = self.dynamodb.scan(
+            TableName=self.state_table_name(),
+            ProjectionExpression="phone_number",
+            FilterExpression=filter_expression,
+            ExpressionAttributeValues=values,
+            **args,
+        )
+        phone_numbers = [item["phone_number"]["S"] for item in response["Items"]]
+        return phone_numbers, response.get("LastEvaluatedKey")
+
+    def fetch_due_reminders(self, bucket: int, due_before: int) -> List[DueReminder]:
+        due_reminders = []
+        args: Dict[str, Any] = {}
+        while True:
+            response = self.dynamodb.query(
+                TableName=self.state_table_name(),
+                IndexName=REMINDER_INDEX,
+                KeyConditionExpression=(
+                    "reminder_due_bucket = :bucket AND reminder_due_ts <= :due_before"
+                ),
+                ExpressionAttributeValues={
+                    ":bucket": {"N": str(bucket)},
+                    ":due_before": {"N": str(due_before)},
+                },
+                **args,
+            )
+            for item in response["Items"]:
+                due_reminders.append(
+                    DueReminder(
+                        phone_number=item["phone_number"]["S"],
+                        drill_instance_id=uuid.UUID(item["drill_instance_id"]["S"]),
+                        prompt_slug=item["current_prompt_state"]["M"]["slug"]["S"],
+                    )
+                )
+            if not response.get("LastEvaluatedKey"):
+                return due_reminders
+            args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
     def persist_dialog_state(
         self, event_batch: DialogEventBatch, dialog_state: DialogState
     ) -> None:
@@ -76,11 +240,68 @@ class DynamoDBDialogRepository(DialogRepository):
                 {
                     "Put": {
                         "TableName": self.state_table_name(),
-                        "Item": dynamodb_utils.serialize(json.loads(dialog_state.json())),
+                        "Item": dynamodb_utils.serialize(
+                            {
+                                **json.loads(dialog_state.json()),
+                                **reminder_index_attributes(dialog_state),
+                            }
+                        ),
                     }
                 },
             ]
-            self.dynamodb.transact_write_items(TransactItems=write_items)
+            with timer("dynamodb_transact_write"):
+                self.dynamodb.transact_write_items(TransactItems=write_items)
+
+    def replace_dialog_state(self, dialog_state: DialogState, expected_seq: str) -> bool:
+        if expected_seq == "0":
+            condition = "attribute_not_exists(phone_number)"
+            condition_args: Dict[str, Any] = {}
+        else:
+            condition = "#seq = :seq"
+            condition_args = {
+                "ExpressionAttributeNames": {"#seq": "seq"},
+                "ExpressionAttributeValues": {":seq": {"S": expected_seq}},
+            }
+        try:
+            self.dynamodb.put_item(
+                TableName=self.state_table_name(),
+                Item=dynamodb_utils.serialize(
+                    {**json.loads(dialog_state.json()), **reminder_index_attributes(dialog_state)}
+                ),
+                ConditionExpression=condition,
+                **condition_args,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def fetch_dialog_state_snapshot(self, phone_number: str) -> Optional[DialogStateSnapshot]:
+        response = self.dynamodb.get_item(
+            TableName=self.snapshot_table_name(),
+            Key={"phone_number": {"S": phone_number}},
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return None
+        return DialogStateSnapshot(**dynamodb_utils.deserialize(response["Item"]))
+
+    def save_dialog_state_snapshot(self, snapshot: DialogStateSnapshot) -> None:
+        try:
+            self.dynamodb.put_item(
+                TableName=self.snapshot_table_name(),
+                Item=dynamodb_utils.serialize(json.loads(snapshot.json())),
+                ConditionExpression=(
+                    "attribute_not_exists(phone_number) OR created_time < :created_time"
+                ),
+                ExpressionAttributeValues={
+                    ":created_time": {"S": snapshot.created_time.isoformat()}
+                },
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
 
     def ensure_tables_exist(self) -> None:
         # useful for testing but will likely be duplicated elsewhere
@@ -112,11 +333,236 @@ class DynamoDBDialogRepository(DialogRepository):
             )
 
             self.dynamodb.create_table(
-                TableName=self.state_table_name(),
+                TableName=self.snapshot_table_name(),
                 KeySchema=[{"AttributeName": "phone_number", "KeyType": "HASH"}],
                 AttributeDefinitions=[{"AttributeName": "phone_number", "AttributeType": "S"}],
                 BillingMode="PAY_PER_REQUEST",
             )
+
+            self.dynamodb.create_table(
+                TableName=self.state_table_name(),
+                KeySchema=[{"AttributeName": "phone_number", "KeyType": "HASH"}],
+                AttributeDefinitions=[
+                    {"AttributeName": "phone_number", "AttributeType": "S"},
+                    {"AttributeName": "reminder_due_bucket", "AttributeType": "N"},
+                    {"AttributeName": "reminder_due_ts", "AttributeType": "N"},
+                ],
+                GlobalSecondaryIndexes=[
+                    {
+                        "IndexName": REMINDER_INDEX,
+                        "KeySchema": [
+                            {"AttributeName": "reminder_due_bucket", "KeyType": "HASH"},
+                            {"AttributeName": "reminder_due_ts", "KeyType": "RANGE"},
+                        ],
+                        "Projection": {
+                            "ProjectionType": "INCLUDE",
+                            "NonKeyAttributes": ["drill_instance_id", "current_prompt_state"],
+                        },
+                    }
+                ],
+                BillingMode="PAY_PER_REQUEST",
+            )
         except Exception:
             # table already exists, most likely
             pass
+
+
+# Repositories that need no external services, for load tests and benchmarks. Both store what
+# the DynamoDB repository stores, serialized the same way, and write a batch and the state it
+# produced together or not at all.
+
+
+class InMemoryDialogRepository(DialogRepository):
+    def __init__(self) -> None:
+        self.states: Dict[str, str] = {}
+        # phone number -> batch id -> (created time, serialized batch)
+        self.event_batches: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        self.snapshots: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def fetch_dialog_state(self, phone_number: str) -> DialogState:
+        state_json = self.states.get(phone_number)
+        if state_json is None:
+            return DialogState(phone_number=phone_number, seq="0")
+        return DialogState(**json.loads(state_json))
+
+    def fetch_user_profiles(self, phone_numbers: List[str]) -> Dict[str, UserProfile]:
+        return {
+            phone_number: self.fetch_dialog_state(phone_number).user_profile
+            for phone_number in phone_numbers
+            if phone_number in self.states
+        }
+
+    def fetch_dialog_event_batch(self, phone_number: str, batch_id: uuid.UUID) -> DialogEventBatch:
+        _, batch_json = self.event_batches[phone_number][str(batch_id)]
+        return batch_from_dict(json.loads(batch_json))
+
+    def fetch_dialog_event_batches(
+        self, phone_number: str, created_after: Optional[datetime.datetime] = None
+    ) -> Iterator[DialogEventBatch]:
+        with self.lock:
+            batches = sorted(self.event_batches.get(phone_number, {}).values())
+        for created_time, batch_json in batches:
+            if created_after is None or created_time > created_after.isoformat():
+                yield batch_from_dict(json.loads(batch_json))
+
+    def persist_dialog_state(
+        self, event_batch: DialogEventBatch, dialog_state: DialogState
+    ) -> None:
+        if event_batch.events:
+            # serialized before anything is stored, so a failure stores nothing
+            batch_json = event_batch.json()
+            state_json = dialog_state.json()
+            with self.lock:
+                self.event_batches.setdefault(event_batch.phone_number, {})[
+                    str(event_batch.batch_id)
+                ] = (event_batch.created_time.isoformat(), batch_json)
+                self.states[dialog_state.phone_number] = state_json
+
+    def replace_dialog_state(self, dialog_state: DialogState, expected_seq: str) -> bool:
+        state_json = dialog_state.json()
+        with self.lock:
+            stored_json = self.states.get(dialog_state.phone_number)
+            stored_seq = json.loads(stored_json)["seq"] if stored_json else "0"
+            if stored_seq != expected_seq:
+                return False
+            self.states[dialog_state.phone_number] = state_json
+            return True
+
+    def fetch_dialog_state_snapshot(self, phone_number: str) -> Optional[DialogStateSnapshot]:
+        snapshot_json = self.snapshots.get(phone_number)
+        if snapshot_json is None:
+            return None
+        return DialogStateSnapshot(**json.loads(snapshot_json))
+
+    def save_dialog_state_snapshot(self, snapshot: DialogStateSnapshot) -> None:
+        snapshot_json = snapshot.json()
+        with self.lock:
+            stored = self.fetch_dialog_state_snapshot(snapshot.phone_number)
+            if stored is None or stored.created_time < snapshot.created_time:
+                self.snapshots[snapshot.phone_number] = snapshot_json
+
+
+class SQLiteDialogRepository(DialogRepository):
+    def __init__(self, database: str = ":memory:") -> None:
+        # one connection, shared by every thread that uses the repository
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dialog_state "
+                "(phone_number TEXT PRIMARY KEY, state TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dialog_event_batches "
+                "(phone_number TEXT NOT NULL, batch_id TEXT NOT NULL, created_time TEXT NOT NULL, "
+                "batch TEXT NOT NULL, PRIMARY KEY (phone_number, batch_id))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS by_created_time "
+                "ON dialog_event_batches (phone_number, created_time)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dialog_state_snapshots "
+                "(phone_number TEXT PRIMARY KEY, created_time TEXT NOT NULL, snapshot TEXT NOT NULL)"
+            )
+
+    def _fetch_all(self, sql: str, parameters: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def fetch_dialog_state(self, phone_number: str) -> DialogState:
+        rows = self._fetch_all(
+            "SELECT state FROM dialog_state WHERE phone_number = ?", (phone_number,)
+        )
+        if not rows:
+            return DialogState(phone_number=phone_number, seq="0")
+        return DialogState(**json.loads(rows[0][0]))
+
+    def fetch_user_profiles(self, phone_numbers: List[str]) -> Dict[str, UserProfile]:
+        profiles = {}
+        for phone_number in dict.fromkeys(phone_numbers):
+            rows = self._fetch_all(
+                "SELECT state FROM dialog_state WHERE phone_number = ?", (phone_number,)
+            )
+            if rows:
+                profiles[phone_number] = UserProfile(**json.loads(rows[0][0])["user_profile"])
+        return profiles
+
+    def fetch_dialog_event_batch(self, phone_number: str, batch_id: uuid.UUID) -> DialogEventBatch:
+        rows = self._fetch_all(
+            "SELECT batch FROM dialog_event_batches WHERE phone_number = ? AND batch_id = ?",
+            (phone_number, str(batch_id)),
+        )
+        if not rows:
+            raise KeyError(batch_id)
+        return batch_from_dict(json.loads(rows[0][0]))
+
+    def fetch_dialog_event_batches(
+        self, phone_number: str, created_after: Optional[datetime.datetime] = None
+    ) -> Iterator[DialogEventBatch]:
+        rows = self._fetch_all(
+            "SELECT batch FROM dialog_event_batches WHERE phone_number = ? AND created_time > ? "
+            "ORDER BY created_time",
+            (phone_number, created_after.isoformat() if created_after else ""),
+        )
+        for (batch_json,) in rows:
+            yield batch_from_dict(json.loads(batch_json))
+
+    def persist_dialog_state(
+        self, event_batch: DialogEventBatch, dialog_state: DialogState
+    ) -> None:
+        if event_batch.events:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO dialog_event_batches VALUES (?, ?, ?, ?)",
+                    (
+                        event_batch.phone_number,
+                        str(event_batch.batch_id),
+                        event_batch.created_time.isoformat(),
+                        event_batch.json(),
+                    ),
+                )
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO dialog_state VALUES (?, ?)",
+                    (dialog_state.phone_number, dialog_state.json()),
+                )
+
+    def replace_dialog_state(self, dialog_state: DialogState, expected_seq: str) -> bool:
+        state_json = dialog_state.json()
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT state FROM dialog_state WHERE phone_number = ?",
+                (dialog_state.phone_number,),
+            ).fetchall()
+            stored_seq = json.loads(rows[0][0])["seq"] if rows else "0"
+            if stored_seq != expected_seq:
+                return False
+            self.connection.execute(
+                "INSERT OR REPLACE INTO dialog_state VALUES (?, ?)",
+                (dialog_state.phone_number, state_json),
+            )
+            return True
+
+    def fetch_dialog_state_snapshot(self, phone_number: str) -> Optional[DialogStateSnapshot]:
+        rows = self._fetch_all(
+            "SELECT snapshot FROM dialog_state_snapshots WHERE phone_number = ?", (phone_number,)
+        )
+        if not rows:
+            return None
+        return DialogStateSnapshot(**json.loads(rows[0][0]))
+
+    def save_dialog_state_snapshot(self, snapshot: DialogStateSnapshot) -> None:
+        created_time = snapshot.created_time.isoformat()
+        snapshot_json = snapshot.json()
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT created_time FROM dialog_state_snapshots WHERE phone_number = ?",
+                (snapshot.phone_number,),
+            ).fetchall()
+            if rows and rows[0][0] >= created_time:
+                return
+            self.connection.execute(
+                "INSERT OR REPLACE INTO dialog_state_snapshots VALUES (?, ?, ?)",
+                (snapshot.phone_number, created_time, snapshot_json),
+            )
@@ -0,0 +1,172 @@
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .models.events import DialogEventBatch
+from .models.state import DialogState, DialogStateSnapshot
+from .persistence import DialogRepository
+
+# Dialog events are the source of truth: a user's dialog state is what you get by applying
+# their event batches, in the order they were created, to an empty state. Rebuilding a state
+# that way and comparing it to the stored one finds states that have been corrupted.
+#
+# Every so often, the folded state is saved as a snapshot, along with the time the last batch
+# folded into it was created. Later rebuilds start from the snapshot and only apply the batches
+# created after it, so they read as many batches as the user has had recently, not ever.
+
+MATCHED = "matched"
+DIFFERENT = "different"
+CORRECTED = "corrected"
+# the engine processed a command for the user while their state was being rebuilt
+CHANGED = "changed"
+# there are no event batches to rebuild the state from
+NO_HISTORY = "no_history"
+FAILED = "failed"
+
+# phone numbers waiting for a worker, per worker
+PENDING_PER_WORKER = 4
+# a new snapshot is saved once this many batches have been applied on top of the last one
+SNAPSHOT_EVERY_BATCHES = 50
+
+
+class RebuildResult(NamedTuple):
+    phone_number: str
+    status: str
+    # applied on top of the user's snapshot, if they had one
+    batches: int = 0
+    # the paths of the attributes that differ between the stored and rebuilt states
+    differences: Tuple[str, ...] = ()
+    snapshot_saved: bool = False
+
+
+class FoldedState(NamedTuple):
+    dialog_state: DialogState
+    # the snapshot folding started from, if any
+    snapshot: Optional[DialogStateSnapshot]
+    # applied on top of the snapshot
+    batches: int
+    last_batch: Optional[DialogEventBatch]
+
+    def to_snapshot(self) -> DialogStateSnapshot:
+        assert self.last_batch
+        return DialogStateSnapshot(
+            phone_number=self.dialog_state.phone_number,
+            dialog_state=self.dialog_state,
+            seq=self.last_batch.seq,
+            created_time=self.last_batch.created_time,
+            batch_count=(self.snapshot.batch_count if self.snapshot else 0) + self.batches,
+        )
+
+
+def apply_batch(dialog_state: DialogState, batch: DialogEventBatch) -> None:
+    # as the engine did when it processed the command that produced the batch
+    for event in batch.events:
+        event.apply_to(dialog_state)
+    dialog_state.seq = batch.seq
+
+
+def fold_state(repo: DialogRepository, phone_number: str, use_snapshot: bool = True) -> FoldedState:
+    snapshot = repo.fetch_dialog_state_snapshot(phone_number) if use_snapshot else None
+    if snapshot:
+        dialog_state = snapshot.dialog_state.copy(deep=True)
+    else:
+        dialog_state = DialogState(phone_number=phone_number, seq="0")
+    batches = 0
+    last_batch = None
+    for batch in repo.fetch_dialog_event_batches(
+        phone_number, created_after=snapshot.created_time if snapshot else None
+    ):
+        apply_batch(dialog_state, batch)
+        batches += 1
+        last_batch = batch
+    return FoldedState(dialog_state, snapshot, batches, last_batch)
+
+
+def snapshot_state(repo: DialogRepository, phone_number: str) -> Optional[DialogStateSnapshot]:
+    # Saves a snapshot of the user's state now, rather than waiting for enough batches. Returns
+    # the user's latest snapshot, if they have any batches.
+    folded = fold_state(repo, phone_number)
+    if not folded.last_batch:
+        return folded.snapshot
+    snapshot = folded.to_snapshot()
+    repo.save_dialog_state_snapshot(snapshot)
+    return snapshot
+
+
+def _differences(stored: Any, rebuilt: Any, path: str = "") -> List[str]:
+    if isinstance(stored, dict) and isinstance(rebuilt, dict):
+        differences = []
+        for key in sorted(set(stored) | set(rebuilt)):
+            differences.extend(
+                _differences(stored.get(key), rebuilt.get(key), f"{path}.{key}" if path else key)
+            )
+        return differences
+    return [] if stored == rebuilt else [path]
+
+
+def diff_states(stored: DialogState, rebuilt: DialogState) -> Tuple[str, ...]:
+    # compared as they're serialized, so e.g. a drill that was stored is equal to itself
+    return tuple(_differences(json.loads(stored.json()), json.loads(rebuilt.json())))
+
+
+def rebuild_state(
+    repo: DialogRepository,
+    phone_number: str,
+    correct: bool = False,
+    snapshot_every: int = SNAPSHOT_EVERY_BATCHES,
+    use_snapshot: bool = True,
+) -> RebuildResult:
+    # snapshot_every=0 saves no snapshots. use_snapshot=False folds every batch the user has
+    # ever had, e.g. to check the snapshots themselves
+    stored = repo.fetch_dialog_state(phone_number)
+    folded = fold_state(repo, phone_number, use_snapshot)
+    if not folded.snapshot and not folded.last_batch:
+        return RebuildResult(phone_number, NO_HISTORY)
+    snapshot_saved = bool(snapshot_every and folded.batches >= snapshot_every)
+    if snapshot_saved:
+        repo.save_dialog_state_snapshot(folded.to_snapshot())
+    rebuilt = folded.dialog_state
+    differences = diff_states(stored, rebuilt)
+    if not differences:
+        status = MATCHED
+    elif not correct:
+        status = DIFFERENT
+    elif repo.replace_dialog_state(rebuilt, stored.seq):
+        status = CORRECTED
+    else:
+        status = CHANGED
+    return RebuildResult(phone_number, status, folded.batches, differences, snapshot_saved)
+
+
+def rebuild_states(
+    repo: DialogRepository,
+    phone_numbers: Iterable[str],
+    workers: int = 8,
+    correct: bool = False,
+    skip: Optional[Set[str]] = None,
+    snapshot_every: int = SNAPSHOT_EVERY_BATCHES,
+    use_snapshot: bool = True,
+) -> Iterator[RebuildResult]:
+    # Rebuilds each user's state on a pool of workers, yielding results as they finish. Phone
+    # numbers are read from the iterable only as workers become free, so it can be a scan of
+    # the whole state table. Phone numbers in skip, e.g. those rebuilt by an earlier run, are
+    # left alone.
+    def rebuild(phone_number: str) -> RebuildResult:
+        try:
+            return rebuild_state(repo, phone_number, correct, snapshot_every, use_snapshot)
+        except Exception:
+            logging.warning(f"Unable to rebuild the state of {phone_number}", exc_info=True)
+            return RebuildResult(phone_number, FAILED)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: Set["Future[RebuildResult]"] = set()
+        for phone_number in phone_numbers:
+            if skip and phone_number in skip:
+                continue
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+            pending.add(executor.submit(rebuild, phone_number))
+        for future in pending:
+            yield future.result()
@@ -1,10 +1,31 @@
-import functools
+import base64
+import hashlib
+import logging
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Optional, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Any, Dict, Iterable, List, Tuple
 
 import pydantic
-import requests
+
+from stopcovid.utils.instrumentation import increment, timer
+from stopcovid.utils.ttl_cache import TTLCache
+
+CACHE_SIZE = 1024
+# a valid code stays valid for a while, but a code that isn't valid yet may be created any time
+VALID_CODE_TTL_SECONDS = 15 * 60
+INVALID_CODE_TTL_SECONDS = 60
+CONNECT_TIMEOUT_SECONDS = 3.05
+READ_TIMEOUT_SECONDS = 5
+POOL_SIZE = 10
+# codes per request to the batch endpoint
+MAX_BATCH_CODES = 100
+# a code the filter rejects is rejected for no longer than a cached invalid result would be
+CODE_FILTER_REFRESH_SECONDS = INVALID_CODE_TTL_SECONDS
+# after a failed refresh, every code is sent to the validator until the next try
+CODE_FILTER_RETRY_SECONDS = 60
 
 
 class AccountInfo(pydantic.BaseModel):
@@ -20,23 +41,252 @@ class CodeValidationPayload(pydantic.BaseModel):
     account_info: Optional[AccountInfo] = None
 
 
+class CodeShapeFilter:
+    # Rejects messages that can't be registration codes without asking the validator. The
+    # validation service publishes the shape of its live codes (and demo codes), e.g.
+    #
+    #   {"min_length": 6, "max_length": 8, "alphabet": "abcdef0123456789",
+    #    "bloom": {"bits": "<base64>", "hashes": 7}}
+    #
+    # Every field is optional. The Bloom filter holds every live code, lowercased, like the
+    # messages the engine validates. Bit i of the filter is bit i % 8 of byte i // 8, and a
+    # code's bits are (h1 + j * h2) % len(bits) for j < hashes, where h1 and h2 are the first
+    # and second 8 bytes (big endian) of the code's SHA-256. A Bloom filter has no false
+    # negatives, so a code it rejects is certainly invalid.
+
+    def __init__(
+        self,
+        min_length: int = 0,
+        max_length: Optional[int] = None,
+        alphabet: Optional[str] = None,
+        bloom_bits: Optional[bytes] = None,
+        bloom_hashes: int = 0,
+    ) -> None:
+        self.min_length = min_length
+        self.max_length = max_length
+        self.alphabet = frozenset(alphabet.lower()) if alphabet else None
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any]) -> "CodeShapeFilter":
+        bloom = spec.get("bloom") or {}
+        return cls(
+            min_length=spec.get("min_length") or 0,
+            max_length=spec.get("max_length"),
+            alphabet=spec.get("alphabet"),
+            bloom_bits=base64.b64decode(bloom["bits"]) if bloom.get("bits") else None,
+            bloom_hashes=bloom.get("hashes", 0),
+        )
+
+    def might_be_valid(self, code: str) -> bool:
+        if len(code) < self.min_length:
+            return False
+        if self.max_length is not None and len(code) > self.max_length:
+            return False
+        if self.alphabet is not None and not self.alphabet.issuperset(code):
+            return False
+        if self.bloom_bits and self.bloom_hashes:
+            digest = hashlib.sha256(code.encode("utf-8")).digest()
+            h1 = int.from_bytes(digest[:8], "big")
+            h2 = int.from_bytes(digest[8:16], "big")
+            size = len(self.bloom_bits) * 8
+            for j in range(self.bloom_hashes):
+                bit = (h1 + j * h2) % size
+                if not self.bloom_bits[bit // 8] & (1 << (bit % 8)):
+                    return False
+        return True
+
+
+# accepts everything, for when the validation service doesn't publish a filter
+ALLOW_ALL = CodeShapeFilter()
+INVALID_CODE = CodeValidationPayload(valid=False)
+
+
 class RegistrationValidator(ABC):
     @abstractmethod
     def validate_code(self, code: str) -> CodeValidationPayload:
         pass
 
+    def validate_codes(self, codes: Iterable[str]) -> Dict[str, CodeValidationPayload]:
+        return {code: self.validate_code(code) for code in set(codes)}
+
 
 class DefaultRegistrationValidator(RegistrationValidator):
-    @functools.lru_cache(maxsize=1024)
+    # Results are cached per container, valid and invalid codes for different lengths of time.
+    # Concurrent lookups of the same code wait for the request that's already in flight.
+
+    def __init__(self) -> None:
+        self._cache: TTLCache[CodeValidationPayload] = TTLCache(CACHE_SIZE)
+        self._in_flight: Dict[Tuple[str, str], "Future[CodeValidationPayload]"] = {}
+        self._lock = threading.Lock()
+        # refreshing the filter doesn't hold up lookups waiting on _lock
+        self._code_filter_lock = threading.Lock()
+        self._session: Any = None
+        self._code_filter = ALLOW_ALL
+        self._code_filter_expires_at = 0.0
+
+    def _get_session(self) -> Any:
+        # most commands come from validated users, so requests stays off the cold start path
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+            session.mount("http://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+            self._session = session
+        return self._session
+
+    def get_code_filter(self, **kwargs: Any) -> CodeShapeFilter:
+        # refreshed as often as invalid codes expire from the cache, so a code created since the
+        # last refresh is rejected for no longer than it would be without the filter
+        filter_url = kwargs.get("filter_url", os.getenv("REGISTRATION_CODE_FILTER_URL"))
+        if not filter_url:
+            return ALLOW_ALL
+        now = time.monotonic()
+        if now < self._code_filter_expires_at:
+            return self._code_filter
+        with self._code_filter_lock:
+            if now < self._code_filter_expires_at:
+                return self._code_filter
+            key = kwargs.get("key", os.getenv("REGISTRATION_VALIDATION_KEY"))
+            try:
+                with timer("registration_code_filter_http"):
+                    response = self._get_session().get(
+                        url=filter_url,
+                        headers={"authorization": f"Bearer {key}"},
+                        timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+                    )
+                response.raise_for_status()
+                self._code_filter = CodeShapeFilter.from_dict(response.json())
+                self._code_filter_expires_at = now + CODE_FILTER_REFRESH_SECONDS
+            except Exception:
+                logging.warning("Unable to refresh the registration code filter", exc_info=True)
+                self._code_filter = ALLOW_ALL
+                self._code_filter_expires_at = now + CODE_FILTER_RETRY_SECONDS
+            return self._code_filter
+
     def validate_code(self, code: str, **kwargs: Any) -> CodeValidationPayload:
         url = kwargs.get("url", os.environ["REGISTRATION_VALIDATION_URL"])
         key = kwargs.get("key", os.getenv("REGISTRATION_VALIDATION_KEY"))
-        response = requests.post(
-            url=url,
-            json={"code": code, "stage": os.getenv("STAGE")},
-            headers={
-                "authorization": f"Bearer {key}",
-                "content-type": "application/json",
-            },
-        )
+        if not self.get_code_filter(**kwargs).might_be_valid(code):
+            increment("registration_codes_rejected_locally")
+            return INVALID_CODE
+        cache_key = (url, code)
+        payload = self._cache.get(cache_key)
+        if payload is not None:
+            increment("registration_validation_cache_hits")
+            return payload
+
+        with self._lock:
+            future = self._in_flight.get(cache_key)
+            is_owner = future is None
+            if future is None:
+                future = Future()
+                self._in_flight[cache_key] = future
+        if not is_owner:
+            increment("registration_validation_coalesced")
+            return future.result()
+
+        try:
+            payload = self._request(url, key, code)
+            self._cache.set(
+                cache_key,
+                payload,
+                VALID_CODE_TTL_SECONDS if payload.valid else INVALID_CODE_TTL_SECONDS,
+            )
+            future.set_result(payload)
+            return payload
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[cache_key]
+
+    def validate_codes(
+        self, codes: Iterable[str], **kwargs: Any
+    ) -> Dict[str, CodeValidationPayload]:
+        # Resolves many codes at once, e.g. every candidate code in a batch of commands. Codes
+        # that aren't cached are sent to the batch endpoint if there is one, and validated one
+        # by one, concurrently, if there isn't or it fails.
+        url = kwargs.get("url", os.environ["REGISTRATION_VALIDATION_URL"])
+        key = kwargs.get("key", os.getenv("REGISTRATION_VALIDATION_KEY"))
+        batch_url = kwargs.get("batch_url", os.getenv("REGISTRATION_BATCH_VALIDATION_URL"))
+        code_filter = self.get_code_filter(**kwargs)
+        results: Dict[str, CodeValidationPayload] = {}
+        misses = []
+        for code in dict.fromkeys(codes):
+            if not code_filter.might_be_valid(code):
+                increment("registration_codes_rejected_locally")
+                results[code] = INVALID_CODE
+                continue
+            payload = self._cache.get((url, code))
+            if payload is None:
+                misses.append(code)
+            else:
+                results[code] = payload
+        if not misses:
+            return results
+
+        if batch_url:
+            for start in range(0, len(misses), MAX_BATCH_CODES):
+                chunk = misses[start : start + MAX_BATCH_CODES]
+                try:
+                    batch_results = self._batch_request(batch_url, key, chunk)
+                except Exception:
+                    logging.warning("Batch code validation failed", exc_info=True)
+                    continue
+                for code, payload in batch_results.items():
+                    self._cache.set(
+                        (url, code),
+                        payload,
+                        VALID_CODE_TTL_SECONDS if payload.valid else INVALID_CODE_TTL_SECONDS,
+                    )
+                    results[code] = payload
+
+        remaining = [code for code in misses if code not in results]
+        if remaining:
+            with ThreadPoolExecutor(max_workers=min(POOL_SIZE, len(remaining))) as executor:
+                payloads = executor.map(lambda code: self.validate_code(code, **kwargs), remaining)
+                results.update(zip(remaining, payloads))
+        return results
+
+    def _batch_request(
+        self, batch_url: str, key: Optional[str], codes: List[str]
+    ) -> Dict[str, CodeValidationPayload]:
+        increment("registration_batch_validation_requests")
+        with timer("registration_batch_validation_http"):
+            response = self._get_session().post(
+                url=batch_url,
+                json={"codes": codes, "stage": os.getenv("STAGE")},
+                headers={
+                    "authorization": f"Bearer {key}",
+                    "content-type": "application/json",
+                },
+                timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+            )
+        response.raise_for_status()
+        # {"results": {code: {"valid": ..., "is_demo": ..., "account_info": ...}, ...}}
+        return {
+            code: CodeValidationPayload(**payload)
+            for code, payload in response.json()["results"].items()
+            if code in codes
+        }
+
+    def _request(self, url: str, key: Optional[str], code: str) -> CodeValidationPayload:
+        increment("registration_validation_requests")
+        with timer("registration_validation_http"):
+            response = self._get_session().post(
+                url=url,
+                json={"code": code, "stage": os.getenv("STAGE")},
+                headers={
+                    "authorization": f"Bearer {key}",
+                    "content-type": "application/json",
+                },
+                timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+            )
+        # errors aren't cached, so the next message from the user tries again
+        response.raise_for_status()
         return CodeValidationPayload(**response.json())
@@ -0,0 +1,58 @@
+import time
+from typing import Optional
+
+from stopcovid.dialog.command_stream.publish import CommandPublisher
+from stopcovid.dialog.persistence import (
+    REMINDER_BUCKET_SECONDS,
+    DynamoDBDialogRepository,
+    reminder_bucket_for,
+)
+from stopcovid.utils.instrumentation import increment
+from stopcovid.utils.sweep_watermarks import SweepWatermarkRepository
+
+# Reminders are found through the dialog state table's by_reminder_due index, so a sweep reads
+# the minute buckets since the last sweep rather than every user. Each sweep records the bucket
+# it got up to, and the next one starts there, so reminders due while sweeps were failing or
+# not running are sent once they run again. A reminder stays in the index until it's
+# triggered, and a sweep that fails to publish some reminders doesn't move on.
+#
+# After an outage of more than MAX_SWEEP_BUCKETS, the reminders that fell due before then are
+# not sent.
+
+SWEEP_NAME = "reminders"
+# how far back the first sweep goes
+SWEEP_LOOKBACK_BUCKETS = 60
+MAX_SWEEP_BUCKETS = 24 * 60
+
+
+def sweep_due_reminders(
+    now: Optional[float] = None,
+    repo: Optional[DynamoDBDialogRepository] = None,
+    publisher: Optional[CommandPublisher] = None,
+    watermark_repo: Optional[SweepWatermarkRepository] = None,
+) -> int:
+    repo = repo or DynamoDBDialogRepository()
+    publisher = publisher or CommandPublisher()
+    watermark_repo = watermark_repo or SweepWatermarkRepository()
+    now = time.time() if now is None else now
+    current_bucket = reminder_bucket_for(now)
+    watermark = watermark_repo.fetch_watermark(SWEEP_NAME)
+    if watermark is None:
+        watermark = current_bucket - SWEEP_LOOKBACK_BUCKETS * REMINDER_BUCKET_SECONDS
+    first_bucket = max(watermark, current_bucket - MAX_SWEEP_BUCKETS * REMINDER_BUCKET_SECONDS)
+    due = []
+    for bucket in range(first_bucket, current_bucket + 1, REMINDER_BUCKET_SECONDS):
+        due.extend(repo.fetch_due_reminders(bucket, int(now)))
+    # TriggerReminder is a no-op for users who have since moved on or been reminded, so
+    # publishing a reminder again on the next sweep is harmless
+    failed = publisher.publish_trigger_reminder_commands(
+        [
+            (reminder.phone_number, reminder.drill_instance_id, reminder.prompt_slug)
+            for reminder in due
+        ]
+    )
+    # the current bucket's later reminders aren't due yet, so the next sweep reads it again
+    if not failed:
+        watermark_repo.save_watermark(SWEEP_NAME, current_bucket)
+    increment("reminders_triggered", len(due) - len(failed))
+    return len(due) - len(failed)
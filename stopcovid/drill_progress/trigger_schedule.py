@@ -0,0 +1,260 @@
+import datetime
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Any, List, Optional, Sequence
+
+import pydantic
+
+from stopcovid.dialog.command_stream.publish import CommandPublisher
+from stopcovid.drills.bundle import get_drill_loader
+from stopcovid.utils import dynamodb as dynamodb_utils
+from stopcovid.utils.boto3 import get_boto3_client
+from stopcovid.utils.instrumentation import increment
+from stopcovid.utils.sweep_watermarks import SweepWatermarkRepository
+
+# Starting a drill for a whole cohort at once would send every first prompt within a few
+# seconds. Instead, each recipient is given a trigger time within a window (3 hours by default)
+# and stored in the drill-trigger-schedule table under the minute bucket it falls in. A cron
+# drains the buckets that have come due, publishing their START_DRILL commands in bulk.
+#
+# Each run records the bucket it got up to, and the next one starts there, so drills that were
+# due while runs were failing or not running are triggered once they run again. A run that
+# fails to publish some drills doesn't move on.
+
+BUCKET_SECONDS = 60
+DEFAULT_WINDOW = datetime.timedelta(hours=3)
+# undrained schedules are dropped after this long
+SCHEDULE_EXPIRATION = datetime.timedelta(days=1)
+SWEEP_NAME = "drill-triggers"
+# how far back the first run goes
+DRAIN_LOOKBACK_BUCKETS = 15
+# older schedules have expired
+MAX_DRAIN_BUCKETS = int(SCHEDULE_EXPIRATION.total_seconds()) // BUCKET_SECONDS
+
+BUCKET_INDEX = "by_bucket"
+
+
+class ScheduledDrill(pydantic.BaseModel):
+    phone_number: str
+    # the cohort this drill was scheduled in, so relaunching a cohort doesn't schedule twice
+    idempotency_key: str
+    drill_slug: str
+    drill_instance_id: uuid.UUID
+    trigger_ts: int
+    bucket: int
+
+
+def bucket_for(trigger_ts: float) -> int:
+    return int(trigger_ts // BUCKET_SECONDS * BUCKET_SECONDS)
+
+
+def spread_trigger_times(
+    count: int, start: datetime.datetime, window: datetime.timedelta, rng: random.Random
+) -> List[int]:
+    # The window is split into one slot per recipient and each recipient triggers at a random
+    # point within their own slot. Unlike drawing every time uniformly from the whole window,
+    # this puts the same number of recipients in every bucket, give or take one.
+    start_ts = start.timestamp()
+    slot = window.total_seconds() / count if count else 0
+    return [int(start_ts + (i + rng.random()) * slot) for i in range(count)]
+
+
+def schedule_cohort(
+    drill_slug: str,
+    phone_numbers: Sequence[str],
+    cohort_id: str,
+    start: datetime.datetime,
+    window: datetime.timedelta = DEFAULT_WINDOW,
+    rng: Optional[random.Random] = None,
+) -> List[ScheduledDrill]:
+    rng = rng or random.Random()
+    # shuffled, so the order recipients were listed in doesn't decide who goes first
+    recipients = list(dict.fromkeys(phone_numbers))
+    rng.shuffle(recipients)
+    trigger_times = spread_trigger_times(len(recipients), start, window, rng)
+    return [
+        ScheduledDrill(
+            phone_number=phone_number,
+            idempotency_key=cohort_id,
+            drill_slug=drill_slug,
+            drill_instance_id=uuid.uuid4(),
+            trigger_ts=trigger_ts,
+            bucket=bucket_for(trigger_ts),
+        )
+        for phone_number, trigger_ts in zip(recipients, trigger_times)
+    ]
+
+
+class DrillTriggerScheduleRepository:
+    def __init__(self, **kwargs: Any) -> None:
+        self.dynamodb = get_boto3_client("dynamodb", **kwargs)
+        self.stage = os.environ.get("STAGE")
+
+    def _table_name(self) -> str:
+        return f"drill-trigger-schedule-{self.stage}"
+
+    def save_scheduled_drills(self, scheduled_drills: List[ScheduledDrill]) -> None:
+        dynamodb_utils.batch_write(
+            self.dynamodb,
+            self._table_name(),
+            [
+                {
+                    "PutRequest": {
+                        "Item": dynamodb_utils.serialize(
+                            {
+                                **scheduled_drill.dict(),
+                                "drill_instance_id": str(scheduled_drill.drill_instance_id),
+                                "expiration_ts": int(
+                                    scheduled_drill.trigger_ts + SCHEDULE_EXPIRATION.total_seconds()
+                                ),
+                            }
+                        )
+                    }
+                }
+                for scheduled_drill in scheduled_drills
+            ],
+        )
+
+    def delete_scheduled_drills(self, scheduled_drills: List[ScheduledDrill]) -> None:
+        dynamodb_utils.batch_write(
+            self.dynamodb,
+            self._table_name(),
+            [
+                {
+                    "DeleteRequest": {
+                        "Key": {
+                            "phone_number": {"S": scheduled_drill.phone_number},
+                            "idempotency_key": {"S": scheduled_drill.idempotency_key},
+                        }
+                    }
+                }
+                for scheduled_drill in scheduled_drills
+            ],
+        )
+
+    def fetch_bucket(self, bucket: int, due_by: int) -> List[ScheduledDrill]:
+        # the drills in the bucket that trigger at or before due_by
+        return [
+            ScheduledDrill(**dynamodb_utils.deserialize(item))
+            for item in dynamodb_utils.query_items(
+                self.dynamodb,
+                TableName=self._table_name(),
+                IndexName=BUCKET_INDEX,
+                # bucket is a reserved word
+                KeyConditionExpression="#bucket = :bucket AND trigger_ts <= :due_by",
+                ExpressionAttributeNames={"#bucket": "bucket"},
+                ExpressionAttributeValues={
+                    ":bucket": {"N": str(bucket)},
+                    ":due_by": {"N": str(due_by)},
+                },
+            )
+        ]
+
+    def drop_and_recreate_table(self) -> None:
+        if self.stage != "test":
+            raise RuntimeError("Method unsafe to run in non test environment")
+        try:
+            self.dynamodb.delete_table(TableName=self._table_name())
+        except Exception:
+            # Table already does not exist
+            pass
+
+        self.dynamodb.create_table(
+            TableName=self._table_name(),
+            KeySchema=[
+                {"AttributeName": "phone_number", "KeyType": "HASH"},
+                {"AttributeName": "idempotency_key", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "phone_number", "AttributeType": "S"},
+                {"AttributeName": "idempotency_key", "AttributeType": "S"},
+                {"AttributeName": "bucket", "AttributeType": "N"},
+                {"AttributeName": "trigger_ts", "AttributeType": "N"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": BUCKET_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "bucket", "KeyType": "HASH"},
+                        {"AttributeName": "trigger_ts", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def launch_cohort(
+    drill_slug: str,
+    phone_numbers: Sequence[str],
+    cohort_id: Optional[str] = None,
+    start: Optional[datetime.datetime] = None,
+    window: datetime.timedelta = DEFAULT_WINDOW,
+    repo: Optional[DrillTriggerScheduleRepository] = None,
+) -> List[ScheduledDrill]:
+    # fail before scheduling anything if the drill doesn't exist
+    get_drill_loader().get_drill(drill_slug)
+    scheduled_drills = schedule_cohort(
+        drill_slug,
+        phone_numbers,
+        cohort_id or str(uuid.uuid4()),
+        start or datetime.datetime.now(tz=datetime.timezone.utc),
+        window,
+    )
+    (repo or DrillTriggerScheduleRepository()).save_scheduled_drills(scheduled_drills)
+    logging.info(f"Scheduled {drill_slug} for {len(scheduled_drills)} users over {window}")
+    return scheduled_drills
+
+
+def drain_due_buckets(
+    now: Optional[float] = None,
+    repo: Optional[DrillTriggerScheduleRepository] = None,
+    publisher: Optional[CommandPublisher] = None,
+    watermark_repo: Optional[SweepWatermarkRepository] = None,
+) -> int:
+    # Publishes START_DRILL commands for every scheduled drill in a bucket that has come due,
+    # then deletes them. Commands that couldn't be published stay scheduled for the next run.
+    repo = repo or DrillTriggerScheduleRepository()
+    publisher = publisher or CommandPublisher()
+    watermark_repo = watermark_repo or SweepWatermarkRepository()
+    now = time.time() if now is None else now
+    current_bucket = bucket_for(now)
+    watermark = watermark_repo.fetch_watermark(SWEEP_NAME)
+    if watermark is None:
+        watermark = current_bucket - DRAIN_LOOKBACK_BUCKETS * BUCKET_SECONDS
+    first_bucket = max(watermark, current_bucket - MAX_DRAIN_BUCKETS * BUCKET_SECONDS)
+    published = 0
+    any_failed = False
+    for bucket in range(first_bucket, current_bucket + 1, BUCKET_SECONDS):
+        # the current bucket's later drills are left for the next run
+        due = repo.fetch_bucket(bucket, int(now))
+        if not due:
+            continue
+        failed = publisher.publish_start_drill_commands(
+            [
+                (
+                    scheduled_drill.phone_number,
+                    scheduled_drill.drill_slug,
+                    scheduled_drill.drill_instance_id,
+                )
+                for scheduled_drill in due
+            ]
+        )
+        failed_phone_numbers = {phone_number for phone_number, _ in failed}
+        triggered = [
+            scheduled_drill
+            for scheduled_drill in due
+            if scheduled_drill.phone_number not in failed_phone_numbers
+        ]
+        repo.delete_scheduled_drills(triggered)
+        published += len(triggered)
+        any_failed = any_failed or bool(failed)
+    # the current bucket is read again by the next run, for its later drills
+    if not any_failed:
+        watermark_repo.save_watermark(SWEEP_NAME, current_bucket)
+    increment("scheduled_drills_triggered", published)
+    return published
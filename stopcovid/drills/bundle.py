@@ -0,0 +1,185 @@
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union, cast
+
+from .drills import Drill
+
+# Drill content is compiled ahead of time into a library of pre-validated, individually pickled
+# drills, so loading drill content doesn't mean parsing and validating every drill in the library.
+#
+#   python -m stopcovid.drills.bundle          # rebuild the bundle after editing drills.json
+#   python -m stopcovid.drills.bundle --check  # exit non-zero if the bundle is out of date
+#
+# Layout: a fixed size header (magic, version, index length), a pickled index and the pickled
+# drills. The index maps each slug to the byte range of its drill and each language to its slugs.
+# The file is memory mapped, so resolving a drill only touches the pages holding that drill.
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+# bump this whenever the bundle format changes
+DRILL_BUNDLE_VERSION = 2
+DRILL_BUNDLE_MAGIC = b"DRLB"
+HEADER = struct.Struct("<4sIQ")
+# the highest protocol every runtime we deploy to can read
+PICKLE_PROTOCOL = 4
+# how many unpickled drills a loader keeps around
+DRILL_CACHE_SIZE = 64
+
+DRILL_SOURCE_PATH = os.path.join(__location__, "drill_content/drills.json")
+DRILL_BUNDLE_PATH = os.path.join(__location__, "drill_content/drills.bundle")
+
+LANGUAGE_SUFFIX = re.compile(r"-([a-z]{2,3})$")
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+def content_hash(source: bytes) -> str:
+    # covers the drill models' schema too, so the pickles go stale when the models change
+    digest = hashlib.sha256(f"{DRILL_BUNDLE_VERSION}:".encode("utf-8"))
+    digest.update(Drill.schema_json(sort_keys=True).encode("utf-8"))
+    digest.update(source)
+    return digest.hexdigest()
+
+
+def drill_language(drill: Drill) -> Optional[str]:
+    # drills are translated into one drill per language, e.g. 01-intake-en and 01-intake-es
+    match = LANGUAGE_SUFFIX.search(drill.slug)
+    return match.group(1) if match else None
+
+
+def compile_bundle(source: bytes) -> bytes:
+    raw_drills = json.loads(source)
+    ranges: Dict[str, Tuple[int, int]] = {}
+    languages: Dict[str, List[str]] = {}
+    data = bytearray()
+    for slug in sorted(raw_drills):
+        drill = Drill(**raw_drills[slug])
+        pickled = pickle.dumps(drill, protocol=PICKLE_PROTOCOL)
+        ranges[slug] = (len(data), len(pickled))
+        data += pickled
+        language = drill_language(drill)
+        if language:
+            languages.setdefault(language, []).append(slug)
+    index = pickle.dumps(
+        {"content_hash": content_hash(source), "drills": ranges, "languages": languages},
+        protocol=PICKLE_PROTOCOL,
+    )
+    return HEADER.pack(DRILL_BUNDLE_MAGIC, DRILL_BUNDLE_VERSION, len(index)) + index + data
+
+
+def build_bundle(source_path: str = DRILL_SOURCE_PATH, bundle_path: str = DRILL_BUNDLE_PATH) -> str:
+    with open(source_path, "rb") as f:
+        source = f.read()
+    tmp_path = f"{bundle_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(compile_bundle(source))
+    os.replace(tmp_path, bundle_path)
+    return content_hash(source)
+
+
+class BundledDrillLoader:
+    def __init__(self, buffer: Buffer) -> None:
+        magic, version, index_length = HEADER.unpack_from(buffer, 0)
+        if magic != DRILL_BUNDLE_MAGIC or version != DRILL_BUNDLE_VERSION:
+            raise ValueError(f"Unsupported drill bundle (version {version})")
+        index = pickle.loads(buffer[HEADER.size : HEADER.size + index_length])
+        self._buffer = buffer
+        self._data_offset = HEADER.size + index_length
+        self._ranges: Dict[str, Tuple[int, int]] = index["drills"]
+        self._languages: Dict[str, List[str]] = index["languages"]
+        self._drills: "OrderedDict[str, Drill]" = OrderedDict()
+        self.content_hash: str = index["content_hash"]
+        self.all_drill_slugs: List[str] = sorted(self._ranges)
+
+    def get_drill(self, slug: str) -> Drill:
+        drill = self._drills.get(slug)
+        if drill is not None:
+            self._drills.move_to_end(slug)
+            return drill
+        offset, length = self._ranges[slug]
+        start = self._data_offset + offset
+        drill = cast(Drill, pickle.loads(self._buffer[start : start + length]))
+        self._drills[slug] = drill
+        if len(self._drills) > DRILL_CACHE_SIZE:
+            self._drills.popitem(last=False)
+        return drill
+
+    def get_drills(self) -> Dict[str, Drill]:
+        return {slug: self.get_drill(slug) for slug in self.all_drill_slugs}
+
+    def get_slugs_for_language(self, language: str) -> List[str]:
+        return list(self._languages.get(language, []))
+
+    def languages(self) -> List[str]:
+        return sorted(self._languages)
+
+    def close(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+def open_bundle(bundle_path: str = DRILL_BUNDLE_PATH) -> Optional[BundledDrillLoader]:
+    try:
+        with open(bundle_path, "rb") as f:
+            # the mapping stays valid after the file is closed
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        # mmap raises ValueError for empty files
+        return None
+    try:
+        return BundledDrillLoader(buffer)
+    except (ValueError, struct.error):
+        buffer.close()
+        return None
+
+
+def is_up_to_date(
+    source_path: str = DRILL_SOURCE_PATH, bundle_path: str = DRILL_BUNDLE_PATH
+) -> bool:
+    loader = open_bundle(bundle_path)
+    if loader is None:
+        return False
+    try:
+        with open(source_path, "rb") as f:
+            return loader.content_hash == content_hash(f.read())
+    finally:
+        loader.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_drill_loader() -> BundledDrillLoader:
+    loader = open_bundle()
+    if loader is None:
+        logging.warning(
+            f"No drill bundle at {DRILL_BUNDLE_PATH} for version {DRILL_BUNDLE_VERSION}. "
+            "Compiling drill content in memory."
+        )
+        with open(DRILL_SOURCE_PATH, "rb") as f:
+            loader = BundledDrillLoader(compile_bundle(f.read()))
+    return loader
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="compile drills.json into a drill bundle")
+    parser.add_argument("--check", action="store_true", help="fail if the bundle is out of date")
+    args = parser.parse_args()
+    if args.check:
+        if not is_up_to_date():
+            print(f"{DRILL_BUNDLE_PATH} is out of date", file=sys.stderr)
+            sys.exit(1)
+        return
+    print(f"Built {DRILL_BUNDLE_PATH} ({build_bundle()})")
+
+
+if __name__ == "__main__":
+    main()
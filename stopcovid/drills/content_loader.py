@@ -2,14 +2,17 @@ import json
 import os
 import enum
 import random
-from typing import Dict, Any, List, Optional
-from jinja2 import Template
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader, Template
 
 
 from .drills import Drill
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
+JINJA_BYTECODE_CACHE_DIR_ENV_VAR = "JINJA_BYTECODE_CACHE_DIR"
+TEMPLATE_CACHE_SIZE = 1024
+
 
 class SupportedTranslation(enum.Enum):
     INCORRECT_ANSWER = "INCORRECT_ANSWER"
@@ -41,17 +44,47 @@ TRANSLATIONS = {
 }
 
 
+def _load_template_source(source: str) -> Tuple[str, None, Callable[[], bool]]:
+    # Templates are "named" by their source, so the environment's template cache is keyed by
+    # source string and each distinct message is parsed and compiled once per container.
+    return source, None, lambda: True
+
+
+def _bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    directory = os.getenv(JINJA_BYTECODE_CACHE_DIR_ENV_VAR)
+    return FileSystemBytecodeCache(directory) if directory else None
+
+
+TEMPLATE_ENVIRONMENT = Environment(
+    loader=FunctionLoader(_load_template_source),
+    # messages are plain text SMS, so values are never HTML escaped
+    autoescape=False,
+    cache_size=TEMPLATE_CACHE_SIZE,
+    auto_reload=False,
+    bytecode_cache=_bytecode_cache(),
+)
+
+
+def get_template(source: str) -> Template:
+    return TEMPLATE_ENVIRONMENT.get_template(source)
+
+
+def needs_rendering(text: str) -> bool:
+    # Rendering text without any template syntax is a no-op, apart from jinja's newline
+    # normalization and trailing newline removal.
+    return "{" in text or "\r" in text or text.endswith("\n")
+
+
 def correct_answer_response(language: Optional[str]) -> str:
     return f"{random.choice(CORRECT_ANSWER_EMOJI)} {translate(language, SupportedTranslation.MATCH_CORRECT_ANSWER)}"
 
 
 def template_additional_args(message: str, **kwargs: Any) -> str:
-    template = Template(message)
-    result = template.render({**kwargs})
+    result = get_template(message).render({**kwargs})
 
-    if kwargs:
-        template = Template(result)
-        result = template.render(**kwargs)
+    # the arguments may themselves contain template expressions
+    if kwargs and needs_rendering(result):
+        result = get_template(result).render(**kwargs)
     return result
 
 
@@ -62,6 +95,11 @@ def translate(language: Optional[str], template: SupportedTranslation, **kwargs:
     return value
 
 
+for _translations in TRANSLATIONS.values():
+    for _translation in _translations.values():
+        get_template(_translation)
+
+
 class SourceRepoDrillLoader:
     def __init__(self) -> None:
         self.drills_dict: Dict[str, Drill] = {}
@@ -1,14 +1,16 @@
 import logging
 from typing import List
 
-import rollbar
-
-from stopcovid.dialog.models.events import batch_from_dict, DialogEventBatch, DialogEvent
-from stopcovid.utils import dynamodb as dynamodb_utils
-
-
-from stopcovid.sms.enqueue_outbound_sms import enqueue_outbound_sms_commands
+from stopcovid.utils import rollbar
+
+from stopcovid.sms.enqueue_outbound_sms import (
+    enqueue_outbound_sms_commands,
+    project_batch_item,
+    OutboundEvent,
+)
+from stopcovid.utils.instrumentation import flush_metrics, timer
 from stopcovid.utils.logging import configure_logging
+from stopcovid.utils.profiling import profile_handler
 from stopcovid.utils.rollbar import configure_rollbar
 from stopcovid.utils.verify_deploy_stage import verify_deploy_stage
 
@@ -16,22 +18,29 @@ configure_logging()
 configure_rollbar()
 
 
-@rollbar.lambda_function  # type: ignore
+@rollbar.lambda_function
+@profile_handler
 def handler(event: dict, context: dict) -> dict:
     verify_deploy_stage()
-    event_batches: List[DialogEventBatch] = [
-        batch_from_dict(dynamodb_utils.deserialize(record["dynamodb"]["NewImage"]))
-        for record in event["Records"]
-        if record["dynamodb"].get("NewImage")
-    ]
-
-    dialog_events: List[DialogEvent] = []
-    for batch in event_batches:
-        for dialog_event in batch.events:
-            dialog_events.append(dialog_event)
-
-    enqueue_outbound_sms_commands(dialog_events)
-    for batch in event_batches:
-        logging.info(f"Enqueue SMS commands for {batch.phone_number} at seq {batch.seq}")
+    try:
+        with timer("dynamodb_stream_decode"):
+            # Only the fields needed for outbound SMS are read from each batch's image, rather
+            # than hydrating every event in the batch.
+            images = [
+                record["dynamodb"]["NewImage"]
+                for record in event["Records"]
+                if record["dynamodb"].get("NewImage")
+            ]
+            outbound_events: List[OutboundEvent] = []
+            for image in images:
+                outbound_events.extend(project_batch_item(image))
+
+        enqueue_outbound_sms_commands(outbound_events)
+        for image in images:
+            logging.info(
+                f"Enqueue SMS commands for {image['phone_number']['S']} at seq {image['seq']['S']}"
+            )
+    finally:
+        flush_metrics("enqueue_sms_batch")
 
     return {"statusCode": 200}
@@ -1,10 +1,12 @@
 import json
 
-import rollbar
+from stopcovid.utils import rollbar
 
 from stopcovid.sms.send_sms import send_sms_batches
 from stopcovid.sms.types import SMSBatch
+from stopcovid.utils.instrumentation import flush_metrics
 from stopcovid.utils.logging import configure_logging
+from stopcovid.utils.profiling import profile_handler
 from stopcovid.utils.rollbar import configure_rollbar
 from stopcovid.utils.verify_deploy_stage import verify_deploy_stage
 
@@ -12,9 +14,13 @@ configure_logging()
 configure_rollbar()
 
 
-@rollbar.lambda_function  # type: ignore
+@rollbar.lambda_function
+@profile_handler
 def handler(event: dict, context: dict) -> dict:
     verify_deploy_stage()
-    batches = [SMSBatch(**json.loads(record["body"])) for record in event["Records"]]
-    send_sms_batches(batches)
+    try:
+        batches = [SMSBatch(**json.loads(record["body"])) for record in event["Records"]]
+        send_sms_batches(batches)
+    finally:
+        flush_metrics("send_sms_batch")
     return {"statusCode": 200}
@@ -6,7 +6,7 @@ from pytz import UTC
 from typing import Any, Dict, cast
 from urllib.parse import unquote_plus
 
-import rollbar
+from stopcovid.utils import rollbar
 from twilio.request_validator import RequestValidator
 from twilio.twiml.messaging_response import MessagingResponse
 
@@ -14,6 +14,7 @@ from stopcovid.dialog.command_stream.publish import CommandPublisher
 from stopcovid.utils.idempotency import IdempotencyChecker
 
 from stopcovid.utils.logging import configure_logging
+from stopcovid.utils.profiling import profile_handler
 from stopcovid.utils.rollbar import configure_rollbar
 from stopcovid.utils.verify_deploy_stage import verify_deploy_stage
 from stopcovid.utils.boto3 import get_boto3_client
@@ -25,7 +26,8 @@ IDEMPOTENCY_REALM = "twilio-webhook"
 IDEMPOTENCY_EXPIRATION_MINUTES = 60
 
 
-@rollbar.lambda_function  # type: ignore
+@rollbar.lambda_function
+@profile_handler
 def handler(event: dict, context: dict) -> dict:
     verify_deploy_stage()
 
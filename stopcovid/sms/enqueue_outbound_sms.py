@@ -3,29 +3,25 @@ import json
 import logging
 import os
 from collections import defaultdict
-from typing import List, Optional, Any
-from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from dataclasses import dataclass, field
 import uuid
 
 from stopcovid.dialog.models.events import (
     DrillStarted,
-    UserValidated,
-    UserValidationFailed,
     CompletedPrompt,
     FailedPrompt,
     AdvancedToNextPrompt,
-    DrillCompleted,
-    OptedOut,
-    NextDrillRequested,
-    SchedulingDrillRequested,
     DialogEvent,
-    DrillRequested,
-    EnglishLessonDrillRequested,
+    DialogEventType,
     AdHocMessageSent,
+    ReminderTriggered,
 )
 from stopcovid.drills.drills import PromptMessage
-from stopcovid.drills.content_loader import translate, SupportedTranslation, correct_answer_response
-from stopcovid.utils.boto3 import get_boto3_resource
+from stopcovid.drills.content_loader import SupportedTranslation
+from stopcovid.sms.message_catalog import CATALOG
+from stopcovid.utils import sqs
+from stopcovid.utils.instrumentation import increment, timer
 
 USER_VALIDATION_FAILED_COPY = (
     "Invalid Code. Check with your administrator and make sure you have the right code."
@@ -58,73 +54,202 @@ def get_messages(
     ]
 
 
-def get_messages_for_event(event: DialogEvent) -> List[OutboundSMS]:  # noqa: C901
-    language = event.user_profile.language
+# (text, media_url) of each message in a prompt or ad hoc SMS
+MessageContent = Tuple[Optional[str], Optional[str]]
 
-    if isinstance(event, AdvancedToNextPrompt):
-        return get_messages(event, event.prompt.messages)
 
-    elif isinstance(event, FailedPrompt):
-        if not event.abandoned:
-            return get_messages(
-                event,
-                [PromptMessage(text=translate(language, SupportedTranslation.INCORRECT_ANSWER))],
-            )
-        elif event.prompt.correct_response:
-            return get_messages(
-                event,
-                [
-                    PromptMessage(
-                        text=translate(
-                            language,
-                            SupportedTranslation.CORRECTED_ANSWER,
-                            correct_answer=event.prompt.correct_response,
-                        )
-                    )
-                ],
-            )
-
-    elif isinstance(event, CompletedPrompt):
-        if event.prompt.correct_response is not None:
-            return get_messages(
-                event,
-                [PromptMessage(text=correct_answer_response(language))],
-            )
-
-    elif isinstance(event, UserValidated):
-        # User validated events will cause the scheduler to kick off a drill
-        pass
-
-    elif isinstance(event, UserValidationFailed):
-        return get_messages(event, [PromptMessage(text=USER_VALIDATION_FAILED_COPY)])
-
-    elif isinstance(event, DrillStarted):
-        return get_messages(event, event.first_prompt.messages)
-
-    elif isinstance(event, AdHocMessageSent):
-        return get_messages(
-            event, [PromptMessage(text=event.sms.body, media_url=event.sms.media_url)]
-        )
+@dataclass
+class OutboundEvent:
+    # The parts of a dialog event that determine the SMS it produces. It can be projected from a
+    # DialogEvent or straight from the event's DynamoDB attribute map, without hydrating the event.
+    event_type: DialogEventType
+    event_id: uuid.UUID
+    phone_number: str
+    language: Optional[str]
+    messaging_service_sid: Optional[str]
+    messages: List[MessageContent] = field(default_factory=list)
+    correct_response: Optional[str] = None
+    abandoned: bool = False
+
+
+SMS_EVENT_TYPES = {
+    DialogEventType.ADVANCED_TO_NEXT_PROMPT,
+    DialogEventType.FAILED_PROMPT,
+    DialogEventType.COMPLETED_PROMPT,
+    DialogEventType.USER_VALIDATION_FAILED,
+    DialogEventType.DRILL_STARTED,
+    DialogEventType.AD_HOC_MESSAGE_SENT,
+    DialogEventType.REMINDER_TRIGGERED,
+}
+NO_SMS_EVENT_TYPES = {
+    # User validated events will cause the scheduler to kick off a drill
+    DialogEventType.USER_VALIDATED,
+    DialogEventType.DRILL_COMPLETED,
+    DialogEventType.OPTED_OUT,
+    DialogEventType.NEXT_DRILL_REQUESTED,
+    DialogEventType.SCHEDULING_DRILL_REQUESTED,
+    DialogEventType.ENGLISH_LESSON_DRILL_REQUESTED,
+    DialogEventType.DRILL_REQUESTED,
+}
+SMS_EVENT_TYPE_VALUES = {event_type.value: event_type for event_type in SMS_EVENT_TYPES}
+NO_SMS_EVENT_TYPE_VALUES = {event_type.value for event_type in NO_SMS_EVENT_TYPES}
+
+
+def project_event(event: DialogEvent) -> Optional[OutboundEvent]:
+    if event.event_type not in SMS_EVENT_TYPES:
+        if event.event_type not in NO_SMS_EVENT_TYPES:
+            logging.info(f"Unknown event type: {event.event_type}")
+        return None
+    projection = OutboundEvent(
+        event_type=event.event_type,
+        event_id=event.event_id,
+        phone_number=event.phone_number,
+        language=event.user_profile.language,
+        messaging_service_sid=event.user_profile.messaging_service_sid,
+    )
+    if isinstance(event, (AdvancedToNextPrompt, CompletedPrompt, FailedPrompt, ReminderTriggered)):
+        projection.messages = [
+            (message.text, message.media_url) for message in event.prompt.messages
+        ]
+        projection.correct_response = event.prompt.correct_response
+    if isinstance(event, FailedPrompt):
+        projection.abandoned = event.abandoned
+    if isinstance(event, DrillStarted):
+        projection.messages = [
+            (message.text, message.media_url) for message in event.first_prompt.messages
+        ]
+    if isinstance(event, AdHocMessageSent):
+        projection.messages = [(event.sms.body, event.sms.media_url)]
+    return projection
+
+
+def _string(attribute: Optional[dict]) -> Optional[str]:
+    if attribute is None or "NULL" in attribute:
+        return None
+    return str(attribute["S"])
+
+
+def _map(attribute: Optional[dict]) -> dict:
+    if attribute is None or "NULL" in attribute:
+        return {}
+    return dict(attribute["M"])
+
+
+def _message_contents(messages: List[dict]) -> List[MessageContent]:
+    contents = []
+    for message in messages:
+        message_map = message["M"]
+        contents.append((_string(message_map.get("text")), _string(message_map.get("media_url"))))
+    return contents
+
 
-    elif isinstance(
-        event,
-        (
-            DrillCompleted,
-            OptedOut,
-            NextDrillRequested,
-            SchedulingDrillRequested,
-            EnglishLessonDrillRequested,
-            DrillRequested,
-        ),
+def project_event_item(item: dict) -> Optional[OutboundEvent]:
+    # item is the attribute map of one event in a dialog event batch, as found in the batch's
+    # DynamoDB stream image
+    event_type_value = item["event_type"]["S"]
+    event_type = SMS_EVENT_TYPE_VALUES.get(event_type_value)
+    if event_type is None:
+        if event_type_value not in NO_SMS_EVENT_TYPE_VALUES:
+            logging.info(f"Unknown event type: {DialogEventType(event_type_value)}")
+        return None
+    user_profile = _map(item.get("user_profile"))
+    projection = OutboundEvent(
+        event_type=event_type,
+        event_id=uuid.UUID(item["event_id"]["S"]),
+        phone_number=item["phone_number"]["S"],
+        language=_string(user_profile.get("language")),
+        messaging_service_sid=_string(user_profile.get("messaging_service_sid")),
+    )
+    if event_type == DialogEventType.DRILL_STARTED:
+        projection.messages = _message_contents(item["first_prompt"]["M"]["messages"]["L"])
+    elif event_type == DialogEventType.AD_HOC_MESSAGE_SENT:
+        sms = item["sms"]["M"]
+        projection.messages = [(_string(sms.get("body")), _string(sms.get("media_url")))]
+    elif event_type != DialogEventType.USER_VALIDATION_FAILED:
+        prompt = item["prompt"]["M"]
+        projection.messages = _message_contents(prompt["messages"]["L"])
+        projection.correct_response = _string(prompt.get("correct_response"))
+        projection.abandoned = bool(item.get("abandoned", {}).get("BOOL", False))
+    return projection
+
+
+def project_batch_item(image: dict) -> List[OutboundEvent]:
+    # image is a dialog event batch's DynamoDB stream image (NewImage)
+    projections = []
+    for event_item in image.get("events", {}).get("L", []):
+        projection = project_event_item(event_item["M"])
+        if projection is not None:
+            projections.append(projection)
+    return projections
+
+
+def _outbound_sms(
+    event: OutboundEvent, body: Optional[str], media_url: Optional[str] = None
+) -> OutboundSMS:
+    return OutboundSMS(
+        event_id=event.event_id,
+        phone_number=event.phone_number,
+        body=body or None,
+        media_url=media_url,
+        messaging_service_sid=event.messaging_service_sid,
+    )
+
+
+def get_messages_for_projection(event: OutboundEvent) -> List[OutboundSMS]:
+    if event.event_type in (
+        DialogEventType.ADVANCED_TO_NEXT_PROMPT,
+        DialogEventType.DRILL_STARTED,
+        DialogEventType.AD_HOC_MESSAGE_SENT,
+        # a reminder resends the prompt the user is stuck on
+        DialogEventType.REMINDER_TRIGGERED,
     ):
-        pass
+        return [_outbound_sms(event, text, media_url) for text, media_url in event.messages]
 
-    else:
-        logging.info(f"Unknown event type: {event.event_type}")
+    elif event.event_type == DialogEventType.FAILED_PROMPT:
+        if not event.abandoned:
+            return [
+                _outbound_sms(
+                    event, CATALOG.translate(event.language, SupportedTranslation.INCORRECT_ANSWER)
+                )
+            ]
+        elif event.correct_response:
+            return [
+                _outbound_sms(
+                    event,
+                    CATALOG.translate(
+                        event.language,
+                        SupportedTranslation.CORRECTED_ANSWER,
+                        correct_answer=event.correct_response,
+                    ),
+                )
+            ]
+
+    elif event.event_type == DialogEventType.COMPLETED_PROMPT:
+        if event.correct_response is not None:
+            return [_outbound_sms(event, CATALOG.correct_answer_response(event.language))]
+
+    elif event.event_type == DialogEventType.USER_VALIDATION_FAILED:
+        return [_outbound_sms(event, USER_VALIDATION_FAILED_COPY)]
 
     return []
 
 
+def get_messages_for_event(event: DialogEvent) -> List[OutboundSMS]:
+    projection = project_event(event)
+    if projection is None:
+        return []
+    return get_messages_for_projection(projection)
+
+
+def get_outbound_messages(events: List[OutboundEvent]) -> List[OutboundSMS]:
+    outbound_messages = []
+
+    for event in events:
+        outbound_messages.extend(get_messages_for_projection(event))
+
+    return outbound_messages
+
+
 def get_outbound_sms_commands(dialog_events: List[DialogEvent]) -> List[OutboundSMS]:
     outbound_messages = []
 
@@ -134,19 +259,19 @@ def get_outbound_sms_commands(dialog_events: List[DialogEvent]) -> List[Outbound
     return outbound_messages
 
 
-def enqueue_outbound_sms_commands(dialog_events: List[DialogEvent]) -> None:
-    outbound_messages = get_outbound_sms_commands(dialog_events)
-    publish_outbound_sms_messages(outbound_messages)
+def enqueue_outbound_sms_commands(events: List[OutboundEvent]) -> None:
+    with timer("build_outbound_messages"):
+        outbound_messages = get_outbound_messages(events)
+    increment("outbound_messages", len(outbound_messages))
+    with timer("sqs_publish"):
+        publish_outbound_sms_messages(outbound_messages)
 
 
-def publish_outbound_sms_messages(outbound_sms_messages: List[OutboundSMS]) -> Any:
+def publish_outbound_sms_messages(outbound_sms_messages: List[OutboundSMS]) -> None:
     if not outbound_sms_messages:
-        return None
-
-    sqs = get_boto3_resource("sqs")
+        return
 
     queue_name = f"outbound-sms-{os.getenv('STAGE')}.fifo"
-    queue = sqs.get_queue_by_name(QueueName=queue_name)
 
     phone_number_to_messages = defaultdict(list)
     for message in outbound_sms_messages:
@@ -175,7 +300,8 @@ def publish_outbound_sms_messages(outbound_sms_messages: List[OutboundSMS]) -> A
             }
         )
 
-    return queue.send_messages(Entries=entries)
+    # one entry per phone number, so chunks can be sent in any order
+    sqs.send_message_batches(queue_name, entries)
 
 
 def _get_message_deduplication_id(messages: List[OutboundSMS]) -> str:
@@ -0,0 +1,78 @@
+import random
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from stopcovid.drills.content_loader import (
+    CORRECT_ANSWER_EMOJI,
+    TRANSLATIONS,
+    SupportedTranslation,
+    needs_rendering,
+    template_additional_args,
+)
+
+# Outbound copy is fixed per language, so it's prepared once per container: translations are
+# split into literal text and variable slots, and the correct answer responses are expanded for
+# every emoji. Producing a message for an event is then a dict lookup and a string join.
+
+DEFAULT_LANGUAGE = "en"
+
+SLOT = re.compile(r"{{\s*(\w+)\s*}}")
+
+
+class MessageTemplate:
+    def __init__(self, source: str) -> None:
+        self.source = source
+        parts = SLOT.split(source)
+        self.literals: Tuple[str, ...] = tuple(parts[0::2])
+        self.slots: Tuple[str, ...] = tuple(parts[1::2])
+        # templates with any jinja syntax besides plain variables are left to jinja
+        self.is_simple = not needs_rendering("".join(self.literals))
+
+    def render(self, **kwargs: Any) -> str:
+        if not kwargs:
+            return self.source
+        if self.is_simple:
+            result = self.literals[0]
+            for slot, literal in zip(self.slots, self.literals[1:]):
+                # like jinja, a missing variable renders as an empty string
+                result += (str(kwargs[slot]) if slot in kwargs else "") + literal
+            # values can contain template syntax of their own, which jinja would render
+            if not needs_rendering(result):
+                return result
+        return template_additional_args(self.source, **kwargs)
+
+
+class MessageCatalog:
+    def __init__(
+        self,
+        translations: Dict[str, Dict[SupportedTranslation, str]] = TRANSLATIONS,
+        correct_answer_emoji: List[str] = CORRECT_ANSWER_EMOJI,
+    ) -> None:
+        self._templates: Dict[Tuple[str, SupportedTranslation], MessageTemplate] = {
+            (language, translation): MessageTemplate(source)
+            for language, sources in translations.items()
+            for translation, source in sources.items()
+        }
+        self._correct_answer_responses: Dict[str, Tuple[str, ...]] = {
+            language: tuple(
+                f"{emoji} {sources[SupportedTranslation.MATCH_CORRECT_ANSWER]}"
+                for emoji in correct_answer_emoji
+            )
+            for language, sources in translations.items()
+        }
+
+    def _language(self, language: Optional[str]) -> str:
+        if language is not None and language in self._correct_answer_responses:
+            return language
+        return DEFAULT_LANGUAGE
+
+    def translate(
+        self, language: Optional[str], translation: SupportedTranslation, **kwargs: Any
+    ) -> str:
+        return self._templates[(self._language(language), translation)].render(**kwargs)
+
+    def correct_answer_response(self, language: Optional[str]) -> str:
+        return random.choice(self._correct_answer_responses[self._language(language)])
+
+
+CATALOG = MessageCatalog()
@@ -0,0 +1,93 @@
+import functools
+import json
+import math
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from stopcovid.sms.types import SMS
+
+# A message that only uses the GSM 03.38 alphabet is encoded in 7 bits per character: 160
+# characters fit in one SMS, and each segment of a concatenated SMS holds 153. Anything else
+# (e.g. an emoji or Khmer text) is sent as UCS-2: 70 UTF-16 code units, or 67 per segment.
+
+SMS_MERGE_POLICY_ENV_VAR = "SMS_MERGE_POLICY"
+DEFAULT_POLICY_KEY = "default"
+
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# characters in the GSM extension table take two septets
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+GSM7_SINGLE_SEGMENT = 160
+GSM7_PER_SEGMENT = 153
+UCS2_SINGLE_SEGMENT = 70
+UCS2_PER_SEGMENT = 67
+
+# Twilio rejects message bodies longer than this
+MAX_BODY_LENGTH = 1600
+
+
+def is_gsm7(text: str) -> bool:
+    return all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text)
+
+
+def segment_count(text: str) -> int:
+    if is_gsm7(text):
+        length = len(text) + sum(1 for c in text if c in GSM7_EXTENDED)
+        single, per_segment = GSM7_SINGLE_SEGMENT, GSM7_PER_SEGMENT
+    else:
+        length = len(text.encode("utf-16-le")) // 2
+        single, per_segment = UCS2_SINGLE_SEGMENT, UCS2_PER_SEGMENT
+    if length <= single:
+        return 1
+    return math.ceil(length / per_segment)
+
+
+@dataclass
+class MergePolicy:
+    enabled: bool = False
+    separator: str = "\n\n"
+    max_segments: int = 10
+
+
+@functools.lru_cache(maxsize=None)
+def _load_policies(config: str) -> Dict[str, MergePolicy]:
+    # e.g. {"default": {"enabled": true}, "MG123": {"enabled": true, "max_segments": 3}}
+    return {key: MergePolicy(**value) for key, value in json.loads(config or "{}").items()}
+
+
+def get_merge_policy(messaging_service_sid: Optional[str]) -> MergePolicy:
+    policies = _load_policies(os.getenv(SMS_MERGE_POLICY_ENV_VAR, ""))
+    if messaging_service_sid and messaging_service_sid in policies:
+        return policies[messaging_service_sid]
+    return policies.get(DEFAULT_POLICY_KEY, MergePolicy())
+
+
+def _is_text(message: SMS) -> bool:
+    return bool(message.body) and message.media_url is None
+
+
+def merge_messages(messages: List[SMS], policy: MergePolicy) -> List[SMS]:
+    # Combines consecutive text messages when the combined message needs no more segments than
+    # the messages it replaces. Media messages are never merged, so they keep their position.
+    if not policy.enabled:
+        return messages
+    merged: List[SMS] = []
+    for message in messages:
+        previous = merged[-1] if merged else None
+        if previous is not None and _is_text(previous) and _is_text(message):
+            assert previous.body and message.body
+            body = f"{previous.body}{policy.separator}{message.body}"
+            segments = segment_count(body)
+            if (
+                segments <= segment_count(previous.body) + segment_count(message.body)
+                and segments <= policy.max_segments
+                and len(body) <= MAX_BODY_LENGTH
+            ):
+                merged[-1] = SMS(body=body)
+                continue
+        merged.append(message)
+    return merged
@@ -9,7 +9,9 @@ from . import twilio
 from stopcovid.sms.types import SMSBatch, OutboundPayload
 
 from . import publish
+from .segments import get_merge_policy, merge_messages
 from ..utils.idempotency import IdempotencyChecker
+from ..utils.instrumentation import increment, timer
 from ..utils.phones import is_fake_phone_number
 
 DELAY_SECONDS_BETWEEN_MESSAGES = 3
@@ -57,24 +59,31 @@ def _send_batch(batch: SMSBatch) -> Optional[List[twilio.TwilioResponse]]:
     if idempotency_checker.already_processed(batch.idempotency_key, IDEMPOTENCY_REALM):
         logging.info(f"SMS Batch already processed. Skipping. {batch}")
         return None
+    messages = merge_messages(batch.messages, get_merge_policy(batch.messaging_service_sid))
+    if len(messages) < len(batch.messages):
+        increment("sms_merged", len(batch.messages) - len(messages))
     twilio_responses = []
-    for i, message in enumerate(batch.messages):
+    for i, message in enumerate(messages):
         if (message.body is None) and (message.media_url is None):
             logging.info(f"Skipped messages to {batch.phone_number}; no body or media_url")
             continue
-        res = twilio.send_message(
-            batch.phone_number, message.body, message.media_url, batch.messaging_service_sid
-        )
-        _publish_send(res, message.media_url)
+        with timer("twilio_send_message"):
+            res = twilio.send_message(
+                batch.phone_number, message.body, message.media_url, batch.messaging_service_sid
+            )
+        with timer("message_log_publish"):
+            _publish_send(res, message.media_url)
+        increment("sms_sent")
         twilio_responses.append(res)
 
         # sleep after every message besides the last one
 
-        if i < len(batch.messages) - 1:
-            if message.media_url:
-                sleep(DELAY_SECONDS_AFTER_MEDIA)
-            else:
-                sleep(DELAY_SECONDS_BETWEEN_MESSAGES)
+        if i < len(messages) - 1:
+            with timer("message_pacing_sleep"):
+                if message.media_url:
+                    sleep(DELAY_SECONDS_AFTER_MEDIA)
+                else:
+                    sleep(DELAY_SECONDS_BETWEEN_MESSAGES)
 
     idempotency_checker.record_as_processed(
         batch.idempotency_key, IDEMPOTENCY_REALM, IDEMPOTENCY_EXPIRATION_MINUTES
@@ -1,7 +1,7 @@
-from typing import Optional
+import functools
+from typing import Optional, Any
 import pydantic
 
-from twilio.rest import Client
 import os
 
 
@@ -17,7 +17,7 @@ class TwilioResponse(pydantic.BaseModel):
 def send_message(
     to: str, body: Optional[str], media_url: Optional[str], messaging_service_sid: Optional[str]
 ) -> TwilioResponse:
-    client = Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"])
+    client = _get_client()
     if body is None:
         emoji_escaped_body = None
     else:
@@ -38,6 +38,15 @@ def send_message(
     )
 
 
+@functools.lru_cache(maxsize=None)
+def _get_client() -> Any:
+    # twilio.rest is slow to import, so it's loaded when the first message is sent, and the
+    # client (and its HTTP session) is reused for the life of the container.
+    from twilio.rest import Client
+
+    return Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"])
+
+
 def _get_messaging_service_sid(to: str, messaging_service_sid: Optional[str]) -> Optional[str]:
     if messaging_service_sid is None or to.startswith("whatsapp"):
         return os.environ["TWILIO_MESSAGING_SERVICE_SID"]
@@ -1,3 +1,11 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
 from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
 
 
@@ -9,3 +17,144 @@ def serialize(a_dict: dict) -> dict:
 def deserialize(a_dict: dict) -> dict:
     deserializer = TypeDeserializer()
     return {k: deserializer.deserialize(v) for k, v in a_dict.items()}
+
+
+def _decimal_to_number(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def deserialize_to_json(a_dict: dict) -> str:
+    # The JSON that was stored, without round tripping it through our models
+    return json.dumps(deserialize(a_dict), default=_decimal_to_number)
+
+
+# batch_write_item accepts at most 25 requests per call
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_BATCH_WRITE_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 0.1
+
+
+def batch_write(dynamodb: Any, table_name: str, requests: List[dict]) -> None:
+    # requests are PutRequests and DeleteRequests. Unprocessed items are retried with backoff.
+    for start in range(0, len(requests), MAX_BATCH_WRITE_ITEMS):
+        pending = {table_name: requests[start : start + MAX_BATCH_WRITE_ITEMS]}
+        for attempt in range(MAX_BATCH_WRITE_ATTEMPTS):
+            if attempt:
+                time.sleep(RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get("UnprocessedItems")
+            if not pending:
+                break
+        else:
+            raise RuntimeError(f"Unable to write to {table_name}: {pending}")
+
+
+def query_items(dynamodb: Any, **kwargs: Any) -> Iterator[dict]:
+    # every item matching the query, following LastEvaluatedKey across pages
+    while True:
+        response = dynamodb.query(**kwargs)
+        yield from response["Items"]
+        if not response.get("LastEvaluatedKey"):
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def projection_expression(attributes: Sequence[str]) -> Tuple[str, Dict[str, str]]:
+    # A ProjectionExpression for dotted attribute paths, e.g. "user_profile.language", and its
+    # ExpressionAttributeNames. Every name is substituted, since many are reserved words.
+    names: Dict[str, str] = {}
+    paths = []
+    for attribute in attributes:
+        path = []
+        for name in attribute.split("."):
+            placeholder = names.setdefault(name, f"#a{len(names)}")
+            path.append(placeholder)
+        paths.append(".".join(path))
+    return ", ".join(paths), {placeholder: name for name, placeholder in names.items()}
+
+
+class CapacityLimiter:
+    # Paces requests so that the capacity they consume averages at most units_per_second. The
+    # capacity each response reports pushes back the time the next request may start.
+
+    def __init__(self, units_per_second: float) -> None:
+        self.units_per_second = units_per_second
+        self._next_request_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            delay = self._next_request_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def consumed(self, units: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._next_request_at = max(self._next_request_at, now) + units / self.units_per_second
+
+
+# pages buffered per segment while the caller is busy with earlier ones
+SCAN_PAGES_PER_SEGMENT = 2
+_SEGMENT_DONE = object()
+
+
+def parallel_scan(
+    dynamodb: Any,
+    total_segments: int = 4,
+    max_capacity_per_second: Optional[float] = None,
+    **kwargs: Any,
+) -> Iterator[dict]:
+    # Every item a scan returns, with the table split into total_segments segments that are
+    # scanned concurrently. Items are yielded as their pages arrive, so in no particular order.
+    # kwargs are passed to scan, e.g. TableName, ProjectionExpression and FilterExpression.
+    limiter = CapacityLimiter(max_capacity_per_second) if max_capacity_per_second else None
+    pages: "queue.Queue[Any]" = queue.Queue(maxsize=total_segments * SCAN_PAGES_PER_SEGMENT)
+    stopped = threading.Event()
+
+    def put(page: Any) -> None:
+        # gives up if the caller stopped reading
+        while not stopped.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def scan_segment(segment: int) -> None:
+        args = {**kwargs, "Segment": segment, "TotalSegments": total_segments}
+        if limiter:
+            args["ReturnConsumedCapacity"] = "TOTAL"
+        try:
+            while not stopped.is_set():
+                if limiter:
+                    limiter.wait()
+                response = dynamodb.scan(**args)
+                if limiter:
+                    limiter.consumed(response.get("ConsumedCapacity", {}).get("CapacityUnits", 0))
+                put(response["Items"])
+                if not response.get("LastEvaluatedKey"):
+                    break
+                args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as e:
+            put(e)
+            return
+        put(_SEGMENT_DONE)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        try:
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is _SEGMENT_DONE:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from page
+        finally:
+            stopped.set()
@@ -0,0 +1,53 @@
+import csv
+import json
+from decimal import Decimal
+from typing import Any, Iterable, Sequence, TextIO
+
+# Writes deserialized DynamoDB items as rows, one at a time, so an export of a whole table
+# never has to fit in memory. Columns are dotted attribute paths, e.g. "user_profile.language".
+
+FORMATS = ["text", "jsonl", "csv"]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def get_path(item: dict, path: str) -> Any:
+    value: Any = item
+    for name in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=_json_default)
+
+
+def write_items(items: Iterable[dict], columns: Sequence[str], fmt: str, out: TextIO) -> int:
+    # text is tab separated with no header. Returns the number of items written.
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    count = 0
+    for item in items:
+        values = [get_path(item, column) for column in columns]
+        if fmt == "jsonl":
+            out.write(json.dumps(dict(zip(columns, values)), default=_json_default) + "\n")
+        elif writer is not None:
+            writer.writerow([_cell(value) for value in values])
+        else:
+            out.write("\t".join(_cell(value) for value in values) + "\n")
+        count += 1
+    return count
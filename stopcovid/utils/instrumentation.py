@@ -0,0 +1,107 @@
+import json
+import os
+import time
+from collections import defaultdict
+from types import TracebackType
+from typing import Dict, List, Optional, Type
+
+METRICS_ENABLED_ENV_VAR = "METRICS_ENABLED"
+METRICS_NAMESPACE = "DialogEngine"
+
+# CloudWatch accepts at most 100 values per metric in a single embedded metric format record
+MAX_VALUES_PER_METRIC = 100
+
+
+class MetricsRecorder:
+    # Accumulates timings and counters for one lambda invocation and writes them to stdout in
+    # CloudWatch Embedded Metric Format, so publishing them doesn't cost an API call.
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.counts: Dict[str, float] = defaultdict(float)
+
+    def record_timing(self, name: str, elapsed_ms: float) -> None:
+        if self.enabled:
+            self.timings[name].append(elapsed_ms)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        if self.enabled:
+            self.counts[name] += value
+
+    def flush(self, function_name: str) -> None:
+        if not self.enabled:
+            return
+        for record in self._emf_records(function_name):
+            print(json.dumps(record))
+        self.timings.clear()
+        self.counts.clear()
+
+    def _emf_records(self, function_name: str) -> List[dict]:
+        if not self.timings and not self.counts:
+            return []
+        records = []
+        timings = {name: list(values) for name, values in self.timings.items()}
+        counts = dict(self.counts)
+        while timings or counts:
+            metric_definitions = []
+            record: dict = {"function": function_name}
+            for name in list(timings):
+                values = timings[name]
+                record[name] = values[:MAX_VALUES_PER_METRIC]
+                metric_definitions.append({"Name": name, "Unit": "Milliseconds"})
+                if len(values) > MAX_VALUES_PER_METRIC:
+                    timings[name] = values[MAX_VALUES_PER_METRIC:]
+                else:
+                    del timings[name]
+            for name, value in counts.items():
+                record[name] = value
+                metric_definitions.append({"Name": name, "Unit": "Count"})
+            counts = {}
+            record["_aws"] = {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["function"]],
+                        "Metrics": metric_definitions,
+                    }
+                ],
+            }
+            records.append(record)
+        return records
+
+
+class Timer:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+        self.elapsed_ms = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.elapsed_ms = (time.perf_counter() - self.start) * 1000
+        RECORDER.record_timing(self.name, self.elapsed_ms)
+
+
+RECORDER = MetricsRecorder(enabled=os.getenv(METRICS_ENABLED_ENV_VAR, "").lower() == "true")
+
+
+def timer(name: str) -> Timer:
+    return Timer(name)
+
+
+def increment(name: str, value: float = 1) -> None:
+    RECORDER.increment(name, value)
+
+
+def flush_metrics(function_name: str) -> None:
+    RECORDER.flush(function_name)
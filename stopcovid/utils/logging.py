@@ -1,5 +1,11 @@
+import json
 import logging
+import os
+import random
 import sys
+from typing import Any, Callable, Dict
+
+LOG_SAMPLE_RATE_ENV_VAR = "LOG_SAMPLE_RATE"
 
 
 def _is_running_unit_tests() -> bool:
@@ -13,3 +19,42 @@ def configure_logging() -> None:
 
     root = logging.getLogger()
     root.setLevel(logging.INFO)
+
+
+class LazyField:
+    # A structured log field that is expensive to compute. It's only computed if the record is
+    # emitted and the logger is enabled for the field's level (or the request is sampled).
+
+    def __init__(self, compute: Callable[[], Any], level: int = logging.DEBUG) -> None:
+        self.compute = compute
+        self.level = level
+
+
+class StructuredMessage:
+    # Serialized to JSON only when a handler formats the record.
+
+    def __init__(self, message: str, fields: Dict[str, Any]) -> None:
+        self.message = message
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return json.dumps({"message": self.message, **self.fields}, default=str)
+
+
+def should_sample() -> bool:
+    rate = float(os.getenv(LOG_SAMPLE_RATE_ENV_VAR, "0"))
+    return rate > 0 and random.random() < rate
+
+
+def log_structured(level: int, message: str, sampled: bool = False, **fields: Any) -> None:
+    logger = logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    resolved = {}
+    for name, value in fields.items():
+        if isinstance(value, LazyField):
+            if not (sampled or logger.isEnabledFor(value.level)):
+                continue
+            value = value.compute()
+        resolved[name] = value
+    logger.log(level, StructuredMessage(message, resolved))
@@ -0,0 +1,146 @@
+import functools
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any, Callable, List, Optional, TypeVar, cast, TYPE_CHECKING
+
+from stopcovid.utils.logging import log_structured
+
+if TYPE_CHECKING:
+    import cProfile
+
+PROFILE_SAMPLE_RATE_ENV_VAR = "PROFILE_SAMPLE_RATE"
+PROFILE_MODE_ENV_VAR = "PROFILE_MODE"
+PROFILE_TOP_N_ENV_VAR = "PROFILE_TOP_N"
+
+CPROFILE_MODE = "cprofile"
+SAMPLING_MODE = "sampling"
+DEFAULT_TOP_N = 25
+SAMPLING_INTERVAL_SECONDS = 0.005
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class SamplingProfiler:
+    # Periodically captures the stack of the thread that started it and aggregates the samples
+    # as collapsed stacks ("outer;inner;innermost count"), the input format for flame graphs.
+
+    def __init__(self, interval_seconds: float = SAMPLING_INTERVAL_SECONDS) -> None:
+        self.interval_seconds = interval_seconds
+        self.stacks: Counter = Counter()
+        self._target_thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def collapsed_stacks(self) -> List[str]:
+        return [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _should_profile() -> bool:
+    rate = float(os.getenv(PROFILE_SAMPLE_RATE_ENV_VAR, "0"))
+    return rate > 0 and random.random() < rate
+
+
+def _output_path(name: str, extension: str) -> Optional[str]:
+    # Profiles are only written to disk for local runs. In lambda the summary goes to the log.
+    if os.getenv("STAGE") != "local":
+        return None
+    return os.path.join(tempfile.gettempdir(), f"{name}-{int(time.time() * 1000)}.{extension}")
+
+
+def _report_cprofile(name: str, profiler: "cProfile.Profile", top_n: int) -> None:
+    import pstats
+
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats("cumulative").print_stats(top_n)
+    path = _output_path(name, "pstats")
+    if path:
+        stats.dump_stats(path)
+    log_structured(
+        logging.INFO,
+        "Profile",
+        function=name,
+        mode=CPROFILE_MODE,
+        path=path,
+        top=[line for line in output.getvalue().splitlines() if line.strip()],
+    )
+
+
+def _report_samples(name: str, profiler: SamplingProfiler, top_n: int) -> None:
+    stacks = profiler.collapsed_stacks()
+    path = _output_path(name, "collapsed")
+    if path:
+        with open(path, "w") as f:
+            f.write("\n".join(stacks))
+    log_structured(
+        logging.INFO,
+        "Profile",
+        function=name,
+        mode=SAMPLING_MODE,
+        path=path,
+        samples=sum(profiler.stacks.values()),
+        top=stacks[:top_n],
+    )
+
+
+def profile_handler(handler: F) -> F:
+    # Profiles a fraction (PROFILE_SAMPLE_RATE) of invocations of a lambda handler, with either
+    # cProfile or a stack sampler (PROFILE_MODE). Use it beneath @rollbar.lambda_function.
+    name = f"{handler.__module__}.{handler.__name__}"
+
+    @functools.wraps(handler)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not _should_profile():
+            return handler(*args, **kwargs)
+        top_n = int(os.getenv(PROFILE_TOP_N_ENV_VAR, DEFAULT_TOP_N))
+        if os.getenv(PROFILE_MODE_ENV_VAR, CPROFILE_MODE) == SAMPLING_MODE:
+            sampler = SamplingProfiler()
+            sampler.start()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                sampler.stop()
+                _report_samples(name, sampler, top_n)
+
+        # imported here to keep the profiler off the cold start path of unprofiled handlers
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _report_cprofile(name, profiler, top_n)
+
+    return cast(F, wrapper)
@@ -1,7 +1,18 @@
+import functools
 import os
 import sys
+from types import ModuleType
+from typing import Any, Callable, Optional, TypeVar, cast
 
-import rollbar
+# The rollbar client pulls in requests and urllib3, which is a large share of a lambda's cold
+# start. Most invocations never report anything, so we only import and initialize rollbar the
+# first time something is reported.
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_configured = False
+_rollbar: Optional[ModuleType] = None
+_lambda_context: Any = None
 
 
 def _is_running_unit_tests() -> bool:
@@ -9,25 +20,66 @@ def _is_running_unit_tests() -> bool:
 
 
 def configure_rollbar() -> None:
+    global _configured
     if _is_running_unit_tests():
         return
+    _configured = True
+
+
+def _get_rollbar() -> ModuleType:
+    global _rollbar
+    if _rollbar is None:
+        import rollbar
+
+        if _configured:
+            stage = os.environ.get("STAGE")
+            is_local = stage == "local"
+            rollbar.init(
+                os.environ.get("ROLLBAR_TOKEN"),
+                enabled=not is_local,
+                environment=f"dialog-engine-{stage}",
+                locals={
+                    "safe_repr": False,
+                    "sizes": {
+                        "maxdict": 1000,
+                        "maxarray": 1000,
+                        "maxlist": 1000,
+                        "maxtuple": 1000,
+                        "maxset": 1000,
+                        "maxstring": 1000,
+                        "maxother": 1000,
+                    },
+                },
+            )
+        _rollbar = rollbar
+    # rollbar.lambda_function would have recorded this before invoking the handler
+    _rollbar._CURRENT_LAMBDA_CONTEXT = _lambda_context  # type: ignore
+    return _rollbar
+
+
+def report_exc_info(*args: Any, **kwargs: Any) -> Any:
+    return _get_rollbar().report_exc_info(*args, **kwargs)
+
+
+def lambda_function(handler: F) -> F:
+    # Equivalent to rollbar.lambda_function, without importing rollbar up front.
+
+    @functools.wraps(handler)
+    def wrapper(event: Any, context: Any) -> Any:
+        global _lambda_context
+        _lambda_context = context
+        try:
+            result = handler(event, context)
+        except BaseException:
+            cls, exc, trace = sys.exc_info()
+            rollbar = _get_rollbar()
+            rollbar.report_exc_info((cls, exc, trace.tb_next if trace else None))
+            if _configured:
+                rollbar.wait()
+            raise
+        if _rollbar is not None and _configured:
+            # wait for any reports made during the invocation to be sent
+            _rollbar.wait()
+        return result
 
-    stage = os.environ.get("STAGE")
-    is_local = stage == "local"
-    rollbar.init(
-        os.environ.get("ROLLBAR_TOKEN"),
-        enabled=not is_local,
-        environment=f"dialog-engine-{stage}",
-        locals={
-            "safe_repr": False,
-            "sizes": {
-                "maxdict": 1000,
-                "maxarray": 1000,
-                "maxlist": 1000,
-                "maxtuple": 1000,
-                "maxset": 1000,
-                "maxstring": 1000,
-                "maxother": 1000,
-            },
-        },
-    )
+    return cast(F, wrapper)
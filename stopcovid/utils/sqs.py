@@ -0,0 +1,98 @@
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from stopcovid.utils.boto3 import get_boto3_client
+
+# SQS accepts at most 10 entries and 256 KB of message payload per send_message_batch call
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 0.1
+MAX_WORKERS = 8
+
+
+class SQSPublishError(Exception):
+    def __init__(self, queue_name: str, failed: List[dict]) -> None:
+        super().__init__(f"Failed to send {len(failed)} entries to {queue_name}: {failed}")
+        self.queue_name = queue_name
+        self.failed = failed
+
+
+@functools.lru_cache(maxsize=None)
+def get_client() -> Any:
+    # boto3 clients are thread safe, unlike resources, and expensive enough to create that we
+    # keep one for the life of the container
+    return get_boto3_client("sqs")
+
+
+@functools.lru_cache(maxsize=None)
+def get_queue_url(queue_name: str) -> str:
+    return str(get_client().get_queue_url(QueueName=queue_name)["QueueUrl"])
+
+
+def entry_size(entry: Dict[str, Any]) -> int:
+    size = len(entry["MessageBody"].encode("utf-8"))
+    for name, attribute in entry.get("MessageAttributes", {}).items():
+        size += len(name.encode("utf-8")) + len(attribute.get("DataType", "").encode("utf-8"))
+        value = attribute.get("StringValue") or attribute.get("BinaryValue") or ""
+        size += len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+    return size
+
+
+def chunk_entries(entries: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    chunks: List[List[Dict[str, Any]]] = []
+    chunk: List[Dict[str, Any]] = []
+    chunk_bytes = 0
+    for entry in entries:
+        size = entry_size(entry)
+        if chunk and (len(chunk) == MAX_BATCH_ENTRIES or chunk_bytes + size > MAX_BATCH_BYTES):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(entry)
+        chunk_bytes += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _send_chunk(queue_name: str, queue_url: str, entries: List[Dict[str, Any]]) -> List[dict]:
+    # Sends one chunk, retrying only the entries SQS reports as failed for reasons other than
+    # the request itself. Returns the entries that still failed.
+    entries_by_id = {entry["Id"]: entry for entry in entries}
+    pending = entries
+    # sender faults, e.g. an oversized message, would fail the same way again
+    sender_faults: List[dict] = []
+    retryable: List[dict] = []
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            logging.warning(f"Retrying {len(retryable)} entries for {queue_name}: {retryable}")
+            time.sleep(RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+        response = get_client().send_message_batch(QueueUrl=queue_url, Entries=pending)
+        failed = response.get("Failed", [])
+        sender_faults.extend(failure for failure in failed if failure.get("SenderFault"))
+        retryable = [failure for failure in failed if not failure.get("SenderFault")]
+        if not retryable:
+            break
+        pending = [entries_by_id[failure["Id"]] for failure in retryable]
+    return sender_faults + retryable
+
+
+def send_message_batches(queue_name: str, entries: List[Dict[str, Any]]) -> None:
+    # Entries are chunked and the chunks are sent concurrently, so entries in the same FIFO
+    # message group must be combined into one entry by the caller if their order matters.
+    if not entries:
+        return
+    queue_url = get_queue_url(queue_name)
+    chunks = chunk_entries(entries)
+    if len(chunks) == 1:
+        failed = _send_chunk(queue_name, queue_url, chunks[0])
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(chunks))) as executor:
+            results = executor.map(lambda chunk: _send_chunk(queue_name, queue_url, chunk), chunks)
+            failed = [failure for chunk_failed in results for failure in chunk_failed]
+    if failed:
+        raise SQSPublishError(queue_name, failed)
@@ -0,0 +1,48 @@
+import os
+from typing import Any, Optional
+
+from stopcovid.utils.boto3 import get_boto3_client
+
+# A cron that works through time buckets records the bucket it got up to under its sweep name,
+# so its next run starts there rather than at a fixed lookback.
+
+
+class SweepWatermarkRepository:
+    def __init__(self, **kwargs: Any) -> None:
+        self.dynamodb = get_boto3_client("dynamodb", **kwargs)
+        self.stage = os.environ.get("STAGE")
+
+    def _table_name(self) -> str:
+        return f"sweep-watermarks-{self.stage}"
+
+    def fetch_watermark(self, sweep_name: str) -> Optional[int]:
+        response = self.dynamodb.get_item(
+            TableName=self._table_name(),
+            Key={"sweep_name": {"S": sweep_name}},
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return None
+        return int(response["Item"]["bucket"]["N"])
+
+    def save_watermark(self, sweep_name: str, bucket: int) -> None:
+        self.dynamodb.put_item(
+            TableName=self._table_name(),
+            Item={"sweep_name": {"S": sweep_name}, "bucket": {"N": str(bucket)}},
+        )
+
+    def drop_and_recreate_table(self) -> None:
+        if self.stage != "test":
+            raise RuntimeError("Method unsafe to run in non test environment")
+        try:
+            self.dynamodb.delete_table(TableName=self._table_name())
+        except Exception:
+            # Table already does not exist
+            pass
+
+        self.dynamodb.create_table(
+            TableName=self._table_name(),
+            KeySchema=[{"AttributeName": "sweep_name", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "sweep_name", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )